@@ -0,0 +1,27 @@
+# backend.py
+import os
+from storage import RecordFile
+
+# Which storage engine the managers open: "files" keeps every record type in
+# its own struct file (storage.RecordFile), "sqlite" keeps them as tables of
+# one SQLite database (sqlite_store.SqliteTable). Chosen with FRDB_BACKEND or
+# main.py --backend, before the first store is opened; main.py convert copies
+# the data from one to the other.
+BACKEND_ENV = "FRDB_BACKEND"
+BACKENDS = ("files", "sqlite")
+
+name = os.environ.get(BACKEND_ENV) or "files"
+
+
+def select(backend):
+    global name
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}; choose from {', '.join(BACKENDS)}")
+    name = backend
+
+
+def open_store(schema):
+    if name == "sqlite":
+        import sqlite_store
+        return sqlite_store.SqliteTable(schema)
+    return RecordFile(schema)
@@ -0,0 +1,2 @@
+# bench/__init__.py
+# Benchmarks for the storage and report paths: python -m bench --help
@@ -0,0 +1,223 @@
+# bench/__main__.py
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # No resource module (Windows): peak RSS is left out
+    resource = None
+
+# python -m bench [--scales 1000,100000] [--ops add_product,report_full] [--out results.json]
+#
+# Every scale runs in its own child process inside a scratch directory:
+# generate the data, open it (index rebuild included), then time each
+# operation. Results are JSON so runs from two commits can be compared with
+# python -m bench --compare old.json new.json
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCALES = "1000,10000"
+DEFAULT_ITERATIONS = 1000
+DEFAULT_SCAN_ITERATIONS = 3
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an ascending list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure(op, ctx, iterations):
+    prepare, run = op.factory(ctx)
+    times = []
+    for i in range(iterations):
+        if prepare is not None:
+            prepare(i)
+        start = time.perf_counter()
+        run(i)
+        times.append(time.perf_counter() - start)
+    # One more call, untimed, for the peak Python allocation of a single call
+    if prepare is not None:
+        prepare(iterations)
+    tracemalloc.start()
+    run(iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(times)
+    times.sort()
+    latency = {"min": times[0], "mean": total / len(times), "max": times[-1]}
+    for p in PERCENTILES:
+        latency[f"p{p}"] = percentile(times, p)
+    return {
+        "kind": op.kind,
+        "iterations": iterations,
+        "total_s": round(total, 6),
+        "ops_per_s": round(iterations / total, 1) if total else None,
+        "latency_ms": {k: round(v * 1000, 4) for k, v in latency.items()},
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def run_scale(args):
+    # Child process: cwd is already the scratch directory
+    os.environ.pop("FRDB_WRITER_SOCKET", None)
+    sys.path.insert(0, PROJECT_DIR)
+    from bench import datagen, ops
+    import backend
+    import logger
+    import main
+
+    result = {"scale": args.child, "backend": args.backend}
+    start = time.perf_counter()
+    result["records"] = datagen.generate(args.child, args.seed)
+    if args.backend != "files":
+        import sqlite_store
+        sqlite_store.convert(args.backend)
+    backend.select(args.backend)
+    result["generate_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    main.init_files()
+    result["open_s"] = round(time.perf_counter() - start, 3)
+
+    names = [op.name for op in ops.OPERATIONS] if args.ops == "all" else args.ops.split(",")
+    unknown = [name for name in names if name not in ops.BY_NAME]
+    if unknown:
+        print(f"unknown operation(s): {', '.join(unknown)}; choose from {', '.join(ops.BY_NAME)}",
+              file=sys.stderr)
+        return 2
+
+    ctx = ops.Context(args.child, args.seed)
+    result["ops"] = {}
+    for name in names:
+        op = ops.BY_NAME[name]
+        n = args.iterations if op.kind == ops.POINT else args.scan_iterations
+        result["ops"][name] = measure(op, ctx, n)
+        print(f"  {args.child:>10} {name:<20} {result['ops'][name]['latency_ms']['p50']:>10} ms p50",
+              file=sys.stderr)
+    main.checkpoint_all()
+    logger.shutdown()
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result["max_rss_kb"] = rss // 1024 if sys.platform == "darwin" else rss
+    with open(args.result, "w") as f:
+        json.dump(result, f)
+    return 0
+
+
+def _git(*argv):
+    try:
+        out = subprocess.run(["git", "-C", PROJECT_DIR, *argv], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def run_all(args):
+    report = {
+        "meta": {
+            "commit": _git("rev-parse", "--short", "HEAD"),
+            "dirty": bool(_git("status", "--porcelain", "--", ".")),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "iterations": args.iterations,
+            "scan_iterations": args.scan_iterations,
+            "seed": args.seed,
+            "backend": args.backend,
+        },
+        "results": [],
+    }
+    for scale in (int(s) for s in args.scales.split(",")):
+        workdir = args.workdir or tempfile.mkdtemp(prefix=f"frdb-bench-{scale}-")
+        os.makedirs(workdir, exist_ok=True)
+        result_file = os.path.join(workdir, "bench-result.json")
+        cmd = [sys.executable, "-m", "bench", "--child", str(scale), "--result", result_file,
+               "--ops", args.ops, "--iterations", str(args.iterations),
+               "--scan-iterations", str(args.scan_iterations), "--seed", str(args.seed),
+               "--backend", args.backend]
+        print(f"scale {scale} in {workdir}", file=sys.stderr)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [PROJECT_DIR, os.environ.get("PYTHONPATH")])))
+        try:
+            proc = subprocess.run(cmd, cwd=workdir, env=env)
+            if proc.returncode != 0:
+                print(f"scale {scale} failed with exit code {proc.returncode}", file=sys.stderr)
+                return proc.returncode
+            with open(result_file) as f:
+                report["results"].append(json.load(f))
+        finally:
+            if not args.keep and not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+def compare(old_path, new_path):
+    # p50 latency of every operation present in both runs
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+    print(f"{'Scale':>10} {'Operation':<20} {'p50 old ms':>11} {'p50 new ms':>11} {'change':>8}")
+    old_by_scale = {r["scale"]: r for r in old["results"]}
+    for result in new["results"]:
+        base = old_by_scale.get(result["scale"])
+        if base is None:
+            continue
+        for name, stats in result["ops"].items():
+            if name not in base["ops"]:
+                continue
+            a = base["ops"][name]["latency_ms"]["p50"]
+            b = stats["latency_ms"]["p50"]
+            change = f"{(b - a) / a:+.0%}" if a else "-"
+            print(f"{result['scale']:>10} {name:<20} {a:>11.4f} {b:>11.4f} {change:>8}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Storage and report benchmarks")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated product counts (prices are 3x)")
+    parser.add_argument("--ops", default="all", help="comma-separated operations from bench/ops.py (default: all)")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="calls per point operation")
+    parser.add_argument("--scan-iterations", type=int, default=DEFAULT_SCAN_ITERATIONS,
+                        help="calls per full-scan operation (views, reports, log search)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=("files", "sqlite"), default="files",
+                        help="storage engine; sqlite data is converted from the generated files")
+    parser.add_argument("--out", help="write the JSON here instead of stdout")
+    parser.add_argument("--workdir", help="generate the data here and keep it")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directories")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.child is not None:
+        return run_scale(args)
+    return run_all(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
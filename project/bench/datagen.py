@@ -0,0 +1,83 @@
+# bench/datagen.py
+import os
+import random
+import time
+from datetime import datetime
+from schema import PRODUCT, PRICE, PROMOTION, RECORD_ACTIVE, pack_header
+from storage import pad_string
+
+# Synthetic data at a given scale, written straight in the current file
+# format: `scale` products, PRICES_PER_PRODUCT prices each, one promotion
+# per PRODUCTS_PER_PROMOTION products and LOG_LINES_PER_PRODUCT log lines
+# per product (capped at MAX_LOG_LINES). Indexes are left to be rebuilt on
+# first open, as after a restore.
+SIZES = ("S", "M", "L", "XL", "XXL")
+PRICES_PER_PRODUCT = 3
+PRODUCTS_PER_PROMOTION = 100
+LOG_LINES_PER_PRODUCT = 1
+MAX_LOG_LINES = 1_000_000
+WRITE_CHUNK = 65536
+
+NAMES = ("beef", "pork", "chicken", "fish", "veggie", "double", "cheese", "spicy", "bbq", "mushroom")
+
+
+def product_id(i):
+    return f"P{i:08d}"
+
+
+def _write_records(schema, rows, count):
+    # rows: iterable of field tuples without the status byte
+    tmp = f"{schema.filename}.{os.getpid()}.tmp"
+    pack = schema.struct.pack
+    with open(tmp, 'wb') as f:
+        f.write(pack_header(schema, count, 0))
+        buf = bytearray()
+        for fields in rows:
+            buf += pack(RECORD_ACTIVE, *fields)
+            if len(buf) >= WRITE_CHUNK * schema.struct.size:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
+    os.replace(tmp, schema.filename)
+    for name in (schema.index_file, schema.sorted_file) + tuple(schema.group_files or ()):
+        if name and os.path.exists(name):
+            os.remove(name)
+
+
+def _log_lines(count, rng, products):
+    # Ascending timestamps, one second apart, ending now
+    start = int(time.time()) - count
+    actions = ("Add Product ID {}", "Update Product ID {}", "Add Price for Product ID {}, size S",
+               "Update Price for Product ID {}, size M", "Delete Price for Product ID {}, size L")
+    for n in range(count):
+        stamp = datetime.fromtimestamp(start + n).strftime("%Y-%m-%d %H:%M:%S")
+        if n % 50 == 49:
+            yield f"[{stamp}] SYSTEM - Generate Report:  -> OK\n"
+        else:
+            action = actions[n % len(actions)].format(product_id(rng.randrange(products)))
+            yield f"[{stamp}] USER - {action}:  -> OK\n"
+
+
+def generate(scale, seed=0):
+    # Writes every data file and log.txt into the current directory;
+    # returns the number of records of each kind
+    rng = random.Random(seed)
+    promotions = max(1, scale // PRODUCTS_PER_PROMOTION)
+    prices = scale * PRICES_PER_PRODUCT
+
+    _write_records(PROMOTION, ((i, pad_string(f"{i % 50 + 5}% off {rng.choice(NAMES)}", 30))
+                               for i in range(1, promotions + 1)), promotions)
+    _write_records(PRODUCT, ((pad_string(product_id(i), 10),
+                              pad_string(f"{rng.choice(NAMES)} {rng.choice(NAMES)} burger {i}", 30),
+                              rng.randrange(promotions + 1))
+                             for i in range(scale)), scale)
+    # In key order, as a price file kept sorted would hold them
+    sizes = sorted(SIZES[:PRICES_PER_PRODUCT])
+    _write_records(PRICE, ((pad_string(product_id(i), 10), pad_string(size, 10),
+                            round(rng.uniform(1, 30), 2), rng.randrange(1000, 100000), rng.random() < 0.9)
+                           for i in range(scale) for size in sizes), prices)
+
+    log_lines = min(scale * LOG_LINES_PER_PRODUCT, MAX_LOG_LINES)
+    with open("log.txt", "w", encoding="utf-8") as f:
+        f.writelines(_log_lines(log_lines, rng, scale))
+    return {"products": scale, "prices": prices, "promotions": promotions, "log_lines": log_lines}
@@ -0,0 +1,141 @@
+# bench/ops.py
+import contextlib
+import os
+import random
+from collections import namedtuple
+import catalog
+import log_reader
+import main
+import price_manager
+import product_manager
+import sales
+from bench.datagen import product_id
+
+# Non-interactive versions of the menu actions. Every operation is a factory
+# taking the benchmark context and returning (prepare, run): run(i) is timed,
+# prepare(i) (or None) runs untimed before it. Point operations are repeated
+# many times, scans only a few.
+Operation = namedtuple('Operation', 'name kind factory')
+
+POINT = "point"
+SCAN = "scan"
+
+
+class Context:
+    def __init__(self, scale, seed=0):
+        self.scale = scale
+        self.rng = random.Random(seed)
+
+    def product_id(self):
+        return product_id(self.rng.randrange(self.scale))
+
+
+@contextlib.contextmanager
+def _quiet():
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        yield
+
+
+def _lookup_product(ctx):
+    return None, lambda i: product_manager.load_product(ctx.product_id())
+
+
+def _lookup_price(ctx):
+    return None, lambda i: price_manager.load_price(ctx.product_id(), "S")
+
+
+def _price_prefix(ctx):
+    # Drops the last two digits: the prices of up to a hundred products
+    return None, lambda i: price_manager.prices_with_prefix(ctx.product_id()[:7])
+
+
+def _add_product(ctx):
+    return None, lambda i: product_manager.add_product_record(f"N{i:09d}", f"bench burger {i}", 0)
+
+
+def _update_product(ctx):
+    return None, lambda i: product_manager.update_product(ctx.product_id(), f"renamed {i}", 1)
+
+
+def _delete_product(ctx):
+    # Deletes what add_product added
+    return None, lambda i: product_manager.delete_product(f"N{i:09d}")
+
+
+def _add_price(ctx):
+    return None, lambda i: price_manager.add_price_record(product_id(i % ctx.scale), f"B{i}", 9.5, 100, 1)
+
+
+def _update_price(ctx):
+    return None, lambda i: price_manager.update_price(ctx.product_id(), "M", 12.5, 500 + i, 1)
+
+
+def _delete_price(ctx):
+    return None, lambda i: price_manager.delete_price(product_id(i % ctx.scale), f"B{i}")
+
+
+def _sell(ctx):
+    def run(i):
+        try:
+            sales.sell(ctx.product_id(), "S", 1)
+        except sales.SaleError:
+            pass    # not for sale; still a full lookup and check
+    return None, run
+
+
+def _view_products(ctx):
+    def run(i):
+        with _quiet():
+            main.view_products()
+    return None, run
+
+
+def _view_products_cold(ctx):
+    _, run = _view_products(ctx)
+    return lambda i: catalog.clear(), run
+
+
+def _view_prices(ctx):
+    def run(i):
+        with _quiet():
+            main.view_prices()
+    return None, run
+
+
+def _report_full(ctx):
+    return lambda i: main.drop_report_cache(), lambda i: main.generate_report(echo=False)
+
+
+def _report_incremental(ctx):
+    # A few price changes between reports, as in normal use
+    def prepare(i):
+        for _ in range(10):
+            price_manager.update_price(ctx.product_id(), "L", 7.5, i, 1)
+    return prepare, lambda i: main.generate_report(echo=False)
+
+
+def _search_log(ctx):
+    return None, lambda i: sum(1 for _ in log_reader.events_for(pro_id=ctx.product_id()))
+
+
+# In run order; deletes follow the adds they undo
+OPERATIONS = [
+    Operation("lookup_product", POINT, _lookup_product),
+    Operation("lookup_price", POINT, _lookup_price),
+    Operation("price_prefix", POINT, _price_prefix),
+    Operation("add_product", POINT, _add_product),
+    Operation("update_product", POINT, _update_product),
+    Operation("delete_product", POINT, _delete_product),
+    Operation("add_price", POINT, _add_price),
+    Operation("update_price", POINT, _update_price),
+    Operation("delete_price", POINT, _delete_price),
+    Operation("sell", POINT, _sell),
+    Operation("view_products_cold", SCAN, _view_products_cold),
+    Operation("view_products", SCAN, _view_products),
+    Operation("view_prices", SCAN, _view_prices),
+    Operation("report_full", SCAN, _report_full),
+    Operation("report_incremental", SCAN, _report_incremental),
+    Operation("search_log", SCAN, _search_log),
+]
+
+BY_NAME = {op.name: op for op in OPERATIONS}
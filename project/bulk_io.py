@@ -0,0 +1,213 @@
+# bulk_io.py
+import csv
+import json
+import os
+import sys
+import product_manager
+import price_manager
+import promotion_manager
+from product_manager import product_key
+from price_manager import price_key
+from promotion_manager import promotion_key
+from schema import float32_value
+
+KINDS = ("products", "prices", "promotions")
+
+COLUMNS = {
+    "products": ("pro_id", "pro_name", "promotion_id"),
+    "prices": ("pro_id", "pro_size", "pro_price", "pro_stock", "sale_status"),
+    "promotions": ("promotion_id", "promotion_name"),
+}
+
+INT32_MIN = -2**31
+INT32_MAX = 2**31 - 1
+MAX_REPORTED_ERRORS = 20
+
+
+class RowError(ValueError):
+    pass
+
+
+def guess_kind(path):
+    name = os.path.basename(path).lower()
+    for kind in KINDS:
+        if kind[:-1] in name:
+            return kind
+    return None
+
+
+def guess_format(path):
+    return "jsonl" if path.lower().endswith((".jsonl", ".json")) else "csv"
+
+
+def _iter_rows(f, fmt):
+    # Yields (line number, dict) without loading the whole file
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, RowError(f"bad JSON: {e}")
+
+
+# --- Validation (same limits as the record structs; also used by http_api) ---
+
+def text_field(row, field, max_bytes, required=True):
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"{field} is required")
+    if len(value.encode("utf-8")) > max_bytes:
+        raise RowError(f"{field} is longer than {max_bytes} bytes")
+    return value
+
+
+def int_field(row, field, low=INT32_MIN, high=INT32_MAX):
+    try:
+        value = int(str(row.get(field)).strip())
+    except ValueError:
+        raise RowError(f"{field} must be an integer")
+    if not low <= value <= high:
+        raise RowError(f"{field} must be between {low} and {high}")
+    return value
+
+
+def float_field(row, field):
+    try:
+        return float(str(row.get(field)).strip())
+    except ValueError:
+        raise RowError(f"{field} must be a number")
+
+
+def _parse_product(row, keys, context):
+    pro_id = text_field(row, "pro_id", 10)
+    if product_key(pro_id) in keys:
+        raise RowError(f"product {pro_id} already exists")
+    return product_key(pro_id), (pro_id, text_field(row, "pro_name", 30, required=False), int_field(row, "promotion_id"))
+
+
+def _parse_price(row, keys, product_keys):
+    pro_id = text_field(row, "pro_id", 10)
+    pro_size = text_field(row, "pro_size", 10)
+    if product_key(pro_id) not in product_keys:
+        raise RowError(f"product {pro_id} does not exist")
+    key = price_key(pro_id, pro_size)
+    if key in keys:
+        raise RowError(f"price for {pro_id} size {pro_size} already exists")
+    return key, (pro_id, pro_size, float_field(row, "pro_price"), int_field(row, "pro_stock"), int_field(row, "sale_status", 0, 1))
+
+
+def _parse_promotion(row, keys, context):
+    promotion_id = int_field(row, "promotion_id")
+    if promotion_key(promotion_id) in keys:
+        raise RowError(f"promotion {promotion_id} already exists")
+    return promotion_key(promotion_id), (promotion_id, text_field(row, "promotion_name", 30, required=False))
+
+
+IMPORTERS = {
+    "products": (_parse_product, product_manager.get_store, product_manager.add_product_records),
+    "prices": (_parse_price, price_manager.get_store, price_manager.add_price_records),
+    "promotions": (_parse_promotion, promotion_manager.get_store, promotion_manager.add_promotion_records),
+}
+
+
+def import_records(kind, path, fmt=None, skip_invalid=False, err=sys.stderr):
+    # Validates every row first (one pass, keys checked against an in-memory
+    # set), then writes all valid rows with a single append.
+    # Returns (rows added, rows rejected).
+    parse, get_store, add_records = IMPORTERS[kind]
+    keys = get_store().keys()
+    context = product_manager.get_store().keys() if kind == "prices" else None
+
+    valid = []
+    rejected = 0
+    with open(path, newline="", encoding="utf-8") as f:
+        for line_no, row in _iter_rows(f, fmt or guess_format(path)):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError("row is not an object")
+                key, values = parse(row, keys, context)
+            except RowError as e:
+                rejected += 1
+                if rejected <= MAX_REPORTED_ERRORS:
+                    print(f"{path}:{line_no}: {e}", file=err)
+                continue
+            keys.add(key)
+            valid.append(values)
+
+    if rejected and not skip_invalid:
+        return 0, rejected
+    added = add_records(valid) if valid else 0
+    return added, rejected
+
+
+# --- Orders ---
+
+ORDERS_PER_COMMIT = 500
+
+
+def read_orders(path, fmt=None):
+    # Yields (order id, [(pro_id, pro_size, qty), ...]) from a CSV/JSONL file
+    # with pro_id, pro_size, qty and an optional order_id column; consecutive
+    # rows sharing an order_id form one order, rows without one stand alone.
+    # Malformed rows raise RowError naming the line.
+    current_id, lines = None, []
+    with open(path, newline="", encoding="utf-8") as f:
+        for line_no, row in _iter_rows(f, fmt or guess_format(path)):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                if not isinstance(row, dict):
+                    raise RowError("row is not an object")
+                line = (text_field(row, "pro_id", 10), text_field(row, "pro_size", 10), int_field(row, "qty", 1))
+            except RowError as e:
+                raise RowError(f"{path}:{line_no}: {e}")
+            order_id = str(row.get("order_id") or "").strip() or f"line {line_no}"
+            if lines and order_id != current_id:
+                yield current_id, lines
+                lines = []
+            current_id = order_id
+            lines.append(line)
+    if lines:
+        yield current_id, lines
+
+
+# --- Export ---
+
+EXPORTERS = {
+    "products": product_manager.iter_products,
+    "prices": price_manager.iter_prices,
+    "promotions": promotion_manager.iter_promotions,
+}
+
+
+def _iter_export(kind):
+    # Field values of every record, in COLUMNS order
+    for rec in EXPORTERS[kind]():
+        values = tuple(rec)
+        if kind == "prices":
+            values = values[:2] + (float32_value(values[2]),) + values[3:]
+        yield values
+
+
+def export_records(kind, out, fmt="csv"):
+    # Streams records to an open text file; returns the number written
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS[kind])
+        for values in _iter_export(kind):
+            writer.writerow(values)
+            count += 1
+    else:
+        for values in _iter_export(kind):
+            out.write(json.dumps(dict(zip(COLUMNS[kind], values)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
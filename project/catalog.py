@@ -0,0 +1,129 @@
+# catalog.py
+from collections import OrderedDict
+from itertools import islice
+import instrument
+from storage import KEY_OFFSET
+
+# Read-through cache of decoded records, one TableCache per data file. A
+# table remembers the store version it was decoded at (RecordFile.version)
+# and starts over as soon as this process writes the file or another process
+# commits to it, so a hit is never stale. Cached objects are the managers'
+# records.Record types: read-only and slot-only, safe to hand to every caller.
+# Tables larger than `limit` are streamed instead of kept whole, and single
+# lookups are kept in an LRU of at most `limit` entries.
+
+CACHES = {}
+
+
+class TableCache:
+    def __init__(self, name, get_store, decode, limit=None):
+        self.name = name
+        self.get_store = get_store
+        self.decode = decode      # record bytes -> object
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        self._version = None
+        self._whole = False       # _keys holds every record, in file order
+        self._keys = OrderedDict()
+        self._derived = {}
+        CACHES[name] = self
+
+    def _check(self, store):
+        # Call under the store's shared lock. Tables are replaced, never
+        # emptied in place, so a caller still iterating an old one is safe.
+        version = store.version()
+        if version != self._version:
+            self._version = version
+            self._reset()
+
+    def _reset(self):
+        self._whole = False
+        self._keys = OrderedDict()
+        self._derived = {}
+
+    def items(self):
+        # (raw key, object) for every live record in file order: a view of
+        # the cached table, or a one-off generator for a table over the limit
+        store = self.get_store()
+        end = KEY_OFFSET + store.key_size
+        with store.shared():
+            self._check(store)
+            if self._whole:
+                self.hits += 1
+                return self._keys.items()
+            self.misses += 1
+            rows = ((raw[KEY_OFFSET:end], self.decode(raw)) for _, raw in store.iter_raw())
+            if self.limit is not None and store.live_count() > self.limit:
+                return rows
+            with instrument.span(f"catalog.load_{self.name}"):
+                self._keys = dict(rows)
+            if instrument.enabled:
+                instrument.count("records.decoded", len(self._keys))
+                instrument.count("data.bytes_read", len(self._keys) * store.record_size)
+            self._whole = True
+            return self._keys.items()
+
+    def get(self, key):
+        # Object stored under the raw key, or None
+        store = self.get_store()
+        with store.shared():
+            self._check(store)
+            if self._whole:
+                self.hits += 1
+                return self._keys.get(key)
+            if key in self._keys:
+                self.hits += 1
+                self._keys.move_to_end(key)
+                return self._keys[key]
+            self.misses += 1
+            recno = store.find(key)
+            obj = None if recno is None else self.decode(store.read_raw(recno))
+            if instrument.enabled and obj is not None:
+                instrument.count("records.decoded")
+            self._keys[key] = obj
+            if self.limit is not None and len(self._keys) > self.limit:
+                self._keys.popitem(last=False)
+            return obj
+
+    def page(self, offset, limit):
+        # (live records, the objects at offset..offset+limit in file order).
+        # A cached table is sliced; one over the limit is scanned to the page.
+        store = self.get_store()
+        with store.shared():
+            items = self.items()
+            if not self._whole:
+                return store.live_count(), [obj for _, obj in islice(items, offset, offset + limit)]
+            rows = self._derived.get("rows")
+            if rows is None:
+                rows = self._derived["rows"] = list(self._keys.values())
+            return len(rows), rows[offset:offset + limit]
+
+    def derived(self, name, build):
+        # build(items()) cached alongside the table; callers must not modify it
+        store = self.get_store()
+        with store.shared():
+            self._check(store)
+            if name in self._derived:
+                self.hits += 1
+                return self._derived[name]
+            value = build(self.items())
+            self._derived[name] = value
+            return value
+
+    def clear(self):
+        self._version = None
+        self._reset()
+
+    def size(self):
+        return len(self._keys)
+
+
+def stats():
+    # name -> (hits, misses, objects held)
+    return {name: (c.hits, c.misses, c.size()) for name, c in CACHES.items()}
+
+
+def clear():
+    for cache in CACHES.values():
+        cache.clear()
@@ -0,0 +1,81 @@
+# change_journal.py
+import os
+import struct
+import uuid
+import zlib
+
+# Append-only list of record changes since the last report. The header holds
+# a generation token; the report cache remembers the token it was built
+# against, so a replaced or missing journal forces a full rebuild.
+JOURNAL_FILE = "changes.jnl"
+JOURNAL_MAGIC = b'FRJ1'
+JOURNAL_HEADER = struct.Struct('<4s16s')   # magic, generation token
+
+# Past this size the journal starts a new generation instead of growing: the
+# report cache no longer matches it, so the next report is built in full
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+
+# Entry: record type, op, key (padded to 20 bytes), crc32 of the first three fields
+ENTRY = struct.Struct('<cc20sI')
+ENTRY_BODY = struct.Struct('<cc20s')
+
+PRODUCT = b'P'
+PRICE = b'R'
+PROMOTION = b'M'
+
+ADD = b'A'
+UPDATE = b'U'
+DELETE = b'D'
+
+
+def reset():
+    # Start a new generation and return its token
+    token = uuid.uuid4().bytes
+    tmp = f"{JOURNAL_FILE}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, token))
+    os.replace(tmp, JOURNAL_FILE)
+    return token
+
+
+def _append(data):
+    if not os.path.exists(JOURNAL_FILE):
+        reset()
+    with open(JOURNAL_FILE, 'ab') as f:
+        if f.tell() + len(data) <= JOURNAL_MAX_BYTES:
+            f.write(data)
+            return
+    # Nothing needs recording once the cache is out of date
+    reset()
+
+
+def record(rtype, op, key=b''):
+    body = ENTRY_BODY.pack(rtype, op, key)
+    _append(body + struct.pack('<I', zlib.crc32(body)))
+
+
+def record_many(rtype, op, keys):
+    buf = bytearray()
+    for key in keys:
+        body = ENTRY_BODY.pack(rtype, op, key)
+        buf += body + struct.pack('<I', zlib.crc32(body))
+    _append(buf)
+
+
+def read():
+    # Returns (token, [(rtype, op, key), ...]) or None if missing or corrupt
+    if not os.path.exists(JOURNAL_FILE):
+        return None
+    with open(JOURNAL_FILE, 'rb') as f:
+        data = f.read()
+    if len(data) < JOURNAL_HEADER.size or (len(data) - JOURNAL_HEADER.size) % ENTRY.size:
+        return None
+    magic, token = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC:
+        return None
+    entries = []
+    for rtype, op, key, crc in ENTRY.iter_unpack(memoryview(data)[JOURNAL_HEADER.size:]):
+        if zlib.crc32(ENTRY_BODY.pack(rtype, op, key)) != crc:
+            return None
+        entries.append((rtype, op, key))
+    return token, entries
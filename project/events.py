@@ -0,0 +1,284 @@
+# events.py
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+import instrument
+from schema import float32_value
+
+# In-process bus for price and stock events. Writers publish after a price
+# is added or updated and after every sale; each subscriber has its own
+# bounded queue and delivery thread, so a slow or dead subscriber only loses
+# its own events (counted in `dropped`) and never holds up a write. With no
+# subscribers `enabled` is False and the write paths skip the bus entirely.
+#
+# Subscribers are set up from the environment by configure(): FRDB_EVENTS_FILE
+# appends JSON lines to a file, FRDB_EVENTS_SOCKET sends them to a Unix
+# socket (main.py watch listens on one). Code in the same process can also
+# subscribe(CallbackSubscriber(func)).
+EVENTS_FILE_ENV = "FRDB_EVENTS_FILE"
+EVENTS_SOCKET_ENV = "FRDB_EVENTS_SOCKET"
+THRESHOLD_ENV = "FRDB_STOCK_THRESHOLD"
+EVENTS_SOCKET = "events.sock"
+
+QUEUE_SIZE = 10_000
+DELIVER_BATCH = 256
+CLOSE_TIMEOUT = 5.0     # seconds a subscriber gets to drain at shutdown
+
+# Stock below this counts as low
+STOCK_THRESHOLD = 5
+
+PRICE_CHANGED = "price_changed"          # old is None for a new price
+SALE_STATUS_CHANGED = "sale_status_changed"
+STOCK_LOW = "stock_low"                  # fell below STOCK_THRESHOLD
+STOCK_OUT = "out_of_stock"               # fell to zero
+STOCK_RESTOCKED = "stock_restocked"      # back to STOCK_THRESHOLD or more
+
+Event = namedtuple("Event", "type time pro_id pro_size old new")
+
+enabled = False
+_subscribers = ()       # replaced, never changed in place, so publish needs no lock
+_lock = threading.Lock()
+
+
+# --- Subscribers ---
+
+class Subscriber(ABC):
+    # Base class: deliver() gets the events in publishing order, a batch at
+    # a time, on the subscriber's own thread
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=f"events-{type(self).__name__}", daemon=True)
+        self._thread.start()
+
+    @abstractmethod
+    def deliver(self, events):
+        pass
+
+    def close(self):
+        pass
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            if instrument.enabled:
+                instrument.count("events.dropped")
+
+    def stop(self, timeout=CLOSE_TIMEOUT):
+        # Delivers what is queued, then ends the thread
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < DELIVER_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if batch:
+                try:
+                    self.deliver(batch)
+                    self.delivered += len(batch)
+                except Exception:
+                    self.errors += 1
+                    self.dropped += len(batch)
+            if done:
+                self.close()
+                return
+
+
+class CallbackSubscriber(Subscriber):
+    def __init__(self, func, maxsize=QUEUE_SIZE):
+        self.func = func
+        super().__init__(maxsize)
+
+    def deliver(self, events):
+        for event in events:
+            self.func(event)
+
+
+class FileSink(Subscriber):
+    # One JSON object per line, appended
+    def __init__(self, path, maxsize=QUEUE_SIZE):
+        self.path = path
+        self._f = None
+        super().__init__(maxsize)
+
+    def deliver(self, events):
+        if self._f is None:
+            self._f = open(self.path, "a", encoding="utf-8")
+        self._f.write("".join(to_json(event) + "\n" for event in events))
+        self._f.flush()
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class SocketSink(Subscriber):
+    # JSON lines over a Unix stream socket. While nobody listens the events
+    # are dropped; the next batch tries to connect again.
+    def __init__(self, path, maxsize=QUEUE_SIZE):
+        self.path = path
+        self._sock = None
+        super().__init__(maxsize)
+
+    def deliver(self, events):
+        data = "".join(to_json(event) + "\n" for event in events).encode("utf-8")
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(self.path)
+            self._sock.sendall(data)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def subscribe(subscriber):
+    global enabled, _subscribers
+    with _lock:
+        _subscribers += (subscriber,)
+        enabled = True
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    global enabled, _subscribers
+    with _lock:
+        _subscribers = tuple(s for s in _subscribers if s is not subscriber)
+        enabled = bool(_subscribers)
+    subscriber.stop()
+
+
+def configure():
+    # Subscribers named in the environment; call once at startup
+    global STOCK_THRESHOLD
+    if os.environ.get(THRESHOLD_ENV):
+        STOCK_THRESHOLD = int(os.environ[THRESHOLD_ENV])
+    if os.environ.get(EVENTS_FILE_ENV):
+        subscribe(FileSink(os.environ[EVENTS_FILE_ENV]))
+    if os.environ.get(EVENTS_SOCKET_ENV):
+        subscribe(SocketSink(os.environ[EVENTS_SOCKET_ENV]))
+
+
+def shutdown():
+    # Lets every subscriber deliver what is queued
+    for subscriber in _subscribers:
+        unsubscribe(subscriber)
+
+
+# --- Publishing ---
+
+def publish(event):
+    if instrument.enabled:
+        instrument.count("events.published")
+    for subscriber in _subscribers:
+        subscriber.offer(event)
+
+
+def price_written(pro_id, pro_size, old, pro_price, pro_stock, sale_status):
+    # After a price was added (old is None) or updated (old: the record
+    # before the write). Call only when `enabled`.
+    now = time.time()
+    new_price = float32_value(pro_price)
+    old_price = None if old is None else float32_value(old.pro_price)
+    if new_price != old_price:
+        publish(Event(PRICE_CHANGED, now, pro_id, pro_size, old_price, new_price))
+    if old is not None and old.sale_status != sale_status:
+        publish(Event(SALE_STATUS_CHANGED, now, pro_id, pro_size, old.sale_status, sale_status))
+    stock_changed(pro_id, pro_size, None if old is None else old.pro_stock, pro_stock, now)
+
+
+def stock_changed(pro_id, pro_size, old, new, now=None):
+    # old is None for a new price. Only crossings of the threshold (or of
+    # zero) are events, not every sale.
+    was_low = old is not None and old < STOCK_THRESHOLD
+    if new <= 0 and (old is None or old > 0):
+        kind = STOCK_OUT
+    elif new < STOCK_THRESHOLD and not was_low:
+        kind = STOCK_LOW
+    elif new >= STOCK_THRESHOLD and was_low:
+        kind = STOCK_RESTOCKED
+    else:
+        return
+    publish(Event(kind, time.time() if now is None else now, pro_id, pro_size, old, new))
+
+
+# --- Listening ---
+
+class _ListenHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                event = from_json(line)
+            except (ValueError, TypeError):
+                continue
+            with self.server.lock:
+                self.server.on_event(event)
+
+
+class EventListener(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # The other end of SocketSink: takes events from any number of
+    # processes and hands them to on_event(event) one at a time
+    daemon_threads = True
+
+    def __init__(self, path, on_event):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _ListenHandler)
+        self.path = path
+        self.on_event = on_event
+        self.lock = threading.Lock()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# --- Formatting ---
+
+def to_json(event):
+    return json.dumps(event._asdict(), ensure_ascii=False)
+
+
+def from_json(line):
+    return Event(**json.loads(line))
+
+
+def describe(event):
+    what = {
+        PRICE_CHANGED: (f"new price {event.new}" if event.old is None
+                        else f"price {event.old} -> {event.new}"),
+        SALE_STATUS_CHANGED: "now for sale" if event.new == 1 else "no longer for sale",
+        STOCK_LOW: f"stock low: {event.new} left",
+        STOCK_OUT: "out of stock",
+        STOCK_RESTOCKED: f"restocked: {event.new} in stock",
+    }.get(event.type, f"{event.type} {event.old} -> {event.new}")
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.time))
+    return f"[{stamp}] {event.pro_id} {event.pro_size}: {what}"
@@ -0,0 +1,268 @@
+# hash_index.py
+import os
+import struct
+import threading
+import zlib
+
+# Sidecar hash index: fixed-width key -> record number inside a .dat file.
+# File layout: header(capacity, used slots, data record count) followed by
+# `capacity` slots of (state, key, record number). Open addressing with
+# linear probing, so a lookup is normally one seek + one read.
+INDEX_HEADER = struct.Struct('<III')
+
+SLOT_EMPTY = 0
+SLOT_USED = 1
+SLOT_DELETED = 2
+
+MIN_CAPACITY = 64
+MAX_LOAD = 0.7
+
+
+class HashIndex:
+    def __init__(self, filename, key_size):
+        self.filename = filename
+        self.key_size = key_size
+        self.slot = struct.Struct(f'<B{key_size}sI')
+        self.capacity = 0
+        self.used = 0          # USED + DELETED slots, drives the load factor
+        self.data_count = 0    # number of records in the .dat file when last synced
+        self._f = None
+        self._io = threading.Lock()   # readers on several threads share _f
+
+    def open(self):
+        # False if the index file is missing or damaged (caller rebuilds it)
+        if self._f is not None:
+            return True
+        if not os.path.exists(self.filename):
+            return False
+        f = open(self.filename, 'r+b')
+        header = f.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            f.close()
+            return False
+        capacity, used, data_count = INDEX_HEADER.unpack(header)
+        expected = INDEX_HEADER.size + capacity * self.slot.size
+        if capacity == 0 or os.fstat(f.fileno()).st_size != expected:
+            f.close()
+            return False
+        self._f = f
+        self.capacity, self.used, self.data_count = capacity, used, data_count
+        return True
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def _read_slot(self, i):
+        with self._io:
+            self._f.seek(INDEX_HEADER.size + i * self.slot.size)
+            data = self._f.read(self.slot.size)
+        return self.slot.unpack(data)
+
+    def _write_slot(self, i, state, key, recno):
+        self._f.seek(INDEX_HEADER.size + i * self.slot.size)
+        self._f.write(self.slot.pack(state, key, recno))
+
+    def _write_header(self):
+        self._f.seek(0)
+        self._f.write(INDEX_HEADER.pack(self.capacity, self.used, self.data_count))
+
+    def _probe(self, key):
+        # Returns (slot holding key, its record number, first reusable slot, reusable slot is empty)
+        i = zlib.crc32(key) % self.capacity
+        free = None
+        free_empty = False
+        for _ in range(self.capacity):
+            state, k, recno = self._read_slot(i)
+            if state == SLOT_EMPTY:
+                if free is None:
+                    free, free_empty = i, True
+                return None, None, free, free_empty
+            if state == SLOT_DELETED:
+                if free is None:
+                    free = i
+            elif k == key:
+                return i, recno, free, free_empty
+            i = (i + 1) % self.capacity
+        return None, None, free, free_empty
+
+    def lookup(self, key):
+        _, recno, _, _ = self._probe(key)
+        return recno
+
+    def insert(self, key, recno):
+        pos, _, _, _ = self._probe(key)
+        if pos is not None:
+            self._write_slot(pos, SLOT_USED, key, recno)
+            return
+        if self.used + 1 > self.capacity * MAX_LOAD:
+            self._grow()
+        _, _, free, free_empty = self._probe(key)
+        self._write_slot(free, SLOT_USED, key, recno)
+        if free_empty:
+            self.used += 1
+            self._write_header()
+
+    def remove(self, key):
+        pos, _, _, _ = self._probe(key)
+        if pos is None:
+            return False
+        self._write_slot(pos, SLOT_DELETED, key, 0)
+        return True
+
+    def set_data_count(self, count):
+        self.data_count = count
+        self._write_header()
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+
+    def entries(self):
+        with self._io:
+            self._f.seek(INDEX_HEADER.size)
+            data = self._f.read(self.capacity * self.slot.size)
+        return [(k, recno) for state, k, recno in self.slot.iter_unpack(data) if state == SLOT_USED]
+
+    def _grow(self):
+        self.rebuild(self.entries(), self.data_count)
+
+    def rebuild(self, entries, data_count):
+        entries = list(entries)
+        capacity = MIN_CAPACITY
+        while capacity * MAX_LOAD < len(entries) + 1:
+            capacity *= 2
+
+        table = [None] * capacity
+        used = 0
+        for key, recno in entries:
+            i = zlib.crc32(key) % capacity
+            while table[i] is not None and table[i][0] != key:
+                i = (i + 1) % capacity
+            if table[i] is None:
+                used += 1
+            table[i] = (key, recno)
+
+        empty = self.slot.pack(SLOT_EMPTY, b'', 0)
+        buf = bytearray(INDEX_HEADER.pack(capacity, used, data_count))
+        for entry in table:
+            buf += empty if entry is None else self.slot.pack(SLOT_USED, entry[0], entry[1])
+
+        self.close()
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp, self.filename)
+        self.open()
+
+
+# Postings node: record number, next node + 1 (0 ends the chain)
+POSTING = struct.Struct('<II')
+
+
+class GroupIndex:
+    # Secondary index: key prefix -> every record number carrying it.
+    # A HashIndex maps the prefix to the newest node of a linked list kept in
+    # a postings file, so listing one group touches only its own k nodes.
+    # Unlinked nodes are left behind until the next rebuild.
+    def __init__(self, heads_file, postings_file, key_size):
+        self.heads = HashIndex(heads_file, key_size)
+        self.postings_file = postings_file
+        self.key_size = key_size
+        self._f = None
+        self._io = threading.Lock()
+
+    def open(self):
+        if self._f is not None:
+            return True
+        if not self.heads.open() or not os.path.exists(self.postings_file):
+            self.heads.close()
+            return False
+        self._f = open(self.postings_file, 'r+b')
+        return True
+
+    def close(self):
+        self.heads.close()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    @property
+    def data_count(self):
+        return self.heads.data_count
+
+    def set_data_count(self, count):
+        self.heads.set_data_count(count)
+
+    def flush(self):
+        self.heads.flush()
+        if self._f is not None:
+            self._f.flush()
+
+    def _read_node(self, node):
+        with self._io:
+            self._f.seek(node * POSTING.size)
+            data = self._f.read(POSTING.size)
+        return POSTING.unpack(data)
+
+    def _write_node(self, node, recno, nxt):
+        self._f.seek(node * POSTING.size)
+        self._f.write(POSTING.pack(recno, nxt))
+
+    def lookup(self, key):
+        # Record numbers of the group in file order
+        recnos = []
+        head = self.heads.lookup(key)
+        nxt = head + 1 if head is not None else 0
+        while nxt:
+            recno, nxt = self._read_node(nxt - 1)
+            recnos.append(recno)
+        # Chains are newest first, and a re-keyed record joins at the head
+        recnos.sort()
+        return recnos
+
+    def insert(self, key, recno):
+        head = self.heads.lookup(key)
+        self._f.seek(0, os.SEEK_END)
+        node = self._f.tell() // POSTING.size
+        self._f.write(POSTING.pack(recno, head + 1 if head is not None else 0))
+        self.heads.insert(key, node)
+
+    def remove(self, key, recno):
+        head = self.heads.lookup(key)
+        prev = None
+        node = head
+        while node is not None:
+            node_recno, nxt = self._read_node(node)
+            if node_recno == recno:
+                if prev is None:
+                    if nxt:
+                        self.heads.insert(key, nxt - 1)
+                    else:
+                        self.heads.remove(key)
+                else:
+                    prev_recno, _ = self._read_node(prev)
+                    self._write_node(prev, prev_recno, nxt)
+                return True
+            prev, node = node, (nxt - 1 if nxt else None)
+        return False
+
+    def rebuild(self, entries, data_count):
+        # entries: (key, record number) in file order
+        self.close()
+        heads = {}
+        buf = bytearray()
+        for node, (key, recno) in enumerate(entries):
+            prev = heads.get(key)
+            buf += POSTING.pack(recno, prev + 1 if prev is not None else 0)
+            heads[key] = node
+        tmp = f"{self.postings_file}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp, self.postings_file)
+        self.heads.rebuild(heads.items(), data_count)
+        self.open()
+
+    def groups(self):
+        return {key: self.lookup(key) for key, _ in self.heads.entries()}
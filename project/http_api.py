@@ -0,0 +1,609 @@
+# http_api.py
+import asyncio
+import json
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+import instrument
+import price_manager
+import product_manager
+import promotion_manager
+import report
+import sales
+import writer
+from bulk_io import float_field, int_field, text_field
+from logger import log_event
+from maintenance import STORES, maybe_compact
+from schema import float32_value
+from storage import ConflictError
+
+# Local HTTP/JSON API for POS clients. One asyncio loop serves every
+# connection (HTTP/1.1 keep-alive; requests on one connection are answered
+# in order). Reads run on a few threads against the managers' catalog
+# caches, so all clients share one warm copy of the tables; on the files
+# backend they read in parallel under one shared lock per store, on SQLite
+# they take turns on the one connection (sqlite_store.py). Writes are
+# queued and applied by a single thread in batches, each batch under one
+# exclusive lock on every store and one group commit, as the writer daemon
+# does. Listings are paged with ?offset=&limit=.
+API_HOST = "127.0.0.1"
+API_PORT = 8080
+READ_THREADS = 4
+WRITE_BATCH = writer.BATCH_SIZE
+KEEPALIVE_TIMEOUT = 30      # seconds an idle connection is kept open
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+JSON_TYPE = "application/json"
+TEXT_TYPE = "text/plain; charset=utf-8"
+
+Request = namedtuple("Request", "method path query version headers body")
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _status_of(e):
+    if isinstance(e, ApiError):
+        return e.status
+    if isinstance(e, (ConflictError, sales.SaleError)):
+        return 409
+    if isinstance(e, ValueError):
+        return 400
+    return 500
+
+
+# --- Routing ---
+
+# (method, path pattern, handler, kind). Read handlers take (query, *path
+# parts) and return (status, payload); they run on the reader threads. Write
+# handlers take (body, *path parts), check the body on the event loop and
+# return (func, args) to queue; func runs inside a write batch and returns
+# (status, payload).
+ROUTES = []
+
+
+def route(method, pattern, kind="read"):
+    def register(handler):
+        ROUTES.append((method, re.compile(pattern), handler, kind))
+        return handler
+    return register
+
+
+def _match(method, path):
+    allowed = False
+    for route_method, pattern, handler, kind in ROUTES:
+        m = pattern.fullmatch(path)
+        if m is None:
+            continue
+        if route_method == method:
+            return handler, kind, [unquote(part) for part in m.groups()]
+        allowed = True
+    if allowed:
+        raise ApiError(405, f"{method} is not allowed on {path}")
+    raise ApiError(404, f"no such resource {path}")
+
+
+# --- Encoding and request parameters ---
+
+def _product(p):
+    return p._asdict()
+
+
+def _price(p):
+    d = p._asdict()
+    d["pro_price"] = float32_value(p.pro_price)
+    return d
+
+
+def _promotion(p):
+    return p._asdict()
+
+
+def _encode(payload):
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _query_int(query, name, default):
+    value = query.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be an integer")
+    if value < 0:
+        raise ApiError(400, f"{name} must not be negative")
+    return value
+
+
+def _paging(query):
+    return _query_int(query, "offset", 0), min(_query_int(query, "limit", PAGE_SIZE), MAX_PAGE_SIZE)
+
+
+def _page(total, items, offset, limit):
+    return {"items": items, "total": total, "offset": offset, "limit": limit,
+            "next": offset + limit if offset + limit < total else None}
+
+
+def _promotion_id(text):
+    try:
+        return int(text)
+    except ValueError:
+        raise ApiError(404, f"promotion {text} not found")
+
+
+def _fields(body):
+    # The JSON object sent as the request body
+    try:
+        row = json.loads(body or b"{}")
+    except ValueError as e:
+        raise ApiError(400, f"bad JSON: {e}")
+    if not isinstance(row, dict):
+        raise ApiError(400, "the body must be a JSON object")
+    return row
+
+
+def _optional(row, field, parse, *args):
+    # Fields left out (or null) in an update keep their current value
+    return None if row.get(field) is None else parse(row, field, *args)
+
+
+def _keep(value, current):
+    return current if value is None else value
+
+
+# --- Products ---
+
+@route("GET", r"/products")
+def list_products(query):
+    offset, limit = _paging(query)
+    total, products = product_manager.products_page(offset, limit)
+    return 200, _page(total, [_product(p) for p in products], offset, limit)
+
+
+@route("GET", r"/products/([^/]+)")
+def get_product(query, pro_id):
+    product = product_manager.load_product(pro_id)
+    if product is None:
+        raise ApiError(404, f"product {pro_id} not found")
+    return 200, _product(product)
+
+
+@route("GET", r"/products/([^/]+)/prices")
+def get_prices_of_product(query, pro_id):
+    if product_manager.load_product(pro_id) is None:
+        raise ApiError(404, f"product {pro_id} not found")
+    return 200, {"items": [_price(p) for p in price_manager.prices_of_product(pro_id)]}
+
+
+@route("POST", r"/products", "write")
+def post_product(body):
+    row = _fields(body)
+    return _add_product, (text_field(row, "pro_id", 10), text_field(row, "pro_name", 30, required=False),
+                          int_field(row, "promotion_id"))
+
+
+def _add_product(pro_id, pro_name, promotion_id):
+    if product_manager.find_product(pro_id) is not None:
+        raise ApiError(409, f"product {pro_id} already exists")
+    product_manager.add_product_record(pro_id, pro_name, promotion_id)
+    log_event("USER", f"Add Product ID {pro_id}")
+    return 201, _product(product_manager.load_product(pro_id))
+
+
+@route("PUT", r"/products/([^/]+)", "write")
+def put_product(body, pro_id):
+    row = _fields(body)
+    return _update_product, (pro_id, _optional(row, "pro_name", text_field, 30, False),
+                             _optional(row, "promotion_id", int_field))
+
+
+def _update_product(pro_id, pro_name, promotion_id):
+    product = product_manager.load_product(pro_id)
+    if product is None:
+        raise ApiError(404, f"product {pro_id} not found")
+    product_manager.update_product(pro_id, _keep(pro_name, product.pro_name),
+                                   _keep(promotion_id, product.promotion_id))
+    log_event("USER", f"Update Product ID {pro_id}")
+    return 200, _product(product_manager.load_product(pro_id))
+
+
+@route("DELETE", r"/products/([^/]+)", "write")
+def delete_product(body, pro_id):
+    return _delete_product, (pro_id,)
+
+
+def _delete_product(pro_id):
+    if not product_manager.delete_product(pro_id):
+        raise ApiError(404, f"product {pro_id} not found")
+    log_event("USER", f"Delete Product ID {pro_id}")
+    removed = price_manager.delete_prices_of_product(pro_id)
+    log_event("SYSTEM", f"Delete all prices of deleted product ID {pro_id}")
+    return 200, {"deleted": pro_id, "prices_deleted": removed}
+
+
+# --- Prices ---
+
+@route("GET", r"/prices")
+def list_prices(query):
+    # ?prefix= narrows the listing to product IDs starting with it, in key order
+    offset, limit = _paging(query)
+    if "prefix" in query:
+        prices = price_manager.prices_with_prefix(query["prefix"])
+        total, prices = len(prices), prices[offset:offset + limit]
+    else:
+        total, prices = price_manager.prices_page(offset, limit)
+    return 200, _page(total, [_price(p) for p in prices], offset, limit)
+
+
+@route("GET", r"/prices/([^/]+)/([^/]+)")
+def get_price(query, pro_id, pro_size):
+    price = price_manager.load_price(pro_id, pro_size)
+    if price is None:
+        raise ApiError(404, f"price of {pro_id} size {pro_size} not found")
+    return 200, _price(price)
+
+
+@route("POST", r"/prices", "write")
+def post_price(body):
+    row = _fields(body)
+    return _add_price, (text_field(row, "pro_id", 10), text_field(row, "pro_size", 10),
+                        float_field(row, "pro_price"), int_field(row, "pro_stock"),
+                        int_field(row, "sale_status", 0, 1))
+
+
+def _add_price(pro_id, pro_size, pro_price, pro_stock, sale_status):
+    if product_manager.find_product(pro_id) is None:
+        raise ApiError(404, f"product {pro_id} does not exist; add the product first")
+    if price_manager.find_price(pro_id, pro_size) is not None:
+        raise ApiError(409, f"price of {pro_id} size {pro_size} already exists")
+    price_manager.add_price_record(pro_id, pro_size, pro_price, pro_stock, sale_status)
+    log_event("USER", f"Add Price for Product ID {pro_id}, size {pro_size}")
+    return 201, _price(price_manager.load_price(pro_id, pro_size))
+
+
+@route("PUT", r"/prices/([^/]+)/([^/]+)", "write")
+def put_price(body, pro_id, pro_size):
+    row = _fields(body)
+    return _update_price, (pro_id, pro_size, _optional(row, "pro_price", float_field),
+                           _optional(row, "pro_stock", int_field), _optional(row, "sale_status", int_field, 0, 1))
+
+
+def _update_price(pro_id, pro_size, pro_price, pro_stock, sale_status):
+    price = price_manager.load_price(pro_id, pro_size)
+    if price is None:
+        raise ApiError(404, f"price of {pro_id} size {pro_size} not found")
+    price_manager.update_price(pro_id, pro_size, _keep(pro_price, price.pro_price),
+                               _keep(pro_stock, price.pro_stock), _keep(sale_status, price.sale_status))
+    log_event("USER", f"Update Price Product ID {pro_id} Size {pro_size}")
+    return 200, _price(price_manager.load_price(pro_id, pro_size))
+
+
+@route("DELETE", r"/prices/([^/]+)/([^/]+)", "write")
+def delete_price(body, pro_id, pro_size):
+    return _delete_price, (pro_id, pro_size)
+
+
+def _delete_price(pro_id, pro_size):
+    if not price_manager.delete_price(pro_id, pro_size):
+        raise ApiError(404, f"price of {pro_id} size {pro_size} not found")
+    log_event("USER", f"Delete Price Product ID {pro_id} Size {pro_size}")
+    return 200, {"deleted": [pro_id, pro_size]}
+
+
+# --- Promotions ---
+
+@route("GET", r"/promotions")
+def list_promotions(query):
+    offset, limit = _paging(query)
+    total, promotions = promotion_manager.promotions_page(offset, limit)
+    return 200, _page(total, [_promotion(p) for p in promotions], offset, limit)
+
+
+@route("GET", r"/promotions/([^/]+)")
+def get_promotion(query, promotion_id):
+    promotion = promotion_manager.load_promotion(_promotion_id(promotion_id))
+    if promotion is None:
+        raise ApiError(404, f"promotion {promotion_id} not found")
+    return 200, _promotion(promotion)
+
+
+@route("POST", r"/promotions", "write")
+def post_promotion(body):
+    row = _fields(body)
+    return _add_promotion, (int_field(row, "promotion_id"), text_field(row, "promotion_name", 30, required=False))
+
+
+def _add_promotion(promotion_id, promotion_name):
+    if promotion_manager.find_promotion(promotion_id) is not None:
+        raise ApiError(409, f"promotion {promotion_id} already exists")
+    promotion_manager.add_promotion_record(promotion_id, promotion_name)
+    log_event("USER", f"Add Promotion ID {promotion_id}")
+    return 201, _promotion(promotion_manager.load_promotion(promotion_id))
+
+
+@route("PUT", r"/promotions/([^/]+)", "write")
+def put_promotion(body, promotion_id):
+    row = _fields(body)
+    return _update_promotion, (_promotion_id(promotion_id), _optional(row, "promotion_name", text_field, 30, False))
+
+
+def _update_promotion(promotion_id, promotion_name):
+    promotion = promotion_manager.load_promotion(promotion_id)
+    if promotion is None:
+        raise ApiError(404, f"promotion {promotion_id} not found")
+    promotion_manager.update_promotion(promotion_id, _keep(promotion_name, promotion.promotion_name))
+    log_event("USER", f"Update Promotion ID {promotion_id}")
+    return 200, _promotion(promotion_manager.load_promotion(promotion_id))
+
+
+@route("DELETE", r"/promotions/([^/]+)", "write")
+def delete_promotion(body, promotion_id):
+    return _delete_promotion, (_promotion_id(promotion_id),)
+
+
+def _delete_promotion(promotion_id):
+    if not promotion_manager.delete_promotion(promotion_id):
+        raise ApiError(404, f"promotion {promotion_id} not found")
+    log_event("USER", f"Delete Promotion ID {promotion_id}")
+    return 200, {"deleted": promotion_id}
+
+
+# --- Selling ---
+
+@route("GET", r"/stock/([^/]+)/([^/]+)")
+def get_stock(query, pro_id, pro_size):
+    price = price_manager.load_price(pro_id, pro_size)
+    if price is None:
+        raise ApiError(404, f"price of {pro_id} size {pro_size} not found")
+    return 200, {"pro_id": price.pro_id, "pro_size": price.pro_size,
+                 "pro_stock": price.pro_stock, "sale_status": price.sale_status}
+
+
+@route("POST", r"/sell", "write")
+def post_sell(body):
+    # {"pro_id", "pro_size", "qty"} for one item, or {"lines": [...]} of
+    # them for an order that is sold whole or not at all
+    row = _fields(body)
+    lines = row.get("lines", [row])
+    if not isinstance(lines, list) or not lines or not all(isinstance(line, dict) for line in lines):
+        raise ApiError(400, "lines must be a non-empty list of objects")
+    return _sell, ([(text_field(line, "pro_id", 10), text_field(line, "pro_size", 10),
+                     int_field(line, "qty", 1)) for line in lines],)
+
+
+def _sell(lines):
+    try:
+        left = sales.sell_batch(lines)
+    except sales.SaleError as e:
+        for pro_id, pro_size, _ in lines:
+            log_event("USER", f"Sell Product ID {pro_id} size {pro_size}", "REJECTED", str(e))
+        raise
+    for (pro_id, pro_size, qty), stock in zip(lines, left):
+        log_event("USER", f"Sell Product ID {pro_id} size {pro_size}", detail=f"qty {qty}, {stock} left")
+    return 200, {"stock_left": left}
+
+
+@route("GET", r"/report", "report")
+def get_report(query):
+    # Writes the report file and names it; it is sent back as plain text
+    report.generate_report(echo=False)
+    return report.REPORT_FILE
+
+
+# --- HTTP ---
+
+async def _read_request(reader):
+    # The next request on the connection, or None once the client is done
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(400, "malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ApiError(431, "too many headers")
+        name, sep, value = line.decode("latin-1").partition(":")
+        if not sep:
+            raise ApiError(400, "malformed header line")
+        headers[name.strip().lower()] = value.strip()
+    if "transfer-encoding" in headers:
+        raise ApiError(411, "send the body with a Content-Length")
+    length = headers.get("content-length", "0")
+    if not length.isdigit():
+        raise ApiError(400, "bad Content-Length")
+    if int(length) > MAX_BODY:
+        raise ApiError(413, f"bodies are limited to {MAX_BODY} bytes")
+    body = await reader.readexactly(int(length))
+    url = urlsplit(target)
+    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+    return Request(method.upper(), url.path.rstrip("/") or "/", query, version.upper(), headers, body)
+
+
+def _keep_alive(request):
+    connection = request.headers.get("connection", "").lower()
+    if request.version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+
+def _head(status, length, content_type, keep_alive):
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {length}"]
+    if keep_alive:
+        lines += ["Connection: keep-alive", f"Keep-Alive: timeout={KEEPALIVE_TIMEOUT}"]
+    else:
+        lines.append("Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _send(out, status, body, keep_alive, content_type=JSON_TYPE):
+    out.write(_head(status, len(body), content_type, keep_alive) + body)
+    await out.drain()
+
+
+def _run_read(handler, query, params):
+    # On a reader thread: the handler and the JSON encoding of its answer
+    status, payload = handler(query, *params)
+    return status, _encode(payload)
+
+
+class ApiServer:
+    def __init__(self, host=API_HOST, port=API_PORT, stores=(), read_threads=READ_THREADS,
+                 batch_size=WRITE_BATCH, sync=False):
+        self.host = host
+        self.port = port
+        self.stores = list(stores)
+        self.batch_size = batch_size
+        self.sync = sync
+        self.requests = 0
+        self.batches = 0
+        self.applied = 0
+        self._readers = ThreadPoolExecutor(read_threads, thread_name_prefix="api-read")
+        # One thread, so batches are applied one after another
+        self._writer = ThreadPoolExecutor(1, thread_name_prefix="api-write")
+        self._loop = None
+        self._pending = None
+        self._report_lock = None
+        self._reports_started = 0
+        self._reports_done = 0
+        self._report_path = None
+
+    def run(self):
+        # Blocks until interrupted; mutations run in this process
+        with writer.serving():
+            try:
+                asyncio.run(self._serve())
+            finally:
+                self._readers.shutdown()
+                self._writer.shutdown()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._pending = asyncio.Queue()
+        self._report_lock = asyncio.Lock()
+        server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        apply = asyncio.create_task(self._write_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            apply.cancel()
+
+    async def _serve_connection(self, reader, out):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except ApiError as e:
+                    await _send(out, e.status, _encode({"error": str(e)}), False)
+                    break
+                except ValueError:
+                    # A line longer than the stream's limit
+                    await _send(out, 400, _encode({"error": "request line or header too long"}), False)
+                    break
+                if request is None or not await self._dispatch(request, out):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            out.close()
+
+    async def _dispatch(self, request, out):
+        # Answers one request; returns True if the connection stays open
+        keep_alive = _keep_alive(request)
+        self.requests += 1
+        try:
+            handler, kind, params = _match(request.method, request.path)
+            if kind == "report":
+                await self._send_report(handler, request.query, out, keep_alive)
+                return keep_alive
+            if kind == "read":
+                status, body = await self._loop.run_in_executor(self._readers, _run_read, handler,
+                                                                request.query, params)
+            else:
+                func, args = handler(request.body, *params)
+                status, payload = await self._submit(func, args)
+                body = _encode(payload)
+        except Exception as e:
+            status = _status_of(e)
+            if status == 500:
+                log_event("SYSTEM", f"API {request.method} {request.path}", "ERROR", repr(e))
+            body = _encode({"error": str(e) if status != 500 else "internal error"})
+        await _send(out, status, body, keep_alive)
+        return keep_alive
+
+    # --- Writes ---
+
+    def _submit(self, func, args):
+        future = self._loop.create_future()
+        self._pending.put_nowait((func, args, future))
+        return future
+
+    async def _write_loop(self):
+        # Everything queued while a batch is being applied forms the next batch
+        while True:
+            batch = [await self._pending.get()]
+            while len(batch) < self.batch_size and not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+            calls = [(func, args, {}) for func, args, _ in batch]
+            try:
+                results = await self._loop.run_in_executor(self._writer, writer.apply_batch, self.stores,
+                                                           calls, sales.group_commit, self.sync)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            self.batches += 1
+            self.applied += len(batch)
+            if instrument.enabled:
+                instrument.count("api.write_batches")
+                instrument.count("api.writes", len(batch))
+            # Merging and compaction rewrite whole files, so they wait until
+            # the batch has committed and its callers have their answers
+            await self._loop.run_in_executor(self._writer, _tidy)
+
+    # --- Report ---
+
+    async def _send_report(self, handler, query, out, keep_alive):
+        # One report is written at a time. Requests that arrive while one is
+        # being written wait for the next; requests waiting together share it.
+        wanted = self._reports_started + 1
+        async with self._report_lock:
+            if self._reports_done < wanted:
+                self._reports_started += 1
+                self._report_path = await self._loop.run_in_executor(self._readers, handler, query)
+                self._reports_done = self._reports_started
+            f = open(self._report_path, "rb")
+        with f:
+            out.write(_head(200, os.fstat(f.fileno()).st_size, TEXT_TYPE, keep_alive))
+            await self._loop.sendfile(out.transport, f)
+
+
+def _tidy():
+    price_manager.maybe_merge()
+    for filename, get_store in STORES:
+        maybe_compact(filename, get_store())
@@ -0,0 +1,130 @@
+# instrument.py
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Optional timing spans and counters for the hot paths. Off by default and
+# then close to free: timed() checks one flag, count() callers guard on
+# `instrument.enabled`. Turn it on with FRDB_STATS=1 or main.py --stats;
+# FRDB_PROFILE=<file> or main.py --profile <file> also runs cProfile and
+# writes a pstats file. The summary is printed when the program exits the
+# main menu or finishes a command.
+STATS_ENV = "FRDB_STATS"
+PROFILE_ENV = "FRDB_PROFILE"
+
+enabled = bool(os.environ.get(STATS_ENV))
+
+_spans = {}       # name -> [calls, total seconds, slowest call]
+_counters = {}
+_lock = threading.Lock()
+_profiler = None
+_profile_path = None
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def start_profile(path):
+    # Profile everything from here until dump(); implies enable()
+    global _profiler, _profile_path
+    import cProfile
+    enable()
+    _profiler = cProfile.Profile()
+    _profile_path = path
+    _profiler.enable()
+
+
+def configure(stats=False, profile=None):
+    # Command-line switches, falling back to the environment
+    profile = profile or os.environ.get(PROFILE_ENV)
+    if profile:
+        start_profile(profile)
+    elif stats:
+        enable()
+
+
+def _record(name, seconds):
+    with _lock:
+        span = _spans.get(name)
+        if span is None:
+            _spans[name] = [1, seconds, seconds]
+        else:
+            span[0] += 1
+            span[1] += seconds
+            if seconds > span[2]:
+                span[2] = seconds
+
+
+@contextmanager
+def span(name):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timed(name):
+    # Decorator: one span per call
+    def wrap(func):
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+        return timed_call
+    return wrap
+
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def snapshot():
+    with _lock:
+        spans = {name: {"calls": calls, "total_s": total, "mean_ms": total / calls * 1000, "max_ms": slowest * 1000}
+                 for name, (calls, total, slowest) in _spans.items()}
+        return {"spans": spans, "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def dump(out=None):
+    # Prints the summary (and writes the profile) if instrumentation is on
+    global _profiler
+    if not enabled:
+        return
+    out = out or sys.stderr
+    stats = snapshot()
+    print("\n=== Performance statistics ===", file=out)
+    print(f"{'Span':<28} {'Calls':>8} {'Total s':>10} {'Mean ms':>10} {'Max ms':>10}", file=out)
+    print("-" * 70, file=out)
+    for name, s in sorted(stats["spans"].items(), key=lambda item: -item[1]["total_s"]):
+        print(f"{name:<28} {s['calls']:>8} {s['total_s']:>10.4f} {s['mean_ms']:>10.3f} {s['max_ms']:>10.3f}", file=out)
+    if stats["counters"]:
+        print(f"\n{'Counter':<28} {'Value':>14}", file=out)
+        print("-" * 43, file=out)
+        for name, value in sorted(stats["counters"].items()):
+            print(f"{name:<28} {value:>14}", file=out)
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        _profiler = None
+        print(f"\nProfile written to {_profile_path} (view with: python -m pstats {_profile_path})", file=out)
@@ -0,0 +1,156 @@
+# locking.py
+import os
+import struct
+import threading
+from contextlib import ExitStack, contextmanager
+import instrument
+
+try:
+    import fcntl
+except ImportError:
+    # No flock() (e.g. Windows): locks only serialize threads of one process
+    fcntl = None
+
+# The lock file holds a counter bumped by every exclusive section, so a
+# process can tell that someone else changed the data since it last looked,
+# and the write-ahead log transaction in progress (0 if none), so the next
+# writer can tell that the previous one died halfway
+LOCK_STATE = struct.Struct('<QI')
+
+# Record type tags (schema.py) in locking order: referenced before referencing
+LOCK_ORDER = (b'M', b'P', b'R')
+
+
+class FileLock:
+    # Reader/writer lock shared between processes through flock() on a
+    # sidecar file, and between the threads of one process: shared sections
+    # of several threads run together under one shared flock, an exclusive
+    # section waits for them and keeps every other thread out. Threads
+    # waiting for an exclusive section go before new shared ones. Sections
+    # nest inside one thread: inner sections reuse the outer lock, but a
+    # shared section cannot be upgraded to exclusive.
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0       # threads inside a shared section
+        self._writer = False    # a thread is inside an exclusive section
+        self._waiting = 0       # threads waiting for an exclusive section
+        self._local = threading.local()
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def close(self):
+        with self._cond:
+            if not self._readers and not self._writer and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    @contextmanager
+    def hold(self, exclusive=False, on_lock=None):
+        # Yields True for the thread's outermost section, False for nested
+        # ones. on_lock() runs each time this process takes the flock, before
+        # any section under it starts.
+        local = self._local
+        depth = getattr(local, "depth", 0)
+        if depth:
+            if exclusive and not local.exclusive:
+                raise RuntimeError(f"{self.path}: cannot upgrade a shared lock to exclusive")
+            local.depth += 1
+            try:
+                yield False
+            finally:
+                local.depth -= 1
+            return
+        self._acquire(exclusive, on_lock)
+        local.depth, local.exclusive = 1, exclusive
+        try:
+            yield True
+        finally:
+            local.depth, local.exclusive = 0, False
+            self._release(exclusive)
+
+    def _acquire(self, exclusive, on_lock):
+        with self._cond:
+            if exclusive:
+                self._waiting += 1
+                try:
+                    self._cond.wait_for(lambda: not self._writer and not self._readers)
+                finally:
+                    self._waiting -= 1
+            else:
+                self._cond.wait_for(lambda: not self._writer and not self._waiting)
+                if self._readers:
+                    # Another thread holds the shared flock already
+                    self._readers += 1
+                    return
+            fd = self._open()
+            if fcntl is not None:
+                # Time spent waiting for other processes shows up as lock.wait_*
+                with instrument.span("lock.wait_exclusive" if exclusive else "lock.wait_shared"):
+                    fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                if on_lock is not None:
+                    on_lock()
+            except BaseException:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                raise
+            if exclusive:
+                self._writer = True
+            else:
+                self._readers = 1
+
+    def _release(self, exclusive):
+        with self._cond:
+            if exclusive:
+                self._writer = False
+            else:
+                self._readers -= 1
+                if self._readers:
+                    return
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._cond.notify_all()
+
+    def state(self):
+        # (counter, open transaction)
+        fd = self._open()
+        os.lseek(fd, 0, os.SEEK_SET)
+        data = os.read(fd, LOCK_STATE.size)
+        if len(data) == LOCK_STATE.size:
+            return LOCK_STATE.unpack(data)
+        # Lock files from before the transaction field hold the counter alone
+        return (struct.unpack('<Q', data[:8])[0] if len(data) >= 8 else 0), 0
+
+    def counter(self):
+        return self.state()[0]
+
+    def _write_state(self, counter, txn):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, LOCK_STATE.pack(counter, txn))
+
+    def mark_open(self, txn):
+        # Call inside an exclusive section before its first logged write
+        self._write_state(self.counter(), txn)
+
+    def bump(self):
+        # Call at the end of an exclusive section; clears the open
+        # transaction and returns the new counter
+        value = self.counter() + 1
+        self._write_state(value, 0)
+        return value
+
+
+@contextmanager
+def hold_all(stores, exclusive=False):
+    # Locks several stores in one fixed order so two processes taking
+    # overlapping sets can never deadlock. Code that nests sections by hand
+    # must follow the same order: promotions, products, prices.
+    with ExitStack() as stack:
+        for store in sorted(stores, key=lambda s: LOCK_ORDER.index(s.schema.tag)):
+            stack.enter_context(store.exclusive() if exclusive else store.shared())
+        yield
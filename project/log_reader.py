@@ -0,0 +1,185 @@
+# log_reader.py
+import bisect
+import glob
+import gzip
+import json
+import os
+import re
+
+LOG_FILE = "log.txt"
+
+# Each log line: "[YYYY-mm-dd HH:MM:SS] ACTOR - action: detail -> status"
+LINE_RE = re.compile(r'^\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (\S+) - ')
+PRODUCT_ID_RE = re.compile(r'[Pp]roduct ID ([^\s,:]+)')
+TAIL_BLOCK = 4096
+
+
+def parse_line(line):
+    # Returns (timestamp string, actor, product id or None), or None for junk
+    m = LINE_RE.match(line)
+    if not m:
+        return None
+    p = PRODUCT_ID_RE.search(line)
+    return m.group(1), m.group(2), p.group(1) if p else None
+
+
+# --- Segments ---
+
+def _segment_order(path, log_file):
+    # log.txt.<YYYYmmdd-HHMMSS>[-n][.gz] -> (stamp, n)
+    name = path[len(log_file) + 1:]
+    if name.endswith(".gz"):
+        name = name[:-3]
+    parts = name.split("-")
+    n = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+    return "-".join(parts[:2]), n
+
+
+def list_segments(log_file=LOG_FILE):
+    # Rotated segments oldest first, then the active file
+    rotated = sorted((p for p in glob.glob(log_file + ".*") if not p.endswith((".idx", ".lock"))),
+                     key=lambda p: _segment_order(p, log_file))
+    if os.path.exists(log_file):
+        rotated.append(log_file)
+    return rotated
+
+
+def _open_segment(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _index_path(path):
+    if path.endswith(".gz"):
+        path = path[:-3]
+    return path + ".idx"
+
+
+def index_segment(path):
+    # Summary of a closed segment: first/last timestamp, the byte offset
+    # (uncompressed) of the first event of each minute, and the actors and
+    # product IDs it mentions
+    minutes = []
+    actors = set()
+    ids = set()
+    first = last = None
+    offset = 0
+    with _open_segment(path) as f:
+        for raw in f:
+            parsed = parse_line(raw.decode("utf-8", "replace"))
+            if parsed:
+                ts, actor, pid = parsed
+                if not minutes or minutes[-1][0] != ts[:16]:
+                    minutes.append([ts[:16], offset])
+                if first is None:
+                    first = ts
+                last = ts
+                actors.add(actor)
+                if pid:
+                    ids.add(pid)
+            offset += len(raw)
+    meta = {"first": first, "last": last, "minutes": minutes,
+            "actors": sorted(actors), "ids": sorted(ids)}
+    with open(_index_path(path), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def load_segment_index(path):
+    # None for the active file, which is small and always scanned
+    idx = _index_path(path)
+    if not os.path.exists(idx):
+        return None
+    try:
+        with open(idx, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        return index_segment(path)
+
+
+def _iter_lines(path, offset=0):
+    with _open_segment(path) as f:
+        if offset:
+            f.seek(offset)
+        for raw in f:
+            yield raw.decode("utf-8", "replace")
+
+
+# --- Queries ---
+
+def _tail_file(path, n):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    lines = data.decode("utf-8", "replace").splitlines(keepends=True)
+    if pos > 0:
+        lines = lines[1:]   # first line may be cut in half
+    return lines[-n:] if n else []
+
+
+def tail_lines(n=10, log_file=LOG_FILE):
+    # Last n lines, reading backwards from the end of the active file and
+    # only falling back to rotated segments if it is too short
+    lines = []
+    for path in reversed(list_segments(log_file)):
+        if path.endswith(".gz"):
+            with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+                older = f.readlines()[-(n - len(lines)):]
+        else:
+            older = _tail_file(path, n - len(lines))
+        lines = older + lines
+        if len(lines) >= n:
+            break
+    return lines
+
+
+def events_between(start, end, log_file=LOG_FILE):
+    # Lines with start <= timestamp <= end; bounds are datetimes or
+    # "YYYY-mm-dd HH:MM:SS" strings
+    start = str(start)[:19]
+    end = str(end)[:19]
+    for path in list_segments(log_file):
+        meta = load_segment_index(path)
+        offset = 0
+        if meta is not None:
+            if meta["first"] is None or meta["last"] < start or meta["first"] > end:
+                continue
+            keys = [m[0] for m in meta["minutes"]]
+            i = bisect.bisect_right(keys, start[:16]) - 1
+            if i > 0:
+                offset = meta["minutes"][i][1]
+        for line in _iter_lines(path, offset):
+            parsed = parse_line(line)
+            if not parsed:
+                continue
+            if parsed[0] > end:
+                break
+            if parsed[0] >= start:
+                yield line
+
+
+def events_for(actor=None, pro_id=None, log_file=LOG_FILE):
+    # Lines written by actor and/or mentioning product pro_id
+    for path in list_segments(log_file):
+        meta = load_segment_index(path)
+        if meta is not None:
+            if actor is not None and actor not in meta["actors"]:
+                continue
+            if pro_id is not None and pro_id not in meta["ids"]:
+                continue
+        for line in _iter_lines(path):
+            parsed = parse_line(line)
+            if not parsed:
+                continue
+            if actor is not None and parsed[1] != actor:
+                continue
+            if pro_id is not None and parsed[2] != pro_id:
+                continue
+            yield line
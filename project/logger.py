@@ -1,10 +1,215 @@
 # logger.py
-from datetime import datetime
+import atexit
+import gzip
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from datetime import datetime, date
+import instrument
+from locking import FileLock
+from log_reader import index_segment
 
 LOG_FILE = "log.txt"
 
+# Events are buffered in memory and written by a background thread once
+# FLUSH_BATCH events are waiting or FLUSH_INTERVAL seconds have passed.
+# If the buffer reaches BUFFER_SIZE the caller writes it out itself.
+FLUSH_BATCH = 64
+FLUSH_INTERVAL = 1.0
+BUFFER_SIZE = 4096
+
+# fsync the log after every FSYNC_EVERY written events (0 = leave it to the OS).
+# Set FRDB_LOG_FSYNC=<n> or main.py --log-fsync <n>.
+FSYNC_ENV = "FRDB_LOG_FSYNC"
+FSYNC_EVERY = int(os.environ.get(FSYNC_ENV) or 0)
+
+# log.txt is rotated to log.txt.<YYYYmmdd-HHMMSS>[.gz] when it would grow past
+# LOG_MAX_BYTES or when the first event of a new day arrives (0/False to disable)
+LOG_MAX_BYTES = 1024 * 1024
+LOG_ROTATE_DAILY = True
+LOG_COMPRESS = True
+
+
+class BatchLogger:
+    def __init__(self, filename=LOG_FILE, batch=FLUSH_BATCH, interval=FLUSH_INTERVAL,
+                 capacity=BUFFER_SIZE, fsync_every=FSYNC_EVERY, max_bytes=LOG_MAX_BYTES,
+                 rotate_daily=LOG_ROTATE_DAILY, compress=LOG_COMPRESS):
+        self.filename = filename
+        self.batch = batch
+        self.interval = interval
+        self.capacity = capacity
+        self.fsync_every = fsync_every
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self._buf = deque()
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()   # keeps batches in order on disk
+        self._thread = None
+        self._closed = False
+        self._f = None
+        self._lock = FileLock(filename + ".lock")
+        self._unsynced = 0
+        self._stamp_second = None
+        self._stamp = ""
+
+    def _timestamp(self):
+        # strftime once per second instead of once per event
+        now = int(time.time())
+        if now != self._stamp_second:
+            self._stamp_second = now
+            self._stamp = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+        return self._stamp
+
+    def log(self, actor, action, status="OK", detail=""):
+        line = f"[{self._timestamp()}] {actor} - {action}: {detail} -> {status}\n"
+        with self._cond:
+            self._buf.append(line)
+            if self._closed:
+                full = True
+            else:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                    self._thread.start()
+                full = len(self._buf) >= self.capacity
+                if len(self._buf) >= self.batch:
+                    self._cond.notify()
+        if full:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._buf) >= self.batch or self._closed, self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _open(self):
+        self._f = open(self.filename, "a", encoding="utf-8")
+
+    def _reopen_if_rotated(self):
+        # Another process may have rotated log.txt since this one opened it
+        try:
+            current = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._f is not None and current != os.fstat(self._f.fileno()).st_ino:
+            self._f.close()
+            self._f = None
+        if self._f is None:
+            self._open()
+
+    def _needs_rotation(self, pending):
+        # Decided from the file itself, so every process sees the same answer
+        st = os.fstat(self._f.fileno())
+        if st.st_size == 0:
+            return False
+        if self.max_bytes and st.st_size + pending > self.max_bytes:
+            return True
+        return self.rotate_daily and date.fromtimestamp(st.st_mtime) != date.today()
+
+    def _rotate(self):
+        # Call under the exclusive log lock; returns the renamed segment
+        self._f.close()
+        self._f = None
+        target = f"{self.filename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        n = 0
+        while os.path.exists(target) or os.path.exists(target + ".gz"):
+            n += 1
+            target = f"{self.filename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{n}"
+        os.replace(self.filename, target)
+        self._open()
+        return target
+
+    def _close_segment(self, segment):
+        index_segment(segment)
+        if self.compress:
+            with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(segment)
+
+    def _append(self, text, count):
+        self._f.write(text)
+        self._f.flush()
+        self._unsynced += count
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            os.fsync(self._f.fileno())
+            self._unsynced = 0
+
+    @instrument.timed("log.write")
+    def _write(self, lines):
+        # Several processes append to one log.txt. Each batch is written
+        # under a shared lock on log.txt.lock after checking that log.txt is
+        # still the file this process has open; rotation takes the lock
+        # exclusively. So once a segment is renamed nobody writes to it again
+        # and it can be compressed and removed while others still hold it open.
+        text = "".join(lines)
+        if instrument.enabled:
+            instrument.count("log.bytes_written", len(text))
+        with self._lock.hold():
+            self._reopen_if_rotated()
+            rotate = self._needs_rotation(len(text))
+            if not rotate:
+                self._append(text, len(lines))
+        if not rotate:
+            return
+        segment = None
+        with self._lock.hold(exclusive=True):
+            # Another process may have rotated in between
+            self._reopen_if_rotated()
+            if self._needs_rotation(len(text)):
+                segment = self._rotate()
+            self._append(text, len(lines))
+        if segment is not None:
+            self._close_segment(segment)
+
+    def flush(self):
+        with self._io_lock:
+            with self._cond:
+                lines = list(self._buf)
+                self._buf.clear()
+            if lines:
+                self._write(lines)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._io_lock:
+            if self._f is not None:
+                if self.fsync_every:
+                    os.fsync(self._f.fileno())
+                self._f.close()
+                self._f = None
+            self._lock.close()
+        with self._cond:
+            self._closed = False
+
+
+_logger = BatchLogger()
+atexit.register(_logger.shutdown)
+
+
+@instrument.timed("log.event")
 def log_event(actor, action, status="OK", detail=""):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {actor} - {action}: {detail} -> {status}\n"
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line)
+    _logger.log(actor, action, status, detail)
+
+
+def flush():
+    _logger.flush()
+
+
+def shutdown():
+    _logger.shutdown()
+
+
+def set_durability(fsync_every):
+    # fsync_every=1 makes every event durable before the next batch is taken
+    _logger.fsync_every = fsync_every
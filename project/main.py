@@ -1,48 +1,104 @@
-import struct
+import argparse
 import os
-from datetime import datetime
-
-# --- Constants & Structs ---
-
-PRODUCT_FILE = "products.dat"
-PRICE_FILE = "prices.dat"
-PROMOTION_FILE = "promotions.dat"
-LOG_FILE = "log.txt"
-REPORT_FILE = "report.txt"
-
-# Struct format:
-# Product: pro_id(10 bytes string), pro_name(30 bytes string), promotion_id(int)
-PRODUCT_STRUCT = struct.Struct('<10s30si')
-
-# Price: pro_id(10 bytes string), pro_size(10 bytes string), pro_price(float), pro_stock(int), sale_status(unsigned char)
-PRICE_STRUCT = struct.Struct('<10s10sfiB')
-
-# Promotion: promotion_id(int), promotion_name(30 bytes string)
-PROMOTION_STRUCT = struct.Struct('<i30s')
+import signal
+import sys
+import backend
+import product_manager
+import price_manager
+import promotion_manager
+import logger
+import log_reader
+import catalog
+import instrument
+import events
+import sales
+import storage
+import writer
+from logger import log_event, LOG_FILE
+from maintenance import STORES, checkpoint_all, compact_file, init_files, maybe_compact, migrate_files
+from product_manager import PRODUCT_FILE
+from price_manager import PRICE_FILE
+from promotion_manager import PROMOTION_FILE
+from report import REPORT_FILE, drop_report_cache, generate_report
 
 # --- Helper Functions ---
 
-def log_event(actor, action, status="OK", detail=""):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {actor} - {action}: {detail} -> {status}\n"
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line)
-
-def pad_string(s, length):
-    b = s.encode('utf-8')[:length]
-    return b.ljust(length, b'\x00')
-
-def read_all_records(filename, record_size):
-    if not os.path.exists(filename):
-        return []
-    with open(filename, 'rb') as f:
-        data = f.read()
-    return [data[i:i+record_size] for i in range(0, len(data), record_size)]
-
-def write_all_records(filename, record_size, records):
-    with open(filename, 'wb') as f:
-        for rec in records:
-            f.write(rec)
+def rebuild_indexes():
+    for _, get_store in STORES:
+        store = get_store()
+        store.rebuild_index()
+        if store.groups is not None:
+            store.rebuild_groups()
+    log_event("SYSTEM", "Rebuild Indexes")
+    print("Indexes rebuilt.")
+
+def verify_indexes():
+    problems = []
+    for _, get_store in STORES:
+        problems.extend(get_store().verify_indexes())
+    for line in problems[:20]:
+        print(line)
+    if problems:
+        print(f"{len(problems)} index problem(s) found; use Rebuild Indexes to repair.")
+    else:
+        print("All indexes match the data files.")
+    log_event("SYSTEM", "Verify Indexes", "FAILED" if problems else "OK", f"{len(problems)} problems")
+
+def cache_statistics():
+    print(f"\n{'Table':<12} {'Hits':>10} {'Misses':>10} {'Hit rate':>9} {'Cached':>10}")
+    print("-" * 55)
+    for name, (hits, misses, size) in catalog.stats().items():
+        rate = f"{hits / (hits + misses):.1%}" if hits + misses else "-"
+        print(f"{name:<12} {hits:>10} {misses:>10} {rate:>9} {size:>10}")
+
+# --- Compaction ---
+
+def compact_all():
+    for filename, get_store in STORES:
+        compact_file(filename, get_store())
+    print("Data files compacted.")
+
+# --- Snapshots ---
+
+def take_snapshot():
+    import snapshot
+    if backend.name != "files":
+        print("Snapshots copy the data files; they are not available with the sqlite backend.")
+        return None
+    snap_id, files = snapshot.create([get_store() for _, get_store in STORES])
+    stored = 0
+    for filename, cloned, blocks, reused, written in files:
+        stored += written
+        if cloned:
+            print(f"{filename}: cloned")
+        else:
+            print(f"{filename}: {blocks} block(s) stored, {reused} unchanged, {written} bytes")
+    log_event("USER", f"Snapshot {snap_id}", detail=f"{stored} bytes stored")
+    print(f"Snapshot {snap_id} written.")
+    return snap_id
+
+def list_snapshots():
+    import snapshot
+    ids = snapshot.list_snapshots()
+    if not ids:
+        print("No snapshots found.")
+        return
+    print(f"\n{'Snapshot':<20} {'Created':<20} {'Based on':<20} {'Bytes':>12}")
+    print("-" * 75)
+    for snap_id in ids:
+        manifest = snapshot.load_manifest(snap_id)
+        print(f"{snap_id:<20} {manifest['created']:<20} {manifest['parent'] or '-':<20} "
+              f"{snapshot.snapshot_size(snap_id):>12}")
+
+def restore_snapshot(snap_id):
+    import snapshot
+    restored = snapshot.restore(snap_id, [get_store() for _, get_store in STORES])
+    # Every record number changed
+    drop_report_cache()
+    catalog.clear()
+    summary = ", ".join(f"{count} in {filename}" for filename, count in restored)
+    log_event("USER", f"Restore snapshot {snap_id}", detail=summary)
+    print(f"Restored snapshot {snap_id}: {summary}.")
 
 # --- CRUD for Products ---
 
@@ -53,17 +109,11 @@ def add_product():
         promotion_id = int(input("Enter promotion ID (int): "))
 
         # Check if pro_id already exists
-        products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-        for rec in products:
-            pid_bytes, _, _ = PRODUCT_STRUCT.unpack(rec)
-            pid = pid_bytes.decode('utf-8').rstrip('\x00')
-            if pid == pro_id:
-                print(f"Product ID {pro_id} already exists.")
-                return
+        if product_manager.find_product(pro_id) is not None:
+            print(f"Product ID {pro_id} already exists.")
+            return
 
-        packed = PRODUCT_STRUCT.pack(pad_string(pro_id, 10), pad_string(pro_name, 30), promotion_id)
-        with open(PRODUCT_FILE, 'ab') as f:
-            f.write(packed)
+        product_manager.add_product_record(pro_id, pro_name, promotion_id)
 
         log_event("USER", f"Add Product ID {pro_id}")
         print("Product added.")
@@ -73,31 +123,22 @@ def add_product():
 def update_product():
     try:
         pro_id = input("Enter product ID to update: ").strip()
-        products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-        updated = False
-        new_products = []
-
-        for rec in products:
-            pid_bytes, pname_b, promo_id = PRODUCT_STRUCT.unpack(rec)
-            pid = pid_bytes.decode('utf-8').rstrip('\x00')
-            if pid == pro_id:
-                print(f"Current name: {pname_b.decode('utf-8').rstrip(chr(0))}, promotion ID: {promo_id}")
-                new_name = input("Enter new product name (leave blank to keep): ")
-                new_promo = input("Enter new promotion ID (leave blank to keep): ")
-                if new_name.strip() == '':
-                    new_name = pname_b.decode('utf-8').rstrip(chr(0))
-                if new_promo.strip() == '':
-                    new_promo = promo_id
-                else:
-                    new_promo = int(new_promo)
-                new_rec = PRODUCT_STRUCT.pack(pad_string(pro_id,10), pad_string(new_name,30), new_promo)
-                new_products.append(new_rec)
-                updated = True
+        product = product_manager.load_product(pro_id)
+
+        if product is not None:
+            print(f"Current name: {product.pro_name}, promotion ID: {product.promotion_id}")
+            new_name = input("Enter new product name (leave blank to keep): ")
+            new_promo = input("Enter new promotion ID (leave blank to keep): ")
+            if new_name.strip() == '':
+                new_name = product.pro_name
+            if new_promo.strip() == '':
+                new_promo = product.promotion_id
             else:
-                new_products.append(rec)
-
-        if updated:
-            write_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size, new_products)
+                new_promo = int(new_promo)
+            # Rejected if another terminal changed the product meanwhile
+            if not product_manager.update_product(pro_id, new_name, new_promo, expected=product):
+                print("Product ID not found.")
+                return
             log_event("USER", f"Update Product ID {pro_id}")
             print("Product updated.")
         else:
@@ -108,50 +149,29 @@ def update_product():
 def delete_product():
     try:
         pro_id = input("Enter product ID to delete: ").strip()
-        products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-        new_products = []
-        deleted = False
-
-        for rec in products:
-            pid_bytes, _, _ = PRODUCT_STRUCT.unpack(rec)
-            pid = pid_bytes.decode('utf-8').rstrip('\x00')
-            if pid == pro_id:
-                deleted = True
-                continue
-            new_products.append(rec)
-
-        if deleted:
-            write_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size, new_products)
+        if product_manager.delete_product(pro_id):
             log_event("USER", f"Delete Product ID {pro_id}")
             print("Product deleted.")
             delete_price_by_product(pro_id)
+            maybe_compact(PRODUCT_FILE, product_manager.get_store())
         else:
             print("Product ID not found.")
     except Exception as e:
         print("Error deleting product:", e)
 
+@instrument.timed("view.products")
 def view_products():
-    products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-    promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-    
-    promo_dict = {}
-    for rec in promotions:
-        pid, pname_b = PROMOTION_STRUCT.unpack(rec)
-        pname = pname_b.decode('utf-8').rstrip('\x00')
-        promo_dict[pid] = pname
-    
-    if not products:
+    promo_dict = promotion_manager.promotion_names()
+
+    if product_manager.get_store().live_count() == 0:
         print("No products found.")
         return
-    
+
     print(f"\n{'ID':<10} {'Name':<30} {'PromotionName':<30}")
     print("-" * 70)
-    for rec in products:
-        pid_bytes, pname_b, promo_id = PRODUCT_STRUCT.unpack(rec)
-        pid = pid_bytes.decode('utf-8').rstrip('\x00')
-        pname = pname_b.decode('utf-8').rstrip('\x00')
-        promo_name = promo_dict.get(promo_id, "No Promotion")
-        print(f"{pid:<10} {pname:<30} {promo_name:<30}")
+    for p in product_manager.iter_products():
+        promo_name = promo_dict.get(p.promotion_id, "No Promotion")
+        print(f"{p.pro_id:<10} {p.pro_name:<30} {promo_name:<30}")
 
 # --- CRUD for Prices ---
 
@@ -166,23 +186,15 @@ def add_price():
             print("Sale status must be 0 or 1")
             return
 
-        products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-        if not any(PRODUCT_STRUCT.unpack(p)[0].decode('utf-8').rstrip('\x00') == pro_id for p in products):
+        if product_manager.find_product(pro_id) is None:
             print("Product ID does not exist. Please add product first.")
             return
 
-        prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
-        for p in prices:
-            pid, size_b, _, _, _ = PRICE_STRUCT.unpack(p)
-            pid_str = pid.decode('utf-8').rstrip('\x00')
-            size = size_b.decode('utf-8').rstrip('\x00')
-            if pid_str == pro_id and size == pro_size:
-                print("Price record for this product and size already exists.")
-                return
+        if price_manager.find_price(pro_id, pro_size) is not None:
+            print("Price record for this product and size already exists.")
+            return
 
-        packed = PRICE_STRUCT.pack(pad_string(pro_id, 10), pad_string(pro_size,10), pro_price, pro_stock, sale_status)
-        with open(PRICE_FILE, 'ab') as f:
-            f.write(packed)
+        price_manager.add_price_record(pro_id, pro_size, pro_price, pro_stock, sale_status)
 
         log_event("USER", f"Add Price for Product ID {pro_id}, size {pro_size}")
         print("Price added.")
@@ -193,46 +205,37 @@ def update_price():
     try:
         pro_id = input("Enter product ID to update : ").strip()
         pro_size = input("Enter size to update: ")[:10]
-        prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
-        updated = False
-        new_prices = []
-
-        for rec in prices:
-            pid, size_b, price, stock, status = PRICE_STRUCT.unpack(rec)
-            pid_str = pid.decode('utf-8').rstrip('\x00')
-            size = size_b.decode('utf-8').rstrip('\x00')
-            if pid_str == pro_id and size == pro_size:
-                print(f"Current price: {price}, stock: {stock}, status: {status}")
-                new_price = input("Enter new price (leave blank to keep): ")
-                new_stock = input("Enter new stock (leave blank to keep): ")
-                new_status = input("Enter new sale status (0/1, blank to keep): ")
-
-                if new_price.strip() == '':
-                    new_price = price
-                else:
-                    new_price = float(new_price)
-
-                if new_stock.strip() == '':
-                    new_stock = stock
-                else:
-                    new_stock = int(new_stock)
-
-                if new_status.strip() == '':
-                    new_status = status
-                else:
-                    new_status = int(new_status)
-                    if new_status not in (0,1):
-                        print("Sale status must be 0 or 1")
-                        return
-
-                new_rec = PRICE_STRUCT.pack(pad_string(pro_id,10), pad_string(pro_size,10), new_price, new_stock, new_status)
-                new_prices.append(new_rec)
-                updated = True
+        current = price_manager.load_price(pro_id, pro_size)
+
+        if current is not None:
+            price, stock, status = current.pro_price, current.pro_stock, current.sale_status
+            print(f"Current price: {price}, stock: {stock}, status: {status}")
+            new_price = input("Enter new price (leave blank to keep): ")
+            new_stock = input("Enter new stock (leave blank to keep): ")
+            new_status = input("Enter new sale status (0/1, blank to keep): ")
+
+            if new_price.strip() == '':
+                new_price = price
             else:
-                new_prices.append(rec)
+                new_price = float(new_price)
 
-        if updated:
-            write_all_records(PRICE_FILE, PRICE_STRUCT.size, new_prices)
+            if new_stock.strip() == '':
+                new_stock = stock
+            else:
+                new_stock = int(new_stock)
+
+            if new_status.strip() == '':
+                new_status = status
+            else:
+                new_status = int(new_status)
+                if new_status not in (0,1):
+                    print("Sale status must be 0 or 1")
+                    return
+
+            # Rejected if another terminal changed the price meanwhile (e.g. a sale)
+            if not price_manager.update_price(pro_id, pro_size, new_price, new_stock, new_status, expected=current):
+                print("Price record not found.")
+                return
             log_event("USER", f"Update Price Product ID {pro_id} Size {pro_size}")
             print("Price updated.")
         else:
@@ -244,52 +247,92 @@ def delete_price():
     try:
         pro_id = input("Enter product ID to delete price: ").strip()
         pro_size = input("Enter size to delete: ")[:10]
-        prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
-        new_prices = []
-        deleted = False
-
-        for rec in prices:
-            pid, size_b, _, _, _ = PRICE_STRUCT.unpack(rec)
-            pid_str = pid.decode('utf-8').rstrip('\x00')
-            size = size_b.decode('utf-8').rstrip('\x00')
-            if pid_str == pro_id and size == pro_size:
-                deleted = True
-                continue
-            new_prices.append(rec)
-
-        if deleted:
-            write_all_records(PRICE_FILE, PRICE_STRUCT.size, new_prices)
+        if price_manager.delete_price(pro_id, pro_size):
             log_event("USER", f"Delete Price Product ID {pro_id} Size {pro_size}")
             print("Price deleted.")
+            maybe_compact(PRICE_FILE, price_manager.get_store())
         else:
             print("Price record not found.")
     except Exception as e:
         print("Error deleting price:", e)
 
 def delete_price_by_product(pro_id):
-    prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
-    new_prices = []
-    for p in prices:
-        pid_bytes = PRICE_STRUCT.unpack(p)[0]
-        pid = pid_bytes.decode('utf-8').rstrip('\x00')
-        if pid != pro_id:
-            new_prices.append(p)
-    write_all_records(PRICE_FILE, PRICE_STRUCT.size, new_prices)
+    price_manager.delete_prices_of_product(pro_id)
+    maybe_compact(PRICE_FILE, price_manager.get_store())
     log_event("SYSTEM", f"Delete all prices of deleted product ID {pro_id}")
 
+@instrument.timed("view.prices")
 def view_prices():
-    prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
+    if price_manager.get_store().live_count() == 0:
+        print("No price records found.")
+        return
+    print(f"\n{'ProductID':<10} {'Size':<10} {'Price':<10} {'Stock':<7} {'Status':<6}")
+    print("-"*50)
+    for p in price_manager.iter_prices():
+        status_str = "Sell" if p.sale_status == 1 else "Not Sell"
+        print(f"{p.pro_id:<10} {p.pro_size:<10} {p.pro_price:<10.2f} {p.pro_stock:<7} {status_str:<6}")
+
+def view_prices_of_product():
+    pro_id = input("Product ID: ").strip()
+    prices = price_manager.prices_of_product(pro_id)
+    if not prices:
+        print("No price records found for this product.")
+        return
+    print(f"\n{'Size':<10} {'Price':<10} {'Stock':<7} {'Status':<6}")
+    print("-"*39)
+    for p in prices:
+        status_str = "Sell" if p.sale_status == 1 else "Not Sell"
+        print(f"{p.pro_size:<10} {p.pro_price:<10.2f} {p.pro_stock:<7} {status_str:<6}")
+
+def search_prices_by_prefix():
+    prefix = input("Product ID prefix (e.g. F for fish items): ").strip()
+    prices = price_manager.prices_with_prefix(prefix)
     if not prices:
         print("No price records found.")
         return
     print(f"\n{'ProductID':<10} {'Size':<10} {'Price':<10} {'Stock':<7} {'Status':<6}")
     print("-"*50)
-    for rec in prices:
-        pid, size_b, price, stock, status = PRICE_STRUCT.unpack(rec)
-        pid_str = pid.decode('utf-8').rstrip('\x00')
-        size = size_b.decode('utf-8').rstrip('\x00')
-        status_str = "Sell" if status == 1 else "Not Sell"
-        print(f"{pid_str:<10} {size:<10} {price:<10.2f} {stock:<7} {status_str:<6}")
+    for p in prices:
+        status_str = "Sell" if p.sale_status == 1 else "Not Sell"
+        print(f"{p.pro_id:<10} {p.pro_size:<10} {p.pro_price:<10.2f} {p.pro_stock:<7} {status_str:<6}")
+
+def sell_item():
+    try:
+        pro_id = input("Enter product ID: ").strip()
+        pro_size = input("Enter size: ")[:10]
+        qty = int(input("Enter quantity: "))
+        left = sales.sell(pro_id, pro_size, qty)
+        log_event("USER", f"Sell Product ID {pro_id} size {pro_size}", detail=f"qty {qty}, {left} left")
+        print(f"Sold. {left} left in stock.")
+    except sales.SaleError as e:
+        log_event("USER", f"Sell Product ID {pro_id} size {pro_size}", "REJECTED", str(e))
+        print("Sale rejected:", e)
+    except Exception as e:
+        print("Error selling:", e)
+
+def view_price_summary():
+    try:
+        import price_analytics
+        arr = price_analytics.live_prices()
+    except ImportError as e:
+        print(e)
+        return
+    if len(arr) == 0:
+        print("No price records found.")
+        return
+
+    print(f"\n{'Size':<10} {'Min':<10} {'Max':<10} {'Mean':<10}")
+    print("-" * 43)
+    for size, (lo, hi, avg) in sorted(price_analytics.price_stats_by_size(arr).items()):
+        print(f"{size:<10} {lo:<10.2f} {hi:<10.2f} {avg:<10.2f}")
+
+    print(f"\n{'ProductID':<10} {'Stock Value':<12}")
+    print("-" * 23)
+    for pid, value in sorted(price_analytics.stock_value_by_product(arr).items()):
+        print(f"{pid:<10} {value:<12.2f}")
+
+    on_sale = len(price_analytics.filter_by_sale_status(1, arr))
+    print(f"\nOn sale: {on_sale}, not on sale: {len(arr) - on_sale}, out of stock: {price_analytics.out_of_stock_count(arr)}")
 
 # --- CRUD for Promotions ---
 
@@ -297,15 +340,10 @@ def add_promotion():
     try:
         promotion_id = int(input("Enter promotion ID (int): "))
         promotion_name = input("Enter promotion name (max 30 chars): ")[:30]
-        promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-        for rec in promotions:
-            pid, _ = PROMOTION_STRUCT.unpack(rec)
-            if pid == promotion_id:
-                print("Promotion ID already exists.")
-                return
-        packed = PROMOTION_STRUCT.pack(promotion_id, pad_string(promotion_name, 30))
-        with open(PROMOTION_FILE, 'ab') as f:
-            f.write(packed)
+        if promotion_manager.find_promotion(promotion_id) is not None:
+            print("Promotion ID already exists.")
+            return
+        promotion_manager.add_promotion_record(promotion_id, promotion_name)
         log_event("USER", f"Add Promotion ID {promotion_id}")
         print("Promotion added.")
     except Exception as e:
@@ -314,24 +352,16 @@ def add_promotion():
 def update_promotion():
     try:
         promotion_id = int(input("Enter promotion ID to update: "))
-        promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-        updated = False
-        new_promos = []
-        for rec in promotions:
-            pid, pname_b = PROMOTION_STRUCT.unpack(rec)
-            pname = pname_b.decode('utf-8').rstrip('\x00')
-            if pid == promotion_id:
-                print(f"Current name: {pname}")
-                new_name = input("Enter new promotion name (leave blank to keep): ")
-                if new_name.strip() == '':
-                    new_name = pname
-                new_rec = PROMOTION_STRUCT.pack(promotion_id, pad_string(new_name,30))
-                new_promos.append(new_rec)
-                updated = True
-            else:
-                new_promos.append(rec)
-        if updated:
-            write_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size, new_promos)
+        promotion = promotion_manager.load_promotion(promotion_id)
+        if promotion is not None:
+            pname = promotion.promotion_name
+            print(f"Current name: {pname}")
+            new_name = input("Enter new promotion name (leave blank to keep): ")
+            if new_name.strip() == '':
+                new_name = pname
+            if not promotion_manager.update_promotion(promotion_id, new_name, expected=promotion):
+                print("Promotion ID not found.")
+                return
             log_event("USER", f"Update Promotion ID {promotion_id}")
             print("Promotion updated.")
         else:
@@ -342,105 +372,49 @@ def update_promotion():
 def delete_promotion():
     try:
         promotion_id = int(input("Enter promotion ID to delete: "))
-        promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-        new_promos = []
-        deleted = False
-        for rec in promotions:
-            pid, _ = PROMOTION_STRUCT.unpack(rec)
-            if pid == promotion_id:
-                deleted = True
-                continue
-            new_promos.append(rec)
-        if deleted:
-            write_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size, new_promos)
+        if promotion_manager.delete_promotion(promotion_id):
             log_event("USER", f"Delete Promotion ID {promotion_id}")
             print("Promotion deleted.")
+            maybe_compact(PROMOTION_FILE, promotion_manager.get_store())
         else:
             print("Promotion ID not found.")
     except Exception as e:
         print("Error deleting promotion:", e)
 
+@instrument.timed("view.promotions")
 def view_promotions():
-    promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-    if not promotions:
+    if promotion_manager.get_store().live_count() == 0:
         print("No promotions found.")
         return
     print(f"\n{'PromotionID':<12} {'Name':<30}")
     print("-" * 45)
-    for rec in promotions:
-        pid, pname_b = PROMOTION_STRUCT.unpack(rec)
-        pname = pname_b.decode('utf-8').rstrip('\x00')
-        print(f"{pid:<12} {pname:<30}")
-
-# --- Report Generation ---
-
-def generate_report():
-    from textwrap import shorten
-
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    products = read_all_records(PRODUCT_FILE, PRODUCT_STRUCT.size)
-    prices = read_all_records(PRICE_FILE, PRICE_STRUCT.size)
-    promotions = read_all_records(PROMOTION_FILE, PROMOTION_STRUCT.size)
-
-    # promotion_id -> promotion_name
-    promo_dict = {}
-    for rec in promotions:
-        pid, pname_b = PROMOTION_STRUCT.unpack(rec)
-        pname = pname_b.decode('utf-8').rstrip('\x00')
-        promo_dict[pid] = pname
-
-    # product_id -> (product_name, promotion_name)
-    product_info = {}
-    for rec in products:
-        pid_bytes, pname_b, promo_id = PRODUCT_STRUCT.unpack(rec)
-        pid = pid_bytes.decode('utf-8').rstrip('\x00')
-        pname = pname_b.decode('utf-8').rstrip('\x00')
-        promo_name = promo_dict.get(promo_id, "No Promotion")
-        product_info[pid] = (pname, promo_name)
-
-    # Header for combined table
-    header = (
-        "+------------+---------------------------+-------------+-------------------+---------+-------+------------+\n"
-        "| Product ID | Product Name              | Size        | Promotion Name    | Price   | Stock | Status     |\n"
-        "+------------+---------------------------+-------------+-------------------+---------+-------+------------+\n"
-    )
-
-    rows = ""
-    for rec in prices:
-        pid_bytes, size_b, price, stock, status = PRICE_STRUCT.unpack(rec)
-        pid = pid_bytes.decode('utf-8').rstrip('\x00')
-        size = size_b.decode('utf-8').rstrip('\x00')
-        pname, promo_name = product_info.get(pid, ("Unknown", "No Promotion"))
-        pname_short = shorten(pname, width=25, placeholder="...")
-        promo_short = shorten(promo_name, width=20, placeholder="...")
-        status_text = "Ready" if status == 1 else "Not Ready"
-        rows += f"| {pid:<10} | {pname_short:<25} | {size:<11} | {promo_short:<17} | {price:<7.2f} | {stock:<5} | {status_text:<10} |\n"
-
-    footer = "+------------+---------------------------+-------------+-------------------+---------+-------+------------+\n"
-
-    # Print to Terminal
-    print("\n=== Combined Product & Price Report ===")
-    print(header + rows + footer)
-
-    # Write to file
-    with open(REPORT_FILE, "w", encoding="utf-8") as f:
-        f.write("Burger Shop Report\n")
-        f.write(f"Generated: {now}\n\n")
-        f.write(f"Total Products: {len(products)}\n")
-        f.write(f"Total Price Records: {len(prices)}\n\n")
-        f.write(header + rows + footer)
-        f.write("\nLast 10 Log Events:\n")
-
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, 'r', encoding='utf-8') as logf:
-                logs = logf.readlines()
-                for line in logs[-10:]:
-                    f.write(line)
-        else:
-            f.write("No log file found.\n")
+    for p in promotion_manager.iter_promotions():
+        print(f"{p.promotion_id:<12} {p.promotion_name:<30}")
 
-    log_event("SYSTEM", "Generate Report")
-    print(f"\n✅ Report written to {REPORT_FILE}")
+# --- Log Search ---
+
+def search_log():
+    try:
+        start = input("From (YYYY-mm-dd HH:MM:SS, blank for any): ").strip()
+        end = input("To (YYYY-mm-dd HH:MM:SS, blank for any): ").strip()
+        actor = input("Actor (USER/SYSTEM, blank for any): ").strip() or None
+        pro_id = input("Product ID (blank for any): ").strip() or None
+        logger.flush()
+        if start or end:
+            lines = log_reader.events_between(start or "0000", end or "9999", LOG_FILE)
+            if actor or pro_id:
+                lines = (line for line in lines
+                         if (actor is None or log_reader.parse_line(line)[1] == actor)
+                         and (pro_id is None or log_reader.parse_line(line)[2] == pro_id))
+        else:
+            lines = log_reader.events_for(actor, pro_id, LOG_FILE)
+        found = 0
+        for line in lines:
+            print(line, end="")
+            found += 1
+        print(f"{found} event(s) found.")
+    except Exception as e:
+        print("Error searching log:", e)
 
 
 def manage_products_menu():
@@ -472,6 +446,10 @@ def manage_prices_menu():
         print("2) Update Price")
         print("3) Delete Price")
         print("4) View Prices")
+        print("5) Price Summary")
+        print("6) View Prices of a Product")
+        print("7) Sell")
+        print("8) Search Prices by ID Prefix")
         print("0) Back to Main Menu")
         choice = input("Choose option: ")
         if choice == '1':
@@ -482,6 +460,14 @@ def manage_prices_menu():
             delete_price()
         elif choice == '4':
             view_prices()
+        elif choice == '5':
+            view_price_summary()
+        elif choice == '6':
+            view_prices_of_product()
+        elif choice == '7':
+            sell_item()
+        elif choice == '8':
+            search_prices_by_prefix()
         elif choice == '0':
             break
         else:
@@ -509,6 +495,40 @@ def manage_promotions_menu():
         else:
             print("Invalid option")
 
+def maintenance_menu():
+    while True:
+        print("\n--- Maintenance ---")
+        print("1) Rebuild Indexes")
+        print("2) Compact Data Files")
+        print("3) Search Log")
+        print("4) Verify Indexes")
+        print("5) Cache Statistics")
+        print("6) Take Snapshot")
+        print("7) List Snapshots")
+        print("0) Back to Main Menu")
+        choice = input("Choose option: ")
+        if choice == '1':
+            rebuild_indexes()
+        elif choice == '2':
+            compact_all()
+        elif choice == '3':
+            search_log()
+        elif choice == '4':
+            verify_indexes()
+        elif choice == '5':
+            cache_statistics()
+        elif choice == '6':
+            try:
+                take_snapshot()
+            except Exception as e:
+                print("Error taking snapshot:", e)
+        elif choice == '7':
+            list_snapshots()
+        elif choice == '0':
+            break
+        else:
+            print("Invalid option")
+
 def main_menu():
     while True:
         print("\n===== Burger Shop Management =====")
@@ -516,6 +536,7 @@ def main_menu():
         print("2) Manage Prices")
         print("3) Manage Promotions")
         print("4) Generate Report")
+        print("5) Maintenance")
         print("0) Exit")
         print("===================================")
         choice = input("Choose option: ")
@@ -527,11 +548,310 @@ def main_menu():
             manage_promotions_menu()
         elif choice == '4':
             generate_report()
+        elif choice == '5':
+            maintenance_menu()
         elif choice == '0':
+            checkpoint_all()
+            events.shutdown()
+            logger.shutdown()
+            instrument.dump()
             print("Goodbye!")
             break
         else:
             print("Invalid option")
 
+# --- Command Line ---
+
+def cli_import(args):
+    import bulk_io
+    kind = args.kind or bulk_io.guess_kind(args.file)
+    if kind is None:
+        print("Cannot tell what the file holds; pass --kind products|prices|promotions", file=sys.stderr)
+        return 2
+    try:
+        added, rejected = bulk_io.import_records(kind, args.file, args.format, args.skip_invalid)
+    except storage.ConflictError as e:
+        # Another process added one of the keys after the rows were checked
+        print(f"{e}; nothing imported", file=sys.stderr)
+        log_event("USER", f"Import {kind} from {args.file}", "FAILED", str(e))
+        return 1
+    if rejected and not args.skip_invalid:
+        print(f"{rejected} invalid row(s), nothing imported (use --skip-invalid to import the rest)", file=sys.stderr)
+        log_event("USER", f"Import {kind} from {args.file}", "FAILED", f"{rejected} invalid rows")
+        return 1
+    log_event("USER", f"Import {kind} from {args.file}", detail=f"{added} added, {rejected} rejected")
+    print(f"Imported {added} {kind}, rejected {rejected}.")
+    return 0
+
+def cli_export(args):
+    import bulk_io
+    fmt = args.format or (bulk_io.guess_format(args.file) if args.file else "csv")
+    if args.file:
+        with open(args.file, "w", newline="", encoding="utf-8") as out:
+            count = bulk_io.export_records(args.kind, out, fmt)
+        print(f"Exported {count} {args.kind} to {args.file}.")
+    else:
+        count = bulk_io.export_records(args.kind, sys.stdout, fmt)
+    log_event("USER", f"Export {args.kind}", detail=f"{count} records")
+    return 0
+
+def cli_migrate(args):
+    pending = 0
+    for filename, status in migrate_files(check=args.check):
+        if status in ("missing", "current"):
+            print(f"{filename}: {status}")
+        else:
+            pending += 1
+            print(f"{filename}: {status} -> {'needs migration' if args.check else 'migrated'}")
+    return 1 if args.check and pending else 0
+
+def cli_sell(args):
+    import bulk_io
+    if args.orders is None:
+        if args.pro_id is None or args.pro_size is None:
+            print("Give PRO_ID SIZE [QTY] or --orders FILE", file=sys.stderr)
+            return 2
+        try:
+            left = sales.sell(args.pro_id, args.pro_size, args.qty)
+        except sales.SaleError as e:
+            log_event("USER", f"Sell Product ID {args.pro_id} size {args.pro_size}", "REJECTED", str(e))
+            print(f"Sale rejected: {e}", file=sys.stderr)
+            return 1
+        log_event("USER", f"Sell Product ID {args.pro_id} size {args.pro_size}", detail=f"qty {args.qty}, {left} left")
+        print(f"Sold {args.qty}; {left} left in stock.")
+        return 0
+
+    # Orders are sent in chunks; each chunk is one lock and one fsync
+    sold = rejected = 0
+    chunk = []
+
+    def commit():
+        nonlocal sold, rejected
+        for (order_id, _), (ok, result) in zip(chunk, sales.process_orders([lines for _, lines in chunk])):
+            if ok:
+                sold += 1
+            else:
+                rejected += 1
+                print(f"{order_id}: {result}", file=sys.stderr)
+        chunk.clear()
+
+    bad_row = None
+    try:
+        for order in bulk_io.read_orders(args.orders, args.format):
+            chunk.append(order)
+            if len(chunk) >= bulk_io.ORDERS_PER_COMMIT:
+                commit()
+    except bulk_io.RowError as e:
+        bad_row = e
+    if chunk:
+        commit()
+    if bad_row is not None:
+        print(f"{bad_row}\nStopped at this row; the orders before it were processed.", file=sys.stderr)
+    log_event("USER", f"Sell orders from {args.orders}", "FAILED" if bad_row else "OK",
+              f"{sold} sold, {rejected} rejected")
+    print(f"{sold} order(s) sold, {rejected} rejected.")
+    return 0 if rejected == 0 and bad_row is None else 1
+
+def cli_convert(args):
+    import sqlite_store
+    try:
+        copied = sqlite_store.convert(args.to, replace=args.replace)
+    except ValueError as e:
+        print(f"{e} (use --replace to overwrite it)", file=sys.stderr)
+        return 1
+    # Record numbers differ between the backends
+    drop_report_cache()
+    catalog.clear()
+    summary = ", ".join(f"{count} {name}s" for name, count in copied)
+    log_event("USER", f"Convert data to {args.to}", detail=summary)
+    print(f"Copied {summary} to the {args.to} backend.")
+    return 0
+
+def cli_snapshot(args):
+    if args.list:
+        list_snapshots()
+        return 0
+    return 0 if take_snapshot() is not None else 2
+
+def cli_restore(args):
+    if backend.name != "files":
+        print("Snapshots copy the data files; they are not available with the sqlite backend.", file=sys.stderr)
+        return 2
+    try:
+        restore_snapshot(args.snapshot)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+def cli_report(args):
+    generate_report(echo=False, workers=args.workers)
+    print(f"Report written to {REPORT_FILE}.")
+    return 0
+
+def stop_on_sigterm():
+    # Servers stop on SIGTERM the same way as on Ctrl+C
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+
+def cli_serve(args):
+    server = writer.WriterServer(args.socket, [get_store() for _, get_store in STORES],
+                                 batch_size=args.batch, sync=args.sync,
+                                 batch_context=sales.group_commit,
+                                 on_batch=lambda n: price_manager.maybe_merge())
+    stop_on_sigterm()
+    print(f"Writer daemon listening on {args.socket}")
+    print(f"Point terminals at it with {writer.WRITER_SOCKET_ENV}={os.path.abspath(args.socket)}")
+    log_event("SYSTEM", "Start writer daemon", detail=args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        checkpoint_all()
+        log_event("SYSTEM", "Stop writer daemon", detail=f"{server.applied} mutations in {server.batches} batches")
+    return 0
+
+def cli_api(args):
+    import http_api
+    server = http_api.ApiServer(args.host, args.port, [get_store() for _, get_store in STORES],
+                                read_threads=args.threads, batch_size=args.batch, sync=args.sync)
+    stop_on_sigterm()
+    print(f"HTTP API listening on http://{args.host}:{args.port}/")
+    log_event("SYSTEM", "Start HTTP API", detail=f"{args.host}:{args.port}")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        checkpoint_all()
+        log_event("SYSTEM", "Stop HTTP API",
+                  detail=f"{server.requests} requests, {server.applied} writes in {server.batches} batches")
+    return 0
+
+def cli_watch(args):
+    # Prints the events every process pointed at the socket sends
+    def show(event):
+        print(events.to_json(event) if args.json else events.describe(event), flush=True)
+
+    listener = events.EventListener(args.socket, show)
+    stop_on_sigterm()
+    print(f"Watching for price and stock events on {args.socket}", file=sys.stderr)
+    print(f"Point terminals at it with {events.EVENTS_SOCKET_ENV}={os.path.abspath(args.socket)}", file=sys.stderr)
+    try:
+        listener.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.server_close()
+    return 0
+
+def cli(argv):
+    parser = argparse.ArgumentParser(prog="main.py", description="Burger Shop Management")
+    parser.add_argument("--stats", action="store_true",
+                        help=f"time hot paths and print a summary at exit (or set {instrument.STATS_ENV}=1)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help=f"also run cProfile and write pstats to FILE (or set {instrument.PROFILE_ENV}=FILE)")
+    parser.add_argument("--sorted-prices", action="store_true",
+                        help=f"keep prices.dat in key order for range queries (or set {storage.SORTED_ENV}=1)")
+    parser.add_argument("--log-fsync", type=int, metavar="N",
+                        help=f"fsync {LOG_FILE} after every N events, 1 for every one (or set {logger.FSYNC_ENV}=N)")
+    parser.add_argument("--backend", choices=backend.BACKENDS,
+                        help=f"storage engine (default: {backend.BACKEND_ENV} or files)")
+    sub = parser.add_subparsers(dest="command", help="run one command instead of the interactive menu")
+
+    p = sub.add_parser("import", help="bulk load records from CSV or JSON Lines")
+    p.add_argument("file")
+    p.add_argument("--kind", choices=("products", "prices", "promotions"),
+                   help="record type (guessed from the file name if omitted)")
+    p.add_argument("--format", choices=("csv", "jsonl"), help="file format (guessed from the extension if omitted)")
+    p.add_argument("--skip-invalid", action="store_true", help="import valid rows even if some rows are invalid")
+    p.set_defaults(func=cli_import)
+
+    p = sub.add_parser("export", help="write records as CSV or JSON Lines")
+    p.add_argument("kind", choices=("products", "prices", "promotions"))
+    p.add_argument("file", nargs="?", help="output file (stdout if omitted)")
+    p.add_argument("--format", choices=("csv", "jsonl"))
+    p.set_defaults(func=cli_export)
+
+    p = sub.add_parser("migrate", help="upgrade data files to the current format")
+    p.add_argument("--check", action="store_true", help="only report which files need migrating")
+    p.set_defaults(func=cli_migrate)
+
+    p = sub.add_parser("sell", help="sell one item, or every order in a CSV/JSONL file")
+    p.add_argument("pro_id", nargs="?")
+    p.add_argument("pro_size", nargs="?")
+    p.add_argument("qty", nargs="?", type=int, default=1)
+    p.add_argument("--orders", help="file with pro_id, pro_size, qty and optional order_id columns")
+    p.add_argument("--format", choices=("csv", "jsonl"))
+    p.set_defaults(func=cli_sell)
+
+    p = sub.add_parser("convert", help="copy all records between the data files and the SQLite database")
+    p.add_argument("--to", required=True, choices=("sqlite", "files"), help="backend to copy into")
+    p.add_argument("--replace", action="store_true", help="overwrite records already in the target backend")
+    p.set_defaults(func=cli_convert)
+
+    p = sub.add_parser("snapshot", help="save a point-in-time copy of the data files (only what changed since the last one)")
+    p.add_argument("--list", action="store_true", help="list the snapshots instead")
+    p.set_defaults(func=cli_snapshot)
+
+    p = sub.add_parser("restore", help="put the data files back as they were in a snapshot")
+    p.add_argument("snapshot", help="snapshot ID (see snapshot --list)")
+    p.set_defaults(func=cli_restore)
+
+    p = sub.add_parser("report", help=f"write {REPORT_FILE}")
+    p.add_argument("--workers", type=int,
+                   help="processes rendering rows (default: one per core for large files; 1 renders serially)")
+    p.set_defaults(func=cli_report)
+
+    p = sub.add_parser("serve", help="run the single-writer daemon that batches mutations from all terminals")
+    p.add_argument("--socket", default=writer.WRITER_SOCKET, help=f"Unix socket path (default {writer.WRITER_SOCKET})")
+    p.add_argument("--batch", type=int, default=writer.BATCH_SIZE, help="most mutations applied under one lock")
+    p.add_argument("--sync", action="store_true", help="fsync the data files after every batch")
+    p.set_defaults(func=cli_serve)
+
+    p = sub.add_parser("api", help="serve products, prices, promotions, sales and reports over local HTTP/JSON")
+    p.add_argument("--host", default="127.0.0.1", help="address to listen on (default 127.0.0.1)")
+    p.add_argument("--port", type=int, default=8080, help="TCP port (default 8080)")
+    p.add_argument("--threads", type=int, default=4, help="threads answering reads")
+    p.add_argument("--batch", type=int, default=writer.BATCH_SIZE, help="most writes applied under one lock")
+    p.add_argument("--sync", action="store_true", help="fsync the data files after every batch")
+    p.set_defaults(func=cli_api)
+
+    p = sub.add_parser("watch", help="print price changes and low-stock events as they happen")
+    p.add_argument("--socket", default=events.EVENTS_SOCKET, help=f"Unix socket path (default {events.EVENTS_SOCKET})")
+    p.add_argument("--json", action="store_true", help="print each event as a JSON line")
+    p.set_defaults(func=cli_watch)
+
+    args = parser.parse_args(argv)
+    instrument.configure(args.stats, args.profile)
+    events.configure()
+    if args.sorted_prices:
+        storage.keep_sorted = True
+    if args.log_fsync is not None:
+        logger.set_durability(args.log_fsync)
+    try:
+        backend.select(args.backend or backend.name)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.command is None:
+        init_files()
+        main_menu()
+        return 0
+    if args.func is not cli_migrate:
+        init_files()
+    try:
+        return args.func(args)
+    finally:
+        if args.func is not cli_migrate:
+            checkpoint_all()
+        events.shutdown()
+        logger.shutdown()
+        instrument.dump()
+
 if __name__ == "__main__":
-    main_menu()
+    sys.exit(cli(sys.argv[1:]))
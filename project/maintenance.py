@@ -0,0 +1,56 @@
+# maintenance.py
+import backend
+import product_manager
+import price_manager
+import promotion_manager
+import schema
+from logger import log_event
+from product_manager import PRODUCT_FILE
+from price_manager import PRICE_FILE
+from promotion_manager import PROMOTION_FILE
+
+STORES = (
+    (PRODUCT_FILE, product_manager.get_store),
+    (PRICE_FILE, price_manager.get_store),
+    (PROMOTION_FILE, promotion_manager.get_store),
+)
+
+def migrate_files(check=False):
+    # Brings every data file to the current header format and schema version.
+    # Each file is rewritten beside the original and renamed over it, so it
+    # can run while the data is in use. Returns (filename, old status) pairs.
+    results = []
+    if backend.name != "files":
+        return results
+    for filename, get_store in STORES:
+        store = get_store()
+        status = schema.file_status(store.schema)
+        results.append((filename, status))
+        if not check and status not in ("missing", "current"):
+            store.upgrade()
+            log_event("SYSTEM", f"Migrate {filename} to format {schema.FORMAT_VERSION}", detail=f"from {status}")
+    return results
+
+def init_files():
+    # A run that died before its last checkpoint left its changes in the
+    # write-ahead logs: finish the committed ones, undo the rest
+    for filename, get_store in STORES:
+        if get_store().recover():
+            log_event("SYSTEM", f"Recover {filename} from write-ahead log")
+    migrate_files()
+    for _, get_store in STORES:
+        get_store().open()
+
+def checkpoint_all():
+    # Sync the data files and empty their write-ahead logs
+    for _, get_store in STORES:
+        get_store().checkpoint()
+# --- Compaction ---
+
+def compact_file(filename, store):
+    kept = store.compact()
+    log_event("SYSTEM", f"Compact {filename}", detail=f"{kept} records kept")
+
+def maybe_compact(filename, store):
+    if store.needs_compaction():
+        compact_file(filename, store)
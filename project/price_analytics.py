@@ -0,0 +1,90 @@
+# price_analytics.py
+# Columnar view of prices.dat for reporting. NumPy is optional: the rest of
+# the program works without it, only these helpers need it.
+import price_manager
+from schema import FILE_HEADER, RECORD_ACTIVE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Mirrors schema.PRICE.struct ('<B10s10sfiB'), packed with no padding
+PRICE_FIELDS = [
+    ('status', 'u1'),
+    ('pro_id', 'S10'),
+    ('pro_size', 'S10'),
+    ('pro_price', '<f4'),
+    ('pro_stock', '<i4'),
+    ('sale_status', 'u1'),
+]
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("price analytics needs numpy (pip install numpy)")
+
+
+def price_dtype():
+    _require_numpy()
+    dtype = np.dtype(PRICE_FIELDS)
+    assert dtype.itemsize == price_manager.PRICE_STRUCT.size
+    return dtype
+
+
+def load_prices_array():
+    # Zero-copy structured array over this process's copy-on-write mapping
+    # of prices.dat, tombstoned rows included (see the 'status' column), read
+    # under a shared lock. It is a snapshot, not a live view: once the store
+    # remaps (appends, compaction, another process's writes) the array keeps
+    # the old mapping, so call again for current data.
+    dtype = price_dtype()
+    store = price_manager.get_store()
+    with store.shared():
+        return np.frombuffer(store.mapping(), dtype=dtype, count=store.count(), offset=FILE_HEADER.size)
+
+
+def live_prices(arr=None):
+    if arr is None:
+        arr = load_prices_array()
+    live = arr['status'] == RECORD_ACTIVE
+    return arr if live.all() else arr[live]
+
+
+def filter_by_sale_status(sale_status, arr=None):
+    arr = live_prices(arr)
+    return arr[arr['sale_status'] == sale_status]
+
+
+def out_of_stock_count(arr=None):
+    arr = live_prices(arr)
+    return int(np.count_nonzero(arr['pro_stock'] <= 0))
+
+
+def _decode(key):
+    return key.decode('utf-8')
+
+
+def stock_value_by_product(arr=None):
+    # pro_id -> sum of price * stock over all sizes
+    arr = live_prices(arr)
+    ids, inverse = np.unique(arr['pro_id'], return_inverse=True)
+    values = arr['pro_price'].astype(np.float64) * arr['pro_stock']
+    totals = np.bincount(inverse, weights=values, minlength=len(ids))
+    return {_decode(pid): float(total) for pid, total in zip(ids, totals)}
+
+
+def price_stats_by_size(arr=None):
+    # pro_size -> (min, max, mean) price
+    arr = live_prices(arr)
+    if len(arr) == 0:
+        return {}
+    sizes, inverse = np.unique(arr['pro_size'], return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    prices = arr['pro_price'].astype(np.float64)[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+    mins = np.minimum.reduceat(prices, starts)
+    maxs = np.maximum.reduceat(prices, starts)
+    means = np.add.reduceat(prices, starts) / np.bincount(inverse)
+    return {_decode(size): (float(lo), float(hi), float(avg))
+            for size, lo, hi, avg in zip(sizes, mins, maxs, means)}
@@ -1,11 +1,194 @@
 # price_manager.py
 import struct
-import os
+from catalog import TableCache
+from records import record_type
+from schema import PRICE
+from storage import ConflictError, RECORD_ACTIVE, decode_string, pad_string
+from writer import mutation
+import backend
+import change_journal
+import events
+import instrument
 
-PRICE_FILE = "prices.dat"
-PRICE_STRUCT = struct.Struct('<i10sfiB')  # pro_id, size, price, stock, status
+PRICE_FILE = PRICE.filename
+PRICE_INDEX_FILE = PRICE.index_file
 
-def init_price_file():
-    if not os.path.exists(PRICE_FILE):
-        with open(PRICE_FILE, 'wb') as f:
-            pass
+PRICE_STRUCT = PRICE.struct
+
+# pro_stock sits at a fixed offset inside each record, so a sale rewrites
+# only those 4 bytes
+PRICE_STOCK = struct.Struct('<i')
+PRICE_STOCK_OFFSET = struct.calcsize('<B10s10sf')
+
+Price = record_type('Price', PRICE, module=__name__)
+
+# Most prices kept decoded in memory; a bigger table is streamed from the file
+PRICE_CACHE_SIZE = 200_000
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = backend.open_store(PRICE)
+    return _store
+
+def price_key(pro_id, pro_size):
+    return pad_string(pro_id, 10) + pad_string(pro_size, 10)
+
+_cache = TableCache("prices", get_store, Price, PRICE_CACHE_SIZE)
+
+def find_price(pro_id, pro_size):
+    return get_store().find(price_key(pro_id, pro_size))
+
+def get_price(recno):
+    return Price(get_store().read_raw(recno))
+
+@instrument.timed("price.load")
+def load_price(pro_id, pro_size):
+    return _cache.get(price_key(pro_id, pro_size))
+
+def iter_prices():
+    for _, price in _cache.items():
+        yield price
+
+def iter_price_items():
+    # (raw key, Price) pairs in file order
+    yield from _cache.items()
+
+def prices_page(offset, limit):
+    # (total, prices offset..offset+limit) in file order
+    return _cache.page(offset, limit)
+
+def price_records_of_product(pro_id):
+    # Record numbers of every price of pro_id, read from the product index
+    return get_store().find_group(pad_string(pro_id, 10))
+
+@instrument.timed("price.of_product")
+def prices_of_product(pro_id):
+    store = get_store()
+    with store.shared():
+        return [Price(store.read_raw(recno)) for recno in price_records_of_product(pro_id)]
+
+def prices_in_range(lo, hi=None):
+    # Prices with lo <= (pro_id, pro_size) < hi in key order; ids compare as
+    # padded bytes, hi=None means no upper bound
+    store = get_store()
+    with store.shared():
+        return [Price(store.read_raw(recno)) for recno in store.find_range(_bound(lo), _bound(hi))]
+
+@instrument.timed("price.with_prefix")
+def prices_with_prefix(prefix):
+    # Prices whose product ID starts with prefix, in key order
+    store = get_store()
+    with store.shared():
+        return [Price(store.read_raw(recno)) for recno in store.find_prefix(prefix.encode('utf-8'))]
+
+def _bound(pro_id):
+    return None if pro_id is None else pad_string(pro_id, 10)
+
+def maybe_merge():
+    # Merges the appended tail into the sorted run once it is long enough.
+    # Merging reorders the file, so the report cache is rebuilt from scratch
+    # afterwards. Returns True if record numbers changed. Inside a caller's
+    # transaction nothing is merged; batch writers call this after the batch.
+    store = get_store()
+    if not store.needs_merge():
+        return False
+    with store.exclusive():
+        # Another process may have merged meanwhile
+        if not store.needs_merge():
+            return False
+        store.merge()
+        change_journal.reset()
+    return True
+
+def price_keys_of_product(pid_b):
+    # Raw price keys under a padded pro_id
+    store = get_store()
+    with store.shared():
+        return [store.key_at(recno) for recno in store.find_group(pid_b)]
+
+# Same locking split as product_manager
+
+@mutation
+@instrument.timed("price.add")
+def add_price_record(pro_id, pro_size, pro_price, pro_stock, sale_status):
+    with get_store().exclusive():
+        recno = get_store().append((RECORD_ACTIVE, pad_string(pro_id, 10), pad_string(pro_size, 10),
+                                    pro_price, pro_stock, sale_status))
+        change_journal.record(change_journal.PRICE, change_journal.ADD, price_key(pro_id, pro_size))
+    if events.enabled:
+        events.price_written(pro_id, pro_size, None, pro_price, pro_stock, sale_status)
+    if maybe_merge():
+        recno = find_price(pro_id, pro_size)
+    return recno
+
+@mutation
+@instrument.timed("price.add_many")
+def add_price_records(rows):
+    # rows: iterable of (pro_id, pro_size, pro_price, pro_stock, sale_status); one append for all
+    records = [(RECORD_ACTIVE, pad_string(pid, 10), pad_string(size, 10), price, stock, status)
+               for pid, size, price, stock, status in rows]
+    with get_store().exclusive():
+        get_store().append_many(records)
+        change_journal.record_many(change_journal.PRICE, change_journal.ADD, [r[1] + r[2] for r in records])
+    if events.enabled:
+        for _, pid, size, price, stock, status in records:
+            events.price_written(decode_string(pid), decode_string(size), None, price, stock, status)
+    maybe_merge()
+    return len(records)
+
+def update_price_record(recno, pro_id, pro_size, pro_price, pro_stock, sale_status):
+    with get_store().exclusive():
+        get_store().write(recno, (RECORD_ACTIVE, pad_string(pro_id, 10), pad_string(pro_size, 10),
+                                  pro_price, pro_stock, sale_status))
+        change_journal.record(change_journal.PRICE, change_journal.UPDATE, price_key(pro_id, pro_size))
+
+def set_stock(recno, pro_stock):
+    # Caller holds the exclusive lock and journals the change
+    get_store().patch(recno, PRICE_STOCK_OFFSET, PRICE_STOCK, pro_stock)
+
+def delete_price_record(recno):
+    store = get_store()
+    with store.exclusive():
+        key = store.key_at(recno)
+        store.delete(recno)
+        change_journal.record(change_journal.PRICE, change_journal.DELETE, key)
+
+@mutation
+@instrument.timed("price.update")
+def update_price(pro_id, pro_size, pro_price, pro_stock, sale_status, expected=None):
+    # False if the price is gone; ConflictError if it no longer equals `expected`
+    with get_store().exclusive():
+        recno = find_price(pro_id, pro_size)
+        if recno is None:
+            return False
+        old = get_price(recno)
+        if expected is not None and tuple(old) != tuple(expected):
+            raise ConflictError(f"price {pro_id} size {pro_size} was changed by someone else; "
+                                f"reload it and try again")
+        update_price_record(recno, pro_id, pro_size, pro_price, pro_stock, sale_status)
+    if events.enabled:
+        events.price_written(old.pro_id, old.pro_size, old, pro_price, pro_stock, sale_status)
+    return True
+
+@mutation
+@instrument.timed("price.delete")
+def delete_price(pro_id, pro_size):
+    with get_store().exclusive():
+        recno = find_price(pro_id, pro_size)
+        if recno is None:
+            return False
+        delete_price_record(recno)
+    return True
+
+@mutation
+@instrument.timed("price.delete_of_product")
+def delete_prices_of_product(pro_id):
+    # Returns the number of price records removed
+    with get_store().exclusive():
+        matches = price_records_of_product(pro_id)
+        for recno in matches:
+            delete_price_record(recno)
+    return len(matches)
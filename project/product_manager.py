@@ -1,11 +1,107 @@
 # product_manager.py
-import struct
-import os
+from catalog import TableCache
+from records import record_type
+from schema import PRODUCT
+from storage import ConflictError, RECORD_ACTIVE, pad_string
+from writer import mutation
+import backend
+import change_journal
+import instrument
 
-PRODUCT_FILE = "products.dat"
-PRODUCT_STRUCT = struct.Struct('<i30si')  # pro_id, pro_name, promotion_id
+PRODUCT_FILE = PRODUCT.filename
+PRODUCT_INDEX_FILE = PRODUCT.index_file
 
-def init_product_file():
-    if not os.path.exists(PRODUCT_FILE):
-        with open(PRODUCT_FILE, 'wb') as f:
-            pass  # สร้างไฟล์เปล่า
+PRODUCT_STRUCT = PRODUCT.struct
+
+Product = record_type('Product', PRODUCT, module=__name__)
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = backend.open_store(PRODUCT)
+    return _store
+
+def product_key(pro_id):
+    return pad_string(pro_id, 10)
+
+_cache = TableCache("products", get_store, Product)
+
+def find_product(pro_id):
+    return get_store().find(product_key(pro_id))
+
+def get_product(recno):
+    return Product(get_store().read_raw(recno))
+
+@instrument.timed("product.load")
+def load_product(pro_id):
+    # Product or None, looked up and read as one step
+    return _cache.get(product_key(pro_id))
+
+def iter_products():
+    for _, product in _cache.items():
+        yield product
+
+def products_page(offset, limit):
+    # (total, products offset..offset+limit) in file order
+    return _cache.page(offset, limit)
+
+# Mutations hold the store's exclusive lock for the write and its journal
+# entry. The record-number variants are for callers already holding it; the
+# others look the key up under the same lock and may run in the writer daemon.
+
+@mutation
+@instrument.timed("product.add")
+def add_product_record(pro_id, pro_name, promotion_id):
+    # Raises ConflictError if pro_id already exists
+    with get_store().exclusive():
+        recno = get_store().append((RECORD_ACTIVE, pad_string(pro_id, 10), pad_string(pro_name, 30), promotion_id))
+        change_journal.record(change_journal.PRODUCT, change_journal.ADD, product_key(pro_id))
+    return recno
+
+@mutation
+@instrument.timed("product.add_many")
+def add_product_records(rows):
+    # rows: iterable of (pro_id, pro_name, promotion_id); one append for all
+    records = [(RECORD_ACTIVE, pad_string(pid, 10), pad_string(name, 30), promo) for pid, name, promo in rows]
+    with get_store().exclusive():
+        get_store().append_many(records)
+        change_journal.record_many(change_journal.PRODUCT, change_journal.ADD, [r[1] for r in records])
+    return len(records)
+
+def update_product_record(recno, pro_id, pro_name, promotion_id):
+    with get_store().exclusive():
+        get_store().write(recno, (RECORD_ACTIVE, pad_string(pro_id, 10), pad_string(pro_name, 30), promotion_id))
+        change_journal.record(change_journal.PRODUCT, change_journal.UPDATE, product_key(pro_id))
+
+def delete_product_record(recno):
+    store = get_store()
+    with store.exclusive():
+        key = store.key_at(recno)
+        store.delete(recno)
+        change_journal.record(change_journal.PRODUCT, change_journal.DELETE, key)
+
+@mutation
+@instrument.timed("product.update")
+def update_product(pro_id, pro_name, promotion_id, expected=None):
+    # False if pro_id is gone; ConflictError if the stored product no longer
+    # equals `expected` (what the caller read before editing)
+    with get_store().exclusive():
+        recno = find_product(pro_id)
+        if recno is None:
+            return False
+        if expected is not None and tuple(get_product(recno)) != tuple(expected):
+            raise ConflictError(f"product {pro_id} was changed by someone else; reload it and try again")
+        update_product_record(recno, pro_id, pro_name, promotion_id)
+    return True
+
+@mutation
+@instrument.timed("product.delete")
+def delete_product(pro_id):
+    with get_store().exclusive():
+        recno = find_product(pro_id)
+        if recno is None:
+            return False
+        delete_product_record(recno)
+    return True
@@ -1,11 +1,108 @@
 # promotion_manager.py
 import struct
-import os
+from catalog import TableCache
+from records import record_type
+from schema import PROMOTION
+from storage import ConflictError, RECORD_ACTIVE, pad_string
+from writer import mutation
+import backend
+import change_journal
+import instrument
 
-PROMOTION_FILE = "promotions.dat"
-PROMOTION_STRUCT = struct.Struct('<i30s')  # promotion_id, promotion_name
+PROMOTION_FILE = PROMOTION.filename
+PROMOTION_INDEX_FILE = PROMOTION.index_file
 
-def init_promotion_file():
-    if not os.path.exists(PROMOTION_FILE):
-        with open(PROMOTION_FILE, 'wb') as f:
-            pass
+PROMOTION_STRUCT = PROMOTION.struct
+PROMOTION_KEY = struct.Struct('<i')
+
+Promotion = record_type('Promotion', PROMOTION, module=__name__)
+
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = backend.open_store(PROMOTION)
+    return _store
+
+def promotion_key(promotion_id):
+    return PROMOTION_KEY.pack(promotion_id)
+
+_cache = TableCache("promotions", get_store, Promotion)
+
+def find_promotion(promotion_id):
+    return get_store().find(promotion_key(promotion_id))
+
+def get_promotion(recno):
+    return Promotion(get_store().read_raw(recno))
+
+@instrument.timed("promotion.load")
+def load_promotion(promotion_id):
+    return _cache.get(promotion_key(promotion_id))
+
+def iter_promotions():
+    for _, promotion in _cache.items():
+        yield promotion
+
+def promotions_page(offset, limit):
+    # (total, promotions offset..offset+limit) in file order
+    return _cache.page(offset, limit)
+
+def promotion_names():
+    # promotion_id -> promotion_name; shared by every caller, do not modify
+    return _cache.derived("names", lambda items: {p.promotion_id: p.promotion_name for _, p in items})
+
+# Same locking split as product_manager
+
+@mutation
+@instrument.timed("promotion.add")
+def add_promotion_record(promotion_id, promotion_name):
+    with get_store().exclusive():
+        recno = get_store().append((RECORD_ACTIVE, promotion_id, pad_string(promotion_name, 30)))
+        change_journal.record(change_journal.PROMOTION, change_journal.ADD, promotion_key(promotion_id))
+    return recno
+
+@mutation
+@instrument.timed("promotion.add_many")
+def add_promotion_records(rows):
+    # rows: iterable of (promotion_id, promotion_name); one append for all
+    records = [(RECORD_ACTIVE, promo_id, pad_string(name, 30)) for promo_id, name in rows]
+    with get_store().exclusive():
+        get_store().append_many(records)
+        change_journal.record_many(change_journal.PROMOTION, change_journal.ADD,
+                                   [promotion_key(r[1]) for r in records])
+    return len(records)
+
+def update_promotion_record(recno, promotion_id, promotion_name):
+    with get_store().exclusive():
+        get_store().write(recno, (RECORD_ACTIVE, promotion_id, pad_string(promotion_name, 30)))
+        change_journal.record(change_journal.PROMOTION, change_journal.UPDATE, promotion_key(promotion_id))
+
+def delete_promotion_record(recno):
+    store = get_store()
+    with store.exclusive():
+        key = store.key_at(recno)
+        store.delete(recno)
+        change_journal.record(change_journal.PROMOTION, change_journal.DELETE, key)
+
+@mutation
+@instrument.timed("promotion.update")
+def update_promotion(promotion_id, promotion_name, expected=None):
+    with get_store().exclusive():
+        recno = find_promotion(promotion_id)
+        if recno is None:
+            return False
+        if expected is not None and tuple(get_promotion(recno)) != tuple(expected):
+            raise ConflictError(f"promotion {promotion_id} was changed by someone else; reload it and try again")
+        update_promotion_record(recno, promotion_id, promotion_name)
+    return True
+
+@mutation
+@instrument.timed("promotion.delete")
+def delete_promotion(promotion_id):
+    with get_store().exclusive():
+        recno = find_promotion(promotion_id)
+        if recno is None:
+            return False
+        delete_promotion_record(recno)
+    return True
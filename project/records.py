@@ -0,0 +1,119 @@
+# records.py
+import re
+import struct
+import instrument
+from schema import RECORD_ACTIVE
+from storage import KEY_OFFSET, decode_string
+
+# Record objects that wrap the raw bytes of one record (status byte
+# included) instead of holding unpacked fields. Numbers are unpacked when
+# read; strings are decoded on first access and kept in a slot, so a scan
+# that only looks at keys never decodes UTF-8. The key is compared as raw
+# padded bytes. Iteration, equality with tuples, _fields and _asdict()
+# behave as for a namedtuple of the decoded fields.
+
+
+class _Text:
+    # NUL-padded UTF-8 field, decoded once
+    __slots__ = ("start", "end", "slot")
+
+    def __init__(self, start, size, slot):
+        self.start, self.end, self.slot = start, start + size, slot
+
+    def __get__(self, rec, owner=None):
+        if rec is None:
+            return self
+        try:
+            return getattr(rec, self.slot)
+        except AttributeError:
+            value = decode_string(rec._buf[self.start:self.end])
+            if instrument.enabled:
+                instrument.count("strings.decoded")
+            setattr(rec, self.slot, value)
+            return value
+
+
+class _Number:
+    __slots__ = ("struct", "start")
+
+    def __init__(self, start, code):
+        self.struct, self.start = struct.Struct('<' + code), start
+
+    def __get__(self, rec, owner=None):
+        if rec is None:
+            return self
+        return self.struct.unpack_from(rec._buf, self.start)[0]
+
+
+class Record:
+    __slots__ = ("_buf",)
+    schema = None
+    _fields = ()
+    _text_sizes = {}
+
+    def __init__(self, buf):
+        self._buf = buf if type(buf) is bytes else bytes(buf)
+
+    @classmethod
+    def from_fields(cls, *values):
+        # Build a live record from decoded field values
+        packed = [v.encode('utf-8')[:cls._text_sizes[name]] if name in cls._text_sizes else v
+                  for name, v in zip(cls._fields, values)]
+        return cls(cls.schema.struct.pack(RECORD_ACTIVE, *packed))
+
+    @property
+    def key(self):
+        return self._buf[KEY_OFFSET:KEY_OFFSET + self.schema.key_size]
+
+    @property
+    def raw(self):
+        return self._buf
+
+    def __iter__(self):
+        for name in self._fields:
+            yield getattr(self, name)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self._buf[KEY_OFFSET:] == other._buf[KEY_OFFSET:]
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self._buf[KEY_OFFSET:])
+
+    def __reduce__(self):
+        return type(self), (self._buf,)
+
+    def __repr__(self):
+        body = ", ".join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({body})"
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+
+def record_type(name, schema, module):
+    # Record subclass with one attribute per schema field after the status
+    # byte. module: the defining module's __name__, so instances pickle by
+    # reference (report workers get records that way).
+    ns = {"__slots__": (), "schema": schema, "_fields": schema.fields[1:], "_text_sizes": {}}
+    slots = []
+    offset = 0
+    codes = re.findall(r'(\d*)([a-zA-Z?])', schema.struct.format.lstrip('<>=!@'))
+    for field, (count, code) in zip(schema.fields, codes):
+        if field != "status":
+            if code == 's':
+                slots.append("_" + field)
+                ns[field] = _Text(offset, int(count), "_" + field)
+                ns["_text_sizes"][field] = int(count)
+            else:
+                ns[field] = _Number(offset, count + code)
+        offset += struct.calcsize('<' + count + code)
+    ns["__slots__"] = tuple(slots)
+    ns["__module__"] = module
+    return type(name, (Record,), ns)
@@ -1,27 +1,254 @@
 # report.py
+import functools
 import os
-from logger import log_event
-
-def generate_report():
-    lines = []
-    lines.append("===== BURGER SHOP REPORT =====")
-    lines.append("Generated by System")
-    lines.append("")
-
-    def count_records(file_path, size):
-        if not os.path.exists(file_path):
-            return 0
-        with open(file_path, 'rb') as f:
-            data = f.read()
-            return len(data) // size
-
-    lines.append(f"Total Products: {count_records('products.dat', 38)}")
-    lines.append(f"Total Prices: {count_records('prices.dat', 23)}")
-    lines.append(f"Total Promotions: {count_records('promotions.dat', 34)}")
-    lines.append("")
-
-    with open("report.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
-
-    log_event("SYSTEM", "Generate report", "OK", "report.txt created")
-    print("Report generated as 'report.txt'")
+import pickle
+import sys
+from datetime import datetime
+import backend
+import change_journal
+import instrument
+import logger
+import log_reader
+import product_manager
+import price_manager
+import promotion_manager
+import report_parallel
+import sales
+from locking import hold_all
+from logger import log_event, LOG_FILE
+from maintenance import STORES
+
+REPORT_FILE = "report.txt"
+
+REPORT_BORDER = "+------------+---------------------------+-------------+-------------------+---------+-------+--------+------------+\n"
+REPORT_HEADER = (
+    REPORT_BORDER +
+    "| Product ID | Product Name              | Size        | Promotion Name    | Price   | Stock | Sold   | Status     |\n" +
+    REPORT_BORDER
+)
+REPORT_BUFFER_SIZE = 1 << 16
+
+# Rendered rows are cached (keyed by pro_id + pro_size) so the next report
+# only re-renders rows named in the change journal. Above this many price
+# records the cache is skipped and the report is streamed from scratch.
+REPORT_CACHE_FILE = "report.cache"
+REPORT_CACHE_MAX_ROWS = 500_000
+REPORT_LAYOUT = 2     # bump when the row format changes to drop old caches
+# Distinct product and promotion names kept shortened between rows
+REPORT_SHORTEN_CACHE = 1 << 16
+
+def report_product_info():
+    # product_id -> (product_name, promotion_name)
+    promo_dict = promotion_manager.promotion_names()
+    product_info = {}
+    for p in product_manager.iter_products():
+        product_info[p.pro_id] = (p.pro_name, promo_dict.get(p.promotion_id, "No Promotion"))
+    return product_info
+
+@functools.lru_cache(maxsize=REPORT_SHORTEN_CACHE)
+def shorten_name(text, width):
+    # Every price of a product, and every product of a promotion, repeats
+    # the same name; shorten each one once
+    from textwrap import shorten
+    return shorten(text, width=width, placeholder="...")
+
+def format_report_row(p, product_info, sold=0):
+    pname, promo_name = product_info.get(p.pro_id, ("Unknown", "No Promotion"))
+    return format_report_line(p, pname, promo_name, sold)
+
+def format_report_line(p, pname, promo_name, sold):
+    pname_short = shorten_name(pname, 25)
+    promo_short = shorten_name(promo_name, 20)
+    status_text = "Ready" if p.sale_status == 1 else "Not Ready"
+    return f"| {p.pro_id:<10} | {pname_short:<25} | {p.pro_size:<11} | {promo_short:<17} | {p.pro_price:<7.2f} | {p.pro_stock:<5} | {sold:<6} | {status_text:<10} |\n"
+
+def iter_report_rows(product_info, sold, workers=1):
+    # Streams price records straight from the mapped file, one row at a time,
+    # or one chunk at a time from the worker processes
+    if workers > 1:
+        for chunk in render_parallel(product_info, sold, workers):
+            for _, row in chunk:
+                yield row
+        return
+    for key, p in price_manager.iter_price_items():
+        yield format_report_row(p, product_info, sold.get(key, 0))
+
+def iter_joined_rows(sold):
+    # SQLite backend: the prices with their product and promotion names come
+    # from one join, in the same order as the other report paths
+    import sqlite_store
+    for key, p, pname, promo_name in sqlite_store.report_rows():
+        yield format_report_line(p, pname, promo_name, sold.get(key, 0))
+
+def render_parallel(product_info, sold, workers):
+    return report_parallel.render_rows(price_manager.get_store(), price_manager.Price, format_report_row,
+                                       product_info, sold, workers)
+
+def report_workers(workers=None):
+    # None: one per core once the price file is big enough to pay for them
+    if backend.name != "files":
+        return 1
+    if workers is not None:
+        return max(1, workers)
+    if price_manager.get_store().live_count() < report_parallel.PARALLEL_MIN_ROWS:
+        return 1
+    return report_parallel.default_workers()
+
+def load_report_cache():
+    try:
+        with open(REPORT_CACHE_FILE, 'rb') as f:
+            cache = pickle.load(f)
+        if isinstance(cache, dict) and "token" in cache and cache.get("layout") == REPORT_LAYOUT:
+            return cache
+        return None
+    except Exception:
+        return None
+
+def save_report_cache(rows):
+    token = change_journal.reset()
+    tmp = REPORT_CACHE_FILE + ".tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump({"token": token, "layout": REPORT_LAYOUT, "rows": rows}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, REPORT_CACHE_FILE)
+
+def drop_report_cache():
+    change_journal.reset()
+    if os.path.exists(REPORT_CACHE_FILE):
+        os.remove(REPORT_CACHE_FILE)
+
+def build_report_rows(product_info, sold, workers=1):
+    if workers > 1:
+        rows = {}
+        for chunk in render_parallel(product_info, sold, workers):
+            rows.update(chunk)
+        return rows
+    return {key: format_report_row(p, product_info, sold.get(key, 0))
+            for key, p in price_manager.iter_price_items()}
+
+def update_report_rows(product_info, sold, workers=1):
+    # Returns (rows in file order, number of rows rendered). Falls back to a
+    # full rebuild when the cache or journal is missing, corrupt or mismatched.
+    cache = load_report_cache()
+    journal = change_journal.read()
+    if cache is None or journal is None or journal[0] != cache["token"]:
+        rows = build_report_rows(product_info, sold, workers)
+        return rows, len(rows)
+
+    rows = cache["rows"]
+    dirty = set()
+    moved = set()
+    dirty_products = set()
+    dirty_promos = set()
+    for rtype, op, key in journal[1]:
+        if rtype == change_journal.PRICE:
+            dirty.add(key)
+            if op != change_journal.UPDATE:
+                moved.add(key)
+        elif rtype == change_journal.PRODUCT:
+            dirty_products.add(key[:10])
+        elif rtype == change_journal.PROMOTION:
+            dirty_promos.add(key[:promotion_manager.PROMOTION_KEY.size])
+
+    # A promotion change touches every product using it, a product change
+    # every price row of that product
+    if dirty_promos:
+        for p in product_manager.iter_products():
+            if promotion_manager.promotion_key(p.promotion_id) in dirty_promos:
+                dirty_products.add(product_manager.product_key(p.pro_id))
+    for pid_b in dirty_products:
+        dirty.update(price_manager.price_keys_of_product(pid_b))
+
+    # Re-added rows live at the end of the file now, so they move to the end
+    for key in moved:
+        rows.pop(key, None)
+    fresh = []
+    for key in dirty:
+        recno = price_manager.get_store().find(key)
+        if recno is None:
+            rows.pop(key, None)
+            continue
+        row = format_report_row(price_manager.get_price(recno), product_info, sold.get(key, 0))
+        if key in rows:
+            rows[key] = row
+        else:
+            fresh.append((recno, key, row))
+    for _, key, row in sorted(fresh):
+        rows[key] = row
+    return rows, len(dirty)
+
+@instrument.timed("report")
+def generate_report(echo=True, workers=None):
+    # workers: processes rendering rows on a full rebuild (see report_workers)
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def emit(text):
+        f.write(text)
+        if echo:
+            sys.stdout.write(text)
+
+    if echo:
+        print("\n=== Combined Product & Price Report ===")
+
+    # Shared locks on all three files give one consistent snapshot and keep
+    # writers out until the journal is reset. The report is written to a temp
+    # file and renamed, so readers never see a half-written report.txt.
+    tmp = f"{REPORT_FILE}.{os.getpid()}.tmp"
+    with hold_all([get_store() for _, get_store in STORES]):
+        # The SQLite backend joins the names in; the files need a lookup table
+        joined = backend.name == "sqlite"
+        if not joined:
+            with instrument.span("report.product_info"):
+                product_info = report_product_info()
+        sold = sales.units_sold()
+        workers = report_workers(workers)
+        # Counts come from the file headers so they can be written before the rows
+        with open(tmp, "w", encoding="utf-8", buffering=REPORT_BUFFER_SIZE) as f:
+            f.write("Burger Shop Report\n")
+            f.write(f"Generated: {now}\n\n")
+            f.write(f"Total Products: {product_manager.get_store().live_count()}\n")
+            f.write(f"Total Price Records: {price_manager.get_store().live_count()}\n\n")
+
+            if joined:
+                cached = None
+                row_iter = iter_joined_rows(sold)
+            elif price_manager.get_store().live_count() <= REPORT_CACHE_MAX_ROWS:
+                with instrument.span("report.render_rows"):
+                    cached, rendered = update_report_rows(product_info, sold, workers)
+                row_iter = cached.values()
+            else:
+                cached = None
+                row_iter = iter_report_rows(product_info, sold, workers)
+
+            # Streamed reports render here, so this includes their formatting
+            with instrument.span("report.write_rows"):
+                rows = 0
+                emit(REPORT_HEADER)
+                for row in row_iter:
+                    emit(row)
+                    rows += 1
+                emit(REPORT_BORDER)
+            if echo:
+                print()
+
+            with instrument.span("report.log_tail"):
+                f.write("\nLast 10 Log Events:\n")
+                logger.flush()
+
+                if os.path.exists(LOG_FILE):
+                    for line in log_reader.tail_lines(10, LOG_FILE):
+                        f.write(line)
+                else:
+                    f.write("No log file found.\n")
+
+        with instrument.span("report.save_cache"):
+            if cached is not None:
+                save_report_cache(cached)
+            else:
+                rendered = rows
+                drop_report_cache()
+    os.replace(tmp, REPORT_FILE)
+
+    log_event("SYSTEM", "Generate Report", detail=f"{rows} rows, {rendered} rendered")
+    if echo:
+        print(f"\n✅ Report written to {REPORT_FILE}")
+
@@ -0,0 +1,81 @@
+# report_parallel.py
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import instrument
+from schema import FILE_HEADER, RECORD_ACTIVE
+from storage import KEY_OFFSET
+
+# Renders report rows on several cores. prices.dat is cut into chunks of
+# whole records; each worker maps the file read-only, decodes and formats its
+# chunks, and the parent takes the results back in file order, so the rows
+# come out exactly as the serial loop would write them. The caller must hold
+# the shared lock on prices.dat for the whole call: workers do not lock, they
+# rely on no writer getting in.
+
+# Below this many price records one core is faster than starting workers
+PARALLEL_MIN_ROWS = 50_000
+# Chunks per worker, so a slow chunk does not leave the other cores idle
+CHUNKS_PER_WORKER = 4
+MIN_CHUNK_RECORDS = 4096
+
+# Worker state, set once per process by _init_worker
+_mm = None
+_record_size = 0
+_key_end = 0
+_decode = None
+_format = None
+_product_info = None
+_sold = None
+
+
+def default_workers():
+    # Cores this process may run on
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _init_worker(filename, record_size, key_size, decode, format_row, product_info, sold):
+    # The lookup tables arrive once per worker, not once per chunk
+    global _mm, _record_size, _key_end, _decode, _format, _product_info, _sold
+    with open(filename, 'rb') as f:
+        _mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    _record_size = record_size
+    _key_end = KEY_OFFSET + key_size
+    _decode, _format = decode, format_row
+    _product_info, _sold = product_info, sold
+
+
+def _render_chunk(start, stop):
+    # [(raw key, row text)] for the live records in [start, stop)
+    mm, size, key_end = _mm, _record_size, _key_end
+    rows = []
+    pos = FILE_HEADER.size + start * size
+    for _ in range(start, stop):
+        if mm[pos] == RECORD_ACTIVE:
+            raw = mm[pos:pos + size]
+            key = raw[KEY_OFFSET:key_end]
+            rows.append((key, _format(_decode(raw), _product_info, _sold.get(key, 0))))
+        pos += size
+    return rows
+
+
+def _chunks(count, workers):
+    step = max(MIN_CHUNK_RECORDS, -(-count // (workers * CHUNKS_PER_WORKER)))
+    return [(start, min(start + step, count)) for start in range(0, count, step)]
+
+
+def render_rows(store, decode, format_row, product_info, sold, workers):
+    # Yields the rendered chunks in file order, each a list of (raw key,
+    # row text). format_row(record, product_info, sold) must be a module
+    # level function so it can be sent to the workers.
+    chunks = _chunks(store.count(), workers)
+    if not chunks:
+        return
+    if instrument.enabled:
+        instrument.count("report.chunks", len(chunks))
+    init = (store.filename, store.record_size, store.key_size, decode, format_row, product_info, sold)
+    with ProcessPoolExecutor(min(workers, len(chunks)), initializer=_init_worker, initargs=init) as pool:
+        # map() hands results back in submission order
+        yield from pool.map(_render_chunk, *zip(*chunks))
@@ -0,0 +1,213 @@
+# sales.py
+import os
+import pickle
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+import change_journal
+import events
+import instrument
+import price_manager
+from price_manager import price_key
+from writer import mutation, register_error
+
+# Append-only record of every unit sold. The journal is fsynced once per
+# group commit (one call to sell_batch/process_orders, or one batch of the
+# writer daemon) rather than once per order; the stock changes of a group
+# are one transaction of the price file, committed with one fsync of its
+# write-ahead log.
+SALES_FILE = "sales.jnl"
+SALES_MAGIC = b'FRS1'
+
+# Entry: unix time, price key (pro_id + pro_size), quantity, crc32 of the first three fields
+SALE_ENTRY = struct.Struct('<d20siI')
+SALE_BODY = struct.Struct('<d20si')
+
+# Units-sold totals with the journal offset they cover, so a report only
+# scans the sales made since the previous one
+SALES_SUMMARY_FILE = "sales.sum"
+
+
+@register_error
+class SaleError(ValueError):
+    pass
+
+
+# --- Journal ---
+
+_journal = None
+_group_depth = 0
+_unsynced = False
+
+
+def _open_journal():
+    # Call under the price file's exclusive lock. A snapshot restore may
+    # have replaced the journal since it was opened.
+    global _journal
+    if _journal is not None and os.fstat(_journal.fileno()).st_ino != _journal_inode():
+        _journal.close()
+        _journal = None
+    if _journal is None:
+        _journal = open(SALES_FILE, 'ab')
+        if _journal.tell() == 0:
+            _journal.write(SALES_MAGIC)
+    return _journal
+
+
+def _journal_inode():
+    try:
+        return os.stat(SALES_FILE).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _sync():
+    global _unsynced
+    if _unsynced:
+        os.fsync(_journal.fileno())
+        _unsynced = False
+
+
+@contextmanager
+def group_commit():
+    # Sales made inside share one fsync of the journal, taken when the
+    # outermost group ends
+    global _group_depth
+    _group_depth += 1
+    try:
+        yield
+    finally:
+        _group_depth -= 1
+        if _group_depth == 0:
+            _sync()
+
+
+def iter_sales(offset=0):
+    # Yields (time, price key, qty) from offset on, then returns the offset
+    # after the last complete entry; a torn or corrupt tail is ignored
+    if not os.path.exists(SALES_FILE):
+        return 0
+    with open(SALES_FILE, 'rb') as f:
+        if f.read(len(SALES_MAGIC)) != SALES_MAGIC:
+            return 0
+        offset = max(offset, len(SALES_MAGIC))
+        f.seek(offset)
+        data = f.read()
+    usable = len(data) - len(data) % SALE_ENTRY.size
+    for ts, key, qty, crc in SALE_ENTRY.iter_unpack(memoryview(data)[:usable]):
+        if zlib.crc32(SALE_BODY.pack(ts, key, qty)) != crc:
+            break
+        yield ts, key, qty
+        offset += SALE_ENTRY.size
+    return offset
+
+
+@instrument.timed("sales.units_sold")
+def units_sold():
+    # price key -> total units sold
+    summary = None
+    if os.path.exists(SALES_SUMMARY_FILE):
+        try:
+            with open(SALES_SUMMARY_FILE, 'rb') as f:
+                summary = pickle.load(f)
+        except Exception:
+            summary = None
+    size = os.path.getsize(SALES_FILE) if os.path.exists(SALES_FILE) else 0
+    if not isinstance(summary, dict) or summary.get("offset", 0) > size:
+        summary = {"offset": 0, "totals": {}}
+
+    totals = summary["totals"]
+    entries = iter_sales(summary["offset"])
+    while True:
+        try:
+            _, key, qty = next(entries)
+        except StopIteration as done:
+            offset = done.value
+            break
+        totals[key] = totals.get(key, 0) + qty
+
+    if offset != summary["offset"]:
+        tmp = f"{SALES_SUMMARY_FILE}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump({"offset": offset, "totals": totals}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, SALES_SUMMARY_FILE)
+    return totals
+
+
+# --- Selling ---
+
+def _apply_order(store, lines):
+    # Checks every line before touching anything, so an order is sold whole
+    # or not at all. Returns the stock left after each line.
+    global _unsynced
+    stock = {}
+    plan = []
+    for pro_id, pro_size, qty in lines:
+        qty = int(qty)
+        if qty <= 0:
+            raise SaleError(f"{pro_id} size {pro_size}: quantity must be positive")
+        key = price_key(pro_id, pro_size)
+        if key not in stock:
+            recno = store.find(key)
+            if recno is None:
+                raise SaleError(f"{pro_id} size {pro_size} does not exist")
+            price = price_manager.get_price(recno)
+            if price.sale_status != 1:
+                raise SaleError(f"{pro_id} size {pro_size} is not for sale")
+            stock[key] = [recno, price.pro_stock, price]
+        if qty > stock[key][1]:
+            raise SaleError(f"{pro_id} size {pro_size}: only {stock[key][1]} left, {qty} requested")
+        stock[key][1] -= qty
+        plan.append((key, qty, stock[key][1]))
+
+    for recno, left, _ in stock.values():
+        price_manager.set_stock(recno, left)
+    now = time.time()
+    buf = bytearray()
+    for key, qty, _ in plan:
+        body = SALE_BODY.pack(now, key, qty)
+        buf += body + struct.pack('<I', zlib.crc32(body))
+    journal = _open_journal()
+    journal.write(buf)
+    journal.flush()
+    _unsynced = True
+    change_journal.record_many(change_journal.PRICE, change_journal.UPDATE, list(stock))
+    if events.enabled:
+        for _, left, price in stock.values():
+            events.stock_changed(price.pro_id, price.pro_size, price.pro_stock, left)
+    return [left for _, _, left in plan]
+
+
+@mutation
+@instrument.timed("sales.sell")
+def sell_batch(order_lines):
+    # One order of (pro_id, pro_size, qty) lines; raises SaleError and sells
+    # nothing if any line is unknown, not for sale or short of stock
+    store = price_manager.get_store()
+    with group_commit():
+        with store.exclusive():
+            return _apply_order(store, order_lines)
+
+
+@mutation
+def sell(pro_id, pro_size, qty):
+    # Returns the stock left
+    return sell_batch([(pro_id, pro_size, qty)])[0]
+
+
+@mutation
+@instrument.timed("sales.process_orders")
+def process_orders(orders):
+    # Many independent orders under one lock and one fsync. Returns, per
+    # order, (True, stock left per line) or (False, reason).
+    store = price_manager.get_store()
+    results = []
+    with group_commit():
+        with store.exclusive():
+            for lines in orders:
+                try:
+                    results.append((True, _apply_order(store, lines)))
+                except SaleError as e:
+                    results.append((False, str(e)))
+    return results
@@ -0,0 +1,176 @@
+# schema.py
+import os
+import struct
+from collections import namedtuple
+
+# Single place where every record type and every on-disk layout is defined.
+# Managers, storage, reports and the migration tool all read from here.
+
+# File header: magic, header format, record size, record type tag, schema
+# version of that type, reserved, live records, deleted records
+FILE_HEADER = struct.Struct('<4sHHcBxxII')
+FILE_MAGIC = b'FRDB'
+FORMAT_VERSION = 3
+
+# Format 2 header (no type tag or schema version); files are migrated from it
+FILE_HEADER_V2 = struct.Struct('<4sHHII')
+
+# Every record starts with a status byte; deleted records are tombstoned
+# in place and only reclaimed by compaction
+RECORD_ACTIVE = 0
+RECORD_DELETED = 1
+
+Schema = namedtuple('Schema', 'name tag version filename struct fields key_size '
+                              'index_file legacy group_size group_files sorted_file')
+Header = namedtuple('Header', 'format tag version record_size live dead')
+
+PRODUCT = Schema(
+    name="product", tag=b'P', version=2, filename="products.dat",
+    # status(unsigned char), pro_id(10 bytes string), pro_name(30 bytes string), promotion_id(int)
+    struct=struct.Struct('<B10s30si'),
+    fields=('status', 'pro_id', 'pro_name', 'promotion_id'),
+    key_size=10, index_file="products.idx",
+    # version 1: headerless, no status byte
+    legacy={1: struct.Struct('<10s30si')},
+    group_size=0, group_files=None, sorted_file=None,
+)
+
+PRICE = Schema(
+    name="price", tag=b'R', version=2, filename="prices.dat",
+    # status(unsigned char), pro_id(10 bytes string), pro_size(10 bytes string), pro_price(float), pro_stock(int), sale_status(unsigned char)
+    struct=struct.Struct('<B10s10sfiB'),
+    fields=('status', 'pro_id', 'pro_size', 'pro_price', 'pro_stock', 'sale_status'),
+    key_size=20, index_file="prices.idx",
+    legacy={1: struct.Struct('<10s10sfiB')},
+    # Secondary index pro_id -> price records: heads table + postings list
+    group_size=10, group_files=("prices_by_product.idx", "prices_by_product.lst"),
+    # Optionally kept in key order (pro_id, pro_size): a sorted run plus a
+    # short tail of recent appends, merged as it grows (storage.keep_sorted)
+    sorted_file="prices.sorted",
+)
+
+PROMOTION = Schema(
+    name="promotion", tag=b'M', version=2, filename="promotions.dat",
+    # status(unsigned char), promotion_id(int), promotion_name(30 bytes string)
+    struct=struct.Struct('<Bi30s'),
+    fields=('status', 'promotion_id', 'promotion_name'),
+    key_size=4, index_file="promotions.idx",
+    legacy={1: struct.Struct('<i30s')},
+    group_size=0, group_files=None, sorted_file=None,
+)
+
+SCHEMAS = {s.name: s for s in (PRODUCT, PRICE, PROMOTION)}
+BY_TAG = {s.tag: s for s in SCHEMAS.values()}
+
+_FLOAT32 = struct.Struct('<f')
+
+
+def float32_value(value):
+    # A value of a float32 field ('f', e.g. pro_price) at the precision it is
+    # stored with, for printing and comparing: 7 significant digits
+    return float(f"{_FLOAT32.unpack(_FLOAT32.pack(value))[0]:.7g}")
+
+
+# --- Headers ---
+
+def pack_header(schema, live, dead):
+    return FILE_HEADER.pack(FILE_MAGIC, FORMAT_VERSION, schema.struct.size,
+                            schema.tag, schema.version, live, dead)
+
+
+def parse_header(data):
+    # Header of a format 2 or 3 file, or None for a headerless (version 1) file
+    if len(data) < len(FILE_MAGIC) or data[:len(FILE_MAGIC)] != FILE_MAGIC:
+        return None
+    fmt = struct.unpack_from('<H', data, len(FILE_MAGIC))[0]
+    if fmt == FORMAT_VERSION and len(data) >= FILE_HEADER.size:
+        _, _, record_size, tag, version, live, dead = FILE_HEADER.unpack_from(data)
+        return Header(fmt, tag, version, record_size, live, dead)
+    if fmt == 2 and len(data) >= FILE_HEADER_V2.size:
+        _, _, record_size, live, dead = FILE_HEADER_V2.unpack_from(data)
+        return Header(fmt, None, 2, record_size, live, dead)
+    raise ValueError(f"unknown file format {fmt}")
+
+
+def read_header(path):
+    # Reads only the header bytes; None if the file is missing, empty or headerless
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return parse_header(f.read(FILE_HEADER.size))
+
+
+def header_size(header):
+    return FILE_HEADER.size if header.format == FORMAT_VERSION else FILE_HEADER_V2.size
+
+
+def record_count(schema, path=None):
+    # Live records in O(1): from the header, or from the file size for a
+    # headerless file (which has no tombstones)
+    path = path or schema.filename
+    if not os.path.exists(path):
+        return 0
+    header = read_header(path)
+    if header is None:
+        return os.path.getsize(path) // schema.legacy[1].size
+    return header.live
+
+
+# --- Migration ---
+
+def file_status(schema, path=None):
+    # "missing", "current", or a description of the layout it must be migrated from
+    path = path or schema.filename
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return "missing"
+    header = read_header(path)
+    if header is None:
+        return "headerless (version 1)"
+    if header.format == FORMAT_VERSION and header.tag == schema.tag and header.version == schema.version:
+        return "current"
+    if header.tag is not None and header.tag != schema.tag:
+        raise ValueError(f"{path} holds {BY_TAG.get(header.tag, header.tag)} records, not {schema.name}")
+    return f"format {header.format}, schema version {header.version}"
+
+
+def needs_migration(schema, path=None):
+    return file_status(schema, path) not in ("missing", "current")
+
+
+def _convert(schema, data):
+    # Returns (packed records, live, dead) in the current layout
+    header = parse_header(data)
+    if header is None:
+        legacy = schema.legacy[1]
+        if len(data) % legacy.size:
+            raise ValueError(f"{schema.filename}: size {len(data)} is not a multiple of the "
+                             f"version 1 record size {legacy.size}")
+        body = bytearray()
+        for fields in legacy.iter_unpack(data):
+            body += schema.struct.pack(RECORD_ACTIVE, *fields)
+        return body, len(data) // legacy.size, 0
+    if header.record_size != schema.struct.size:
+        raise ValueError(f"{schema.filename}: record size {header.record_size} does not match "
+                         f"the {schema.name} schema ({schema.struct.size})")
+    start = header_size(header)
+    return data[start:], header.live, header.dead
+
+
+def migrate(schema, path=None):
+    # Rewrites the file in the current format next to the original and swaps
+    # it in with a rename, so a reader sees either the old or the new file.
+    # Record numbers are unchanged, so sidecar indexes stay valid.
+    path = path or schema.filename
+    if not needs_migration(schema, path):
+        return False
+    with open(path, 'rb') as f:
+        data = f.read()
+    body, live, dead = _convert(schema, data)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(pack_header(schema, live, dead))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return True
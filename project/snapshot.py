@@ -0,0 +1,316 @@
+# snapshot.py
+import hashlib
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime
+import instrument
+import sales
+from locking import hold_all
+from schema import FILE_HEADER, RECORD_ACTIVE, parse_header
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Point-in-time copies of the data files. A snapshot is a directory under
+# SNAPSHOT_DIR with a manifest and, per data file, either a reflink clone
+# (copy-on-write: nothing is copied until the file changes) on filesystems
+# that support it, or the file cut into blocks of BLOCK_RECORDS records at
+# fixed record boundaries. A block whose digest matches the same block of
+# the previous snapshot is not stored again; the manifest names the snapshot
+# holding every block, so restoring any snapshot reads each block once,
+# however long the chain. Stored blocks are zlib-compressed.
+# Hard links are not used: the data files are changed in place through
+# mmap, so a linked copy would change along with them.
+# The sales journal is kept the same way in blocks of JOURNAL_BLOCK bytes
+# (it only grows, so a snapshot stores just its new end), so the units sold
+# in a restored report match the restored stock.
+SNAPSHOT_DIR = "snapshots"
+MANIFEST = "manifest.json"
+BLOCK_SUFFIX = ".blk"
+BLOCK_RECORDS = 1024
+JOURNAL_BLOCK = 64 * 1024
+COMPRESS_LEVEL = 6
+USE_REFLINK = True
+
+# ioctl of linux/fs.h: share the extents of another file
+FICLONE = 0x40049409
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def list_snapshots():
+    # Snapshot IDs, oldest first; a directory without a manifest died halfway
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    return sorted(name for name in os.listdir(SNAPSHOT_DIR)
+                  if os.path.exists(os.path.join(SNAPSHOT_DIR, name, MANIFEST)))
+
+
+def load_manifest(snap_id):
+    path = os.path.join(SNAPSHOT_DIR, snap_id, MANIFEST)
+    if not os.path.exists(path):
+        raise ValueError(f"no snapshot {snap_id}")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def snapshot_size(snap_id):
+    # Bytes this snapshot added on disk (clones count as their full size)
+    directory = os.path.join(SNAPSHOT_DIR, snap_id)
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def _new_id(existing):
+    snap_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    suffix = 1
+    base = snap_id
+    while snap_id in existing:
+        snap_id = f"{base}-{suffix}"
+        suffix += 1
+    return snap_id
+
+
+# --- Taking a snapshot ---
+
+def _reflink(src, path):
+    # Copy-on-write clone of src at path; False where the filesystem cannot
+    if fcntl is None or not USE_REFLINK:
+        return False
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    try:
+        fcntl.ioctl(fd, FICLONE, src.fileno())
+    except OSError:
+        os.close(fd)
+        os.remove(path)
+        return False
+    os.fsync(fd)
+    os.close(fd)
+    return True
+
+
+def _copy_file(store, directory, snap_id, previous):
+    # Manifest entry for one data file and (cloned, blocks stored, blocks
+    # reused, bytes written). previous: the file's entry in the last snapshot.
+    record_size = store.record_size
+    with open(store.filename, 'rb') as src:
+        entry = {"header": src.read(FILE_HEADER.size).hex(), "record_size": record_size}
+        if _reflink(src, os.path.join(directory, store.filename)):
+            entry["clone"] = store.filename
+            return entry, (True, 0, 0, 0)
+
+        old = []
+        if (previous is not None and previous.get("record_size") == record_size
+                and previous.get("block_records") == BLOCK_RECORDS):
+            old = previous.get("blocks", [])
+        src.seek(FILE_HEADER.size)
+        blocks, stored, written = _store_blocks(src, os.path.join(directory, store.filename + BLOCK_SUFFIX),
+                                                snap_id, old, BLOCK_RECORDS * record_size, record_size)
+    entry["block_records"] = BLOCK_RECORDS
+    entry["blocks"] = blocks
+    return entry, (False, stored, len(blocks) - stored, written)
+
+
+def _store_blocks(src, path, snap_id, old, block_size, unit):
+    # Cuts src from its current position into blocks and writes those that
+    # differ from the same block in old to path. A torn last unit (record)
+    # is not part of the file. Returns (blocks, blocks stored, bytes written).
+    blocks = []
+    stored = written = 0
+    out = None     # block file, created by the first changed block
+    try:
+        while True:
+            data = src.read(block_size)
+            data = data[:len(data) - len(data) % unit]
+            if not data:
+                break
+            digest = _digest(data)
+            i = len(blocks)
+            if i < len(old) and old[i][3] == digest:
+                blocks.append(old[i])
+                continue
+            if out is None:
+                out = open(path, 'wb')
+            packed = zlib.compress(data, COMPRESS_LEVEL)
+            blocks.append([snap_id, written, len(packed), digest])
+            out.write(packed)
+            stored += 1
+            written += len(packed)
+        if out is not None:
+            out.flush()
+            os.fsync(out.fileno())
+    finally:
+        if out is not None:
+            out.close()
+    return blocks, stored, written
+
+
+def _copy_journal(directory, snap_id, previous):
+    # Manifest entry for the sales journal (None if there is none yet) and
+    # (blocks stored, blocks reused, bytes written)
+    if not os.path.exists(sales.SALES_FILE):
+        return None, (0, 0, 0)
+    old = []
+    if previous is not None and previous.get("block_bytes") == JOURNAL_BLOCK:
+        old = previous["blocks"]
+    with open(sales.SALES_FILE, 'rb') as src:
+        blocks, stored, written = _store_blocks(src, os.path.join(directory, sales.SALES_FILE + BLOCK_SUFFIX),
+                                                snap_id, old, JOURNAL_BLOCK, 1)
+    return {"block_bytes": JOURNAL_BLOCK, "blocks": blocks}, (stored, len(blocks) - stored, written)
+
+
+@instrument.timed("snapshot.create")
+def create(stores):
+    # Copies every store's data file and the sales journal as of one moment:
+    # shared locks on all of them keep writers out while the files are read.
+    # Returns (snapshot ID, [(file, cloned, blocks stored, blocks reused,
+    # bytes written)]).
+    existing = list_snapshots()
+    last = load_manifest(existing[-1]) if existing else {}
+    previous = last.get("files", {})
+    snap_id = _new_id(existing)
+    tmp = os.path.join(SNAPSHOT_DIR, f".{snap_id}.tmp")
+    os.makedirs(tmp)
+    try:
+        manifest = {"id": snap_id, "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "parent": existing[-1] if existing else None, "files": {}}
+        results = []
+        with hold_all(stores):
+            for store in stores:
+                store.open()
+                entry, stats = _copy_file(store, tmp, snap_id, previous.get(store.filename))
+                manifest["files"][store.filename] = entry
+                results.append((store.filename,) + stats)
+            # Sales are appended under the price file's lock
+            manifest["journal"], stats = _copy_journal(tmp, snap_id, last.get("journal"))
+            if manifest["journal"] is not None:
+                results.append((sales.SALES_FILE, False) + stats)
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # The snapshot appears whole or not at all
+        os.rename(tmp, os.path.join(SNAPSHOT_DIR, snap_id))
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return snap_id, results
+
+
+# --- Restoring ---
+
+def _read_blocks(snap_id, filename, entry):
+    # The records of one data file as stored in a snapshot, a block at a time
+    if "clone" in entry:
+        with open(os.path.join(SNAPSHOT_DIR, snap_id, entry["clone"]), 'rb') as f:
+            f.seek(FILE_HEADER.size)
+            while True:
+                data = f.read(BLOCK_RECORDS * entry["record_size"])
+                if not data:
+                    return
+                yield data
+    files = {}
+    try:
+        for holder, offset, length, digest in entry["blocks"]:
+            f = files.get(holder)
+            if f is None:
+                f = files[holder] = open(os.path.join(SNAPSHOT_DIR, holder, filename + BLOCK_SUFFIX), 'rb')
+            f.seek(offset)
+            try:
+                data = zlib.decompress(f.read(length))
+            except zlib.error:
+                data = None
+            if data is None or _digest(data) != digest:
+                raise ValueError(f"snapshot {holder}: block at {offset} of {filename} is corrupt")
+            yield data
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def _live_records(snap_id, filename, entry):
+    size = entry["record_size"]
+    for data in _read_blocks(snap_id, filename, entry):
+        for pos in range(0, len(data) - size + 1, size):
+            if data[pos] == RECORD_ACTIVE:
+                yield data[pos:pos + size]
+
+
+def _check(snap_id, manifest, store):
+    # Refuses a snapshot taken in another layout, or whose blocks are missing
+    # or damaged
+    entry = manifest["files"].get(store.filename)
+    if entry is None:
+        raise ValueError(f"snapshot {snap_id} has no copy of {store.filename}")
+    header = parse_header(bytes.fromhex(entry["header"]))
+    if (header is None or header.tag != store.schema.tag or header.version != store.schema.version
+            or header.record_size != store.record_size):
+        raise ValueError(f"snapshot {snap_id}: {store.filename} was saved in another format and cannot be restored")
+    _check_blocks(snap_id, store.filename, entry)
+    return entry
+
+
+def _check_journal(snap_id, manifest):
+    if "journal" not in manifest:
+        raise ValueError(f"snapshot {snap_id} has no copy of {sales.SALES_FILE}")
+    entry = manifest["journal"]
+    if entry is not None:
+        _check_blocks(snap_id, sales.SALES_FILE, entry)
+    return entry
+
+
+def _check_blocks(snap_id, filename, entry):
+    if "clone" in entry:
+        holders = {snap_id}
+        name = entry["clone"]
+    else:
+        holders = {block[0] for block in entry["blocks"]}
+        name = filename + BLOCK_SUFFIX
+    for holder in holders:
+        if not os.path.exists(os.path.join(SNAPSHOT_DIR, holder, name)):
+            raise ValueError(f"snapshot {snap_id} needs {name} of snapshot {holder}, which is missing")
+    # Every block is read and checked before any file is replaced, so a
+    # damaged snapshot leaves the data alone (a small cost next to the rewrite)
+    for _ in _read_blocks(snap_id, filename, entry):
+        pass
+
+
+def _restore_journal(snap_id, entry):
+    # Replaces the sales journal (sales.py reopens it) and drops the units
+    # sold summary, which is rebuilt from the journal by the next report
+    if entry is None:
+        if os.path.exists(sales.SALES_FILE):
+            os.remove(sales.SALES_FILE)
+    else:
+        tmp = f"{sales.SALES_FILE}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            for data in _read_blocks(snap_id, sales.SALES_FILE, entry):
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, sales.SALES_FILE)
+    if os.path.exists(sales.SALES_SUMMARY_FILE):
+        os.remove(sales.SALES_SUMMARY_FILE)
+
+
+@instrument.timed("snapshot.restore")
+def restore(snap_id, stores):
+    # Replaces every store's records and the sales journal with the
+    # snapshot's, under exclusive locks on all of them. Each file is
+    # rewritten beside the original and renamed over it, and its indexes are
+    # rebuilt. Returns [(data file, records restored)].
+    manifest = load_manifest(snap_id)
+    entries = [_check(snap_id, manifest, store) for store in stores]
+    journal = _check_journal(snap_id, manifest)
+    results = []
+    with hold_all(stores, exclusive=True):
+        for store, entry in zip(stores, entries):
+            count = store.load(_live_records(snap_id, store.filename, entry))
+            results.append((store.filename, count))
+        _restore_journal(snap_id, journal)
+    return results
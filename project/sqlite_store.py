@@ -0,0 +1,434 @@
+# sqlite_store.py
+import re
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import instrument
+import wal
+from schema import RECORD_ACTIVE, SCHEMAS, pack_header
+from storage import ConflictError, KEY_OFFSET, pad_string, decode_string, _prefix_end
+
+# SQLite storage engine: one database holding a table per schema, with the
+# same interface as storage.RecordFile so the managers, caches and sales code
+# run unchanged on top of it. Records still travel as packed struct bytes
+# (records.Record reads them); they are unpacked into typed columns on the way
+# in and packed again on the way out. Record numbers are rowids.
+# The database runs in WAL mode; a shared section is a read transaction (one
+# consistent snapshot), an exclusive section a BEGIN IMMEDIATE transaction,
+# rolled back if it raises. Sections of all tables nest into one transaction.
+DATABASE_FILE = "shop.db"
+
+# Indexes besides the unique key of each table
+EXTRA_INDEXES = {
+    "product": (("promotion_id",),),
+}
+
+_TYPES = {'s': "TEXT", 'f': "REAL", 'd': "REAL"}
+
+_db = None
+
+
+class Database:
+    def __init__(self, path):
+        self.path = path
+        # Stores are shared by the threads of the writer daemon and the HTTP
+        # API. One connection holds one transaction at a time, so sections of
+        # different threads take turns: the API's reader threads do not read
+        # in parallel on this backend
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if wal.WAL_SYNC else 'NORMAL'}")
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._exclusive = False
+        self._created = set()
+        self.writes = 0      # changes made through this connection
+
+    @contextmanager
+    def section(self, exclusive):
+        with self._mutex:
+            if self._depth:
+                if exclusive and not self._exclusive:
+                    raise RuntimeError(f"{self.path}: cannot upgrade a shared section to exclusive")
+                self._depth += 1
+                try:
+                    yield False
+                finally:
+                    self._depth -= 1
+                return
+            with instrument.span("lock.wait_exclusive" if exclusive else "lock.wait_shared"):
+                self.conn.execute("BEGIN IMMEDIATE" if exclusive else "BEGIN")
+            self._depth, self._exclusive = 1, exclusive
+            try:
+                yield True
+            except BaseException:
+                self._depth, self._exclusive = 0, False
+                self.conn.execute("ROLLBACK")
+                raise
+            self._depth, self._exclusive = 0, False
+            with instrument.span("storage.commit" if exclusive else "storage.end_read"):
+                self.conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def data_version(self):
+        # Changes whenever another connection commits
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def outside_transaction(self, sql):
+        # VACUUM and checkpoints cannot run inside a transaction
+        with self._mutex:
+            if self._depth:
+                raise RuntimeError(f"{sql} inside a transaction")
+            return self.conn.execute(sql).fetchall()
+
+
+def database():
+    global _db
+    if _db is None:
+        _db = Database(DATABASE_FILE)
+    return _db
+
+
+def _columns(schema):
+    # [(field, struct code, byte size, offset in the record)] after the status byte
+    columns = []
+    offset = 0
+    for field, (count, code) in zip(schema.fields, re.findall(r'(\d*)([a-zA-Z?])', schema.struct.format.lstrip('<>=!@'))):
+        size = struct.calcsize('<' + count + code)
+        if field != "status":
+            columns.append((field, code, size, offset))
+        offset += size
+    return columns
+
+
+class SqliteTable:
+    # One schema's table; stands in for storage.RecordFile
+    index = None
+    groups = None
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.table = f"{schema.name}s"
+        self.filename = DATABASE_FILE
+        self.struct = schema.struct
+        self.record_size = schema.struct.size
+        self.key_size = schema.key_size
+        self.group_size = schema.group_size
+        self._columns = _columns(schema)
+        self._names = [name for name, _, _, _ in self._columns]
+        self._text = [code == 's' for _, code, _, _ in self._columns]
+        self._sizes = [size for _, _, size, _ in self._columns]
+        self._by_offset = {offset: i for i, (_, _, _, offset) in enumerate(self._columns)}
+        # Leading columns making up the key
+        self._key_columns = []
+        end = KEY_OFFSET
+        for i, (_, _, size, offset) in enumerate(self._columns):
+            if offset < KEY_OFFSET + self.key_size:
+                self._key_columns.append(i)
+                end = offset + size
+        if end != KEY_OFFSET + self.key_size:
+            raise ValueError(f"{schema.name}: the key does not end on a field boundary")
+        cols = ", ".join(self._names)
+        marks = ", ".join("?" * len(self._names))
+        key_where = " AND ".join(f"{self._names[i]} = ?" for i in self._key_columns)
+        self._key_order = ", ".join(self._names[i] for i in self._key_columns)
+        # Fixed statement texts, so sqlite3 prepares each once and reuses it
+        self._sql_insert = f"INSERT INTO {self.table} ({cols}) VALUES ({marks})"
+        self._sql_update = f"UPDATE {self.table} SET {', '.join(n + ' = ?' for n in self._names)} WHERE recno = ?"
+        self._sql_read = f"SELECT {cols} FROM {self.table} WHERE recno = ?"
+        self._sql_find = f"SELECT recno FROM {self.table} WHERE {key_where}"
+        self._sql_scan = f"SELECT recno, {cols} FROM {self.table} ORDER BY recno"
+        self._sql_delete = f"DELETE FROM {self.table} WHERE recno = ?"
+        self._sql_count = f"SELECT count(*) FROM {self.table}"
+        self._db = None
+        self._count = (None, 0)   # (version, live records)
+
+    # --- Locking ---
+
+    def shared(self):
+        return self.open().section(False)
+
+    def exclusive(self):
+        return self.open().section(True)
+
+    def version(self):
+        # Changes whenever anything in the database changes, here or elsewhere
+        db = self.open()
+        return db.data_version(), db.writes
+
+    # --- Database handling ---
+
+    def open(self, rebuild=False):
+        if self._db is None:
+            db = database()
+            if self.table not in db._created:
+                self._create(db)
+                db._created.add(self.table)
+            self._db = db
+        return self._db
+
+    def _create(self, db):
+        defs = ", ".join(f"{name} {_TYPES.get(code, 'INTEGER')} NOT NULL" for name, code, _, _ in self._columns)
+        db.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (recno INTEGER PRIMARY KEY, {defs})")
+        db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {self.table}_key ON {self.table} ({self._key_order})")
+        for columns in EXTRA_INDEXES.get(self.schema.name, ()):
+            db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_{'_'.join(columns)} "
+                       f"ON {self.table} ({', '.join(columns)})")
+
+    def close(self):
+        pass
+
+    def flush(self):
+        # Commits are already durable
+        pass
+
+    def recover(self):
+        # SQLite replays its own log when the database is opened
+        self.open()
+        return False
+
+    def checkpoint(self):
+        self.open().outside_transaction("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def needs_upgrade(self):
+        return False
+
+    # --- Conversions ---
+
+    def _values(self, fields):
+        # Packed field tuple (status first) -> column values; packing first
+        # truncates and rounds exactly as the record files do
+        values = self.struct.unpack(self.struct.pack(*fields))[1:]
+        return [decode_string(v) if text else v for v, text in zip(values, self._text)]
+
+    def _pack(self, values):
+        return self.struct.pack(RECORD_ACTIVE, *[pad_string(v, size) if text else v
+                                                 for v, text, size in zip(values, self._text, self._sizes)])
+
+    def _key_values(self, key, partial=False):
+        # Column values for the leading key columns covered by key bytes.
+        # With partial, a text column cut short is matched as a prefix.
+        values = []
+        for i in self._key_columns:
+            _, code, size, offset = self._columns[i]
+            chunk = key[offset - KEY_OFFSET:offset - KEY_OFFSET + size]
+            if not chunk:
+                break
+            if len(chunk) < size and not (partial and self._text[i]):
+                raise ValueError(f"{self.table}: key {key!r} ends inside {self._names[i]}")
+            if self._text[i]:
+                # Compared as UTF-8 bytes, like the padded keys of the files
+                values.append(chunk.rstrip(b'\x00'))
+            else:
+                values.append(struct.unpack('<' + code, chunk)[0])
+        return values
+
+    def _key_params(self, values):
+        return [v.decode('utf-8') if isinstance(v, bytes) else v for v in values]
+
+    # --- Reads ---
+
+    def count(self):
+        # No tombstones: every row is live
+        return self.live_count()
+
+    def live_count(self):
+        with self.shared():
+            version = self.version()
+            if self._count[0] != version:
+                self._count = (version, self._db.execute(self._sql_count).fetchone()[0])
+            return self._count[1]
+
+    def dead_count(self):
+        return 0
+
+    def read_raw(self, recno):
+        with self.shared():
+            row = self._db.execute(self._sql_read, (recno,)).fetchone()
+        if row is None:
+            raise IndexError(f"{self.table}: no record {recno}")
+        if instrument.enabled:
+            instrument.count("data.bytes_read", self.record_size)
+        return self._pack(row)
+
+    def read(self, recno):
+        return self.struct.unpack(self.read_raw(recno))
+
+    def key_at(self, recno):
+        return self.read_raw(recno)[KEY_OFFSET:KEY_OFFSET + self.key_size]
+
+    def iter_raw(self):
+        # Yields (record number, record bytes) for every record, in rowid order
+        with self.shared():
+            for recno, *values in self._db.execute(self._sql_scan):
+                yield recno, self._pack(values)
+
+    def iter_records(self):
+        for recno, raw in self.iter_raw():
+            yield recno, self.struct.unpack(raw)
+
+    def mapping(self):
+        # Header and packed records in one buffer, laid out like a data file
+        with self.shared():
+            return pack_header(self.schema, self.count(), 0) + b"".join(raw for _, raw in self.iter_raw())
+
+    def find(self, key):
+        with self.shared():
+            row = self._db.execute(self._sql_find, self._key_params(self._key_values(key))).fetchone()
+        return None if row is None else row[0]
+
+    def keys(self):
+        with self.shared():
+            return {raw[KEY_OFFSET:KEY_OFFSET + self.key_size] for _, raw in self.iter_raw()}
+
+    def find_group(self, prefix):
+        values = self._key_values(prefix)
+        where = " AND ".join(f"{self._names[i]} = ?" for i in self._key_columns[:len(values)])
+        with self.shared():
+            rows = self._db.execute(f"SELECT recno FROM {self.table} WHERE {where} ORDER BY recno",
+                                    self._key_params(values))
+            return [recno for recno, in rows]
+
+    def find_range(self, lo, hi=None):
+        # Same contract as RecordFile.find_range: lo <= key < hi as raw bytes
+        where, params = [], []
+        for bound, op in ((lo, ">="), (hi, "<")):
+            if bound is None:
+                continue
+            values = self._key_values(bound, partial=True)
+            if not values:
+                continue
+            names = [self._names[i] for i in self._key_columns[:len(values)]]
+            marks = ["CAST(? AS TEXT)" if isinstance(v, bytes) else "?" for v in values]
+            where.append(f"({', '.join(names)}) {op} ({', '.join(marks)})")
+            params.extend(values)
+        sql = f"SELECT recno FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        with self.shared():
+            return [recno for recno, in self._db.execute(sql + f" ORDER BY {self._key_order}", params)]
+
+    def find_prefix(self, prefix):
+        return self.find_range(prefix, _prefix_end(prefix))
+
+    # --- Writes ---
+
+    def _run(self, sql, params, key=None):
+        try:
+            return self._db.execute(sql, params)
+        except sqlite3.IntegrityError:
+            raise ConflictError(f"{self.table}: key {key!r} already exists") from None
+        finally:
+            self._db.writes += 1
+
+    def _insert(self, fields):
+        packed = self.struct.pack(*fields)
+        return self._run(self._sql_insert, self._values(fields),
+                         packed[KEY_OFFSET:KEY_OFFSET + self.key_size]).lastrowid
+
+    def append(self, fields):
+        with self.exclusive():
+            return self._insert(fields)
+
+    def append_many(self, records):
+        # Returns the first record number
+        with self.exclusive():
+            recnos = [self._insert(fields) for fields in records]
+            return recnos[0] if recnos else None
+
+    def write(self, recno, fields):
+        with self.exclusive():
+            packed = self.struct.pack(*fields)
+            self._run(self._sql_update, self._values(fields) + [recno],
+                      packed[KEY_OFFSET:KEY_OFFSET + self.key_size])
+
+    def patch(self, recno, offset, field_struct, *values):
+        # Rewrites the fields starting at byte offset of the record
+        first = self._by_offset[offset]
+        names = self._names[first:first + len(values)]
+        with self.exclusive():
+            self._run(f"UPDATE {self.table} SET {', '.join(n + ' = ?' for n in names)} WHERE recno = ?",
+                      list(values) + [recno])
+
+    def delete(self, recno):
+        with self.exclusive():
+            self._run(self._sql_delete, (recno,))
+
+    def load(self, records):
+        # Replaces the whole table with the packed records given
+        with self.exclusive():
+            self._run(f"DELETE FROM {self.table}", ())
+            rows = (self._values(self.struct.unpack(raw)) for raw in records)
+            try:
+                self._db.conn.executemany(self._sql_insert, rows)
+            except sqlite3.IntegrityError as e:
+                raise ConflictError(f"{self.table}: {e}") from None
+            return self._db.execute(self._sql_count).fetchone()[0]
+
+    # --- Maintenance ---
+
+    def rebuild_index(self):
+        with self.exclusive():
+            self._db.execute(f"REINDEX {self.table}")
+
+    def verify_indexes(self):
+        with self.shared():
+            rows = self._db.execute(f"PRAGMA integrity_check({self.table})").fetchall()
+        return [f"{self.table}: {msg}" for msg, in rows if msg != "ok"]
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self):
+        # Reclaims free pages of the whole database; returns the live records
+        self.open().outside_transaction("VACUUM")
+        return self.live_count()
+
+    def needs_merge(self):
+        # Range queries use the key index; there is no tail to merge
+        return False
+
+
+def report_rows():
+    # The report as one indexed join in price file order: yields (price key,
+    # price, product name, promotion name), the price as a namedtuple of its
+    # fields. Unknown products read "Unknown" and products without a
+    # promotion "No Promotion", as in the dictionary version of the report.
+    price = SqliteTable(SCHEMAS["price"])
+    SqliteTable(SCHEMAS["product"]).open()
+    SqliteTable(SCHEMAS["promotion"]).open()
+    row_type = namedtuple('JoinedPrice', price._names)
+    cols = ", ".join(f"pr.{name}" for name in price._names)
+    sql = (f"SELECT {cols}, coalesce(p.pro_name, 'Unknown'), coalesce(m.promotion_name, 'No Promotion') "
+           f"FROM prices pr "
+           f"LEFT JOIN products p ON p.pro_id = pr.pro_id "
+           f"LEFT JOIN promotions m ON m.promotion_id = p.promotion_id "
+           f"ORDER BY pr.recno")
+    with price.shared():
+        for *values, pro_name, promotion_name in price._db.execute(sql):
+            p = row_type(*values)
+            yield pad_string(p.pro_id, 10) + pad_string(p.pro_size, 10), p, pro_name, promotion_name
+
+
+def convert(to, replace=False):
+    # Copies every table between the record files and the database, in the
+    # direction given ("sqlite" or "files"). Refuses to overwrite data unless
+    # replace is set. Returns [(schema name, records copied)].
+    from storage import RecordFile
+    pairs = []
+    for schema in SCHEMAS.values():
+        files, table = RecordFile(schema), SqliteTable(schema)
+        pairs.append((schema, files, table) if to == "sqlite" else (schema, table, files))
+    if not replace:
+        for schema, _, dst in pairs:
+            if dst.live_count():
+                raise ValueError(f"{schema.name} data already exists in the {to} backend")
+    copied = []
+    for schema, src, dst in pairs:
+        with src.shared():
+            copied.append((schema.name, dst.load(raw for _, raw in src.iter_raw())))
+    return copied
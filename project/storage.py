@@ -0,0 +1,791 @@
+# storage.py
+import bisect
+import functools
+import heapq
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+import instrument
+import schema as schemas
+from hash_index import HashIndex, GroupIndex
+from locking import FileLock
+from wal import WriteAheadLog, WAL_CHECKPOINT_BYTES, WRITE, EXTEND, TRUNCATE, BASE
+from writer import register_error
+from schema import FILE_HEADER, FILE_MAGIC, FORMAT_VERSION, RECORD_ACTIVE, RECORD_DELETED
+
+# Index keys are the raw bytes right after the status byte
+KEY_OFFSET = 1
+
+# Compact a file once this share of its records are tombstones
+COMPACT_THRESHOLD = 0.25
+COMPACT_MIN_DEAD = 16
+
+# Files whose schema names a sorted sidecar are only kept in key order with
+# FRDB_SORTED_PRICES=1 or main.py --sorted-prices; otherwise they stay in
+# append order and range queries scan. Every process sharing the files must
+# use the same setting.
+SORTED_ENV = "FRDB_SORTED_PRICES"
+keep_sorted = bool(os.environ.get(SORTED_ENV))
+
+# Sorted files: length of the sorted run, and the record count when it was
+# saved. Appends leave the run alone, so the file only grows until the next
+# save; rewrites (compact, merge, recovery) always save it again.
+SORTED_STATE = struct.Struct('<II')
+# Merge the unsorted tail into the run once it holds this share of the records
+MERGE_TAIL_SHARE = 1 / 16
+MERGE_MIN_TAIL = 256
+
+
+def pad_string(s, length):
+    b = s.encode('utf-8')[:length]
+    return b.ljust(length, b'\x00')
+
+
+def decode_string(b):
+    return b.decode('utf-8').rstrip('\x00')
+
+
+@register_error
+class ConflictError(ValueError):
+    # A write lost a race: the key already exists, or the record changed
+    # since the caller read it
+    pass
+
+
+def _shared(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.shared():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+def _exclusive(method):
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.exclusive():
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class RecordFile:
+    # Fixed-size record file read through a copy-on-write memory map. Readers
+    # unpack straight from the mapping; writes go into this process's copy
+    # of the mapping in place, except appends which grow the file and remap
+    # it.
+    # Every change goes through the file's write-ahead log first; an
+    # exclusive section is one transaction, rolled back if it raises. Its
+    # in-place writes reach the data file only once the commit is fsynced,
+    # so the file never holds uncommitted bytes whose undo is not on disk.
+    # The layout, key and indexes all come from a schema.Schema. An optional
+    # group index maps the first group_size bytes of the key to every record
+    # sharing them (e.g. all prices of one product).
+    # A sorted file keeps records [0, sorted run) in key order, so key ranges
+    # are found by binary search; appends form an unsorted tail until merge().
+    def __init__(self, schema):
+        self.schema = schema
+        self.filename = schema.filename
+        self.struct = schema.struct
+        self.record_size = schema.struct.size
+        self.key_size = schema.key_size
+        self.index = HashIndex(schema.index_file, schema.key_size) if schema.index_file else None
+        self.group_size = schema.group_size
+        self.groups = GroupIndex(*schema.group_files, schema.group_size) if schema.group_files else None
+        self.sorted_file = schema.sorted_file if keep_sorted else None
+        self._sorted_count = 0
+        self._sorted_saved = None
+        self.lock = FileLock(self.filename + ".lock")
+        self.wal = WriteAheadLog(self.filename + ".wal")
+        self._seen = None    # lock counter when the mapping was last known fresh
+        self._txn = None     # undo list of the open transaction
+        self._txn_id = 0
+        self._dirty = []     # (offset, bytes) written in the open transaction
+        self._writes = 0     # changes made by this process, for version()
+        self._f = None
+        self._mm = None
+        self._ready = False  # open() has finished; readers on other threads may use the mapping
+        self._opening = threading.RLock()
+
+    # --- Locking ---
+    # Public methods lock themselves; wrap several calls in shared() or
+    # exclusive() to make them one atomic step for other processes.
+
+    def shared(self):
+        return self._section(False)
+
+    def exclusive(self):
+        return self._section(True)
+
+    @contextmanager
+    def _section(self, exclusive):
+        with self.lock.hold(exclusive, self._refresh) as outer:
+            if outer and exclusive:
+                if self.lock.state()[1]:
+                    # The previous writer died inside a transaction; its
+                    # index writes may be lost or half done
+                    self._recover(rebuild=True)
+                self._txn, self._txn_id = [], self._seen % 0xFFFFFFFF + 1
+            if not (outer and exclusive):
+                yield
+                return
+            try:
+                yield
+            except BaseException:
+                self._rollback()
+                raise
+            finally:
+                self._end_txn()
+
+    def _refresh(self):
+        # Runs as this process takes the file lock
+        seen = self.lock.counter()
+        if seen != self._seen:
+            # Another process wrote since we last looked: drop the mapping
+            # and index handles so open() sees its changes
+            self.close()
+            self._seen = seen
+
+    @instrument.timed("storage.commit")
+    def _end_txn(self):
+        if self._txn is None:
+            # Rollback failed: leave the transaction marked open so the next
+            # writer undoes it from the log
+            self._dirty = []
+            self.close()
+            return
+        if self._txn:
+            self.wal.commit(self._txn_id)
+            self._apply()
+        # The indexes follow the committed data, never ahead of it
+        self._flush_indexes()
+        self._txn = None
+        self._seen = self.lock.bump()
+        if self.wal.size() > WAL_CHECKPOINT_BYTES:
+            self._checkpoint()
+
+    @_shared
+    def version(self):
+        # Changes whenever this process writes the file or another process
+        # commits to it; lets callers cache what they decode
+        return self._seen, self._writes
+
+    def _flush_indexes(self):
+        if self.index is not None:
+            self.index.flush()
+        if self.groups is not None:
+            self.groups.flush()
+        if self.sorted_file is not None and self._mm is not None:
+            if self._sorted_count != self._sorted_saved:
+                self._save_sorted()
+
+    # --- File handling ---
+
+    def open(self, rebuild=False):
+        # rebuild: record numbers changed, derive the indexes again
+        if self._ready:
+            return
+        # Shared sections of several threads may all find the file closed
+        with self._opening:
+            if self._f is not None:
+                return
+            if not os.path.exists(self.filename) or os.path.getsize(self.filename) == 0:
+                self._write_file([])
+            self._f = open(self.filename, 'r+b')
+            self._map()
+            # A missing or stale index is rebuilt in place; every process
+            # derives the same content from the data, so no exclusive lock
+            # is needed
+            if self.index is not None and (not self.index.open() or rebuild or self.index.data_count != self.count()):
+                self._rebuild_index()
+            if self.groups is not None and (not self.groups.open() or rebuild or self.groups.data_count != self.count()):
+                self._rebuild_groups()
+            if self.sorted_file is not None:
+                self._load_sorted(rebuild)
+            elif self.schema.sorted_file is not None:
+                # A sidecar from a sorted run would be wrong about the
+                # records appended since; if the layout is turned back on it
+                # is rebuilt
+                try:
+                    os.remove(self.schema.sorted_file)
+                except FileNotFoundError:
+                    pass
+            self._ready = True
+
+    def _rebuild_derived(self):
+        if self.index is not None:
+            self._rebuild_index()
+        if self.groups is not None:
+            self._rebuild_groups()
+        if self.sorted_file is not None:
+            self._rebuild_sorted()
+
+    def close(self):
+        self._ready = False
+        self._unmap()
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+        if self.index is not None:
+            self.index.close()
+        if self.groups is not None:
+            self.groups.close()
+
+    def _map(self):
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_COPY)
+        for pos, data in self._dirty:
+            self._mm[pos:pos + len(data)] = data
+        magic, version, record_size, tag, schema_version, _, _ = FILE_HEADER.unpack_from(self._mm, 0)
+        if (magic != FILE_MAGIC or version != FORMAT_VERSION or record_size != self.record_size
+                or tag != self.schema.tag or schema_version != self.schema.version):
+            self._unmap()
+            raise ValueError(f"{self.filename} has an unsupported format (run: main.py migrate)")
+
+    def _unmap(self):
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # A caller still holds a view into the old mapping; it is
+                # released together with that view
+                pass
+            self._mm = None
+
+    def _write_file(self, records):
+        # records: packed live records, any iterable. Whole-file rewrites go
+        # to a temp file renamed over the original, so other processes never
+        # map a half-written file. Returns the number of records written.
+        tmp = f"{self.filename}.{os.getpid()}.tmp"
+        count = 0
+        with open(tmp, 'wb') as f:
+            f.write(schemas.pack_header(self.schema, 0, 0))
+            for raw in records:
+                f.write(raw)
+                count += 1
+            f.seek(0)
+            f.write(schemas.pack_header(self.schema, count, 0))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.filename)
+        return count
+
+    def needs_upgrade(self):
+        return schemas.needs_migration(self.schema)
+
+    @_exclusive
+    def upgrade(self):
+        # Migrate an older layout to the current one; safe while open
+        self._checkpoint()
+        self.close()
+        self._writes += 1
+        return schemas.migrate(self.schema)
+
+    # --- Header ---
+
+    @_shared
+    def _header(self):
+        self.open()
+        live, dead = FILE_HEADER.unpack_from(self._mm, 0)[-2:]
+        return live, dead
+
+    def _set_header(self, live, dead):
+        self._put(0, schemas.pack_header(self.schema, live, dead))
+
+    def live_count(self):
+        return self._header()[0]
+
+    def dead_count(self):
+        return self._header()[1]
+
+    def count(self):
+        # Number of record slots, tombstones included
+        self.open()
+        return (len(self._mm) - FILE_HEADER.size) // self.record_size
+
+    # --- Reads ---
+
+    def offset(self, recno):
+        return FILE_HEADER.size + recno * self.record_size
+
+    @_shared
+    def mapping(self):
+        # This process's copy-on-write mapping itself, for zero-copy consumers
+        # such as NumPy; only stable while the caller holds shared()
+        self.open()
+        return self._mm
+
+    @_shared
+    def read(self, recno):
+        self.open()
+        return self.struct.unpack_from(self._mm, self.offset(recno))
+
+    @_shared
+    def read_raw(self, recno):
+        # The record's bytes, status byte included
+        if instrument.enabled:
+            instrument.count("data.bytes_read", self.record_size)
+        self.open()
+        start = self.offset(recno)
+        return self._mm[start:start + self.record_size]
+
+    def key_at(self, recno):
+        start = self.offset(recno) + KEY_OFFSET
+        return self._mm[start:start + self.key_size]
+
+    def iter_records(self):
+        # Yields (record number, fields) for every live record, status byte included
+        with self.shared():
+            self.open()
+            end = self.offset(self.count())
+            with memoryview(self._mm) as mv:
+                with mv[FILE_HEADER.size:end] as body:
+                    for recno, fields in enumerate(self.struct.iter_unpack(body)):
+                        if fields[0] == RECORD_ACTIVE:
+                            yield recno, fields
+
+    # --- Write-ahead log ---
+
+    def _log(self, kind, offset, payload, undo):
+        self._writes += 1
+        if not self._txn:
+            self.lock.mark_open(self._txn_id)
+            if self.wal.size() == 0:
+                # The data file is on disk as it is now (checkpoint)
+                self.wal.append(BASE, self._txn_id, os.fstat(self._f.fileno()).st_size)
+        self.wal.append(kind, self._txn_id, offset, payload)
+        self._txn.append(undo)
+
+    def _put(self, pos, data):
+        # Overwrite bytes of the mapping in place; the data file gets them
+        # at commit
+        end = pos + len(data)
+        if instrument.enabled:
+            instrument.count("data.bytes_written", len(data))
+        before = self._mm[pos:end]
+        self._log(WRITE, pos, before + data, (WRITE, pos, before))
+        self._mm[pos:end] = data
+        self._dirty.append((pos, bytes(data)))
+
+    def _apply(self):
+        # Called once the commit is durable
+        if not self._dirty:
+            return
+        for pos, data in self._dirty:
+            self._f.seek(pos)
+            self._f.write(data)
+        self._f.flush()
+        self._dirty = []
+
+    def _extend(self, data):
+        # Append bytes to the file and remap it
+        size = self._f.seek(0, os.SEEK_END)
+        if instrument.enabled:
+            instrument.count("data.bytes_written", len(data))
+        self._log(EXTEND, size, data, (EXTEND, size, None))
+        self._f.write(data)
+        self._f.flush()
+        self._unmap()
+        self._map()
+
+    def _truncate(self, size):
+        self._log(TRUNCATE, size, b'', (TRUNCATE, size, None))
+        self._dirty = [(pos, data[:size - pos]) for pos, data in self._dirty if pos < size]
+        self._unmap()
+        self._f.truncate(size)
+        self._map()
+
+    def _rollback(self):
+        # Undo the open transaction with logged compensating writes, so the
+        # log still redoes to the right bytes once they commit
+        undo, self._txn = self._txn, []
+        if not undo:
+            return
+        try:
+            self.open()
+            for kind, offset, before in reversed(undo):
+                if kind == WRITE:
+                    self._put(offset, before)
+                elif kind == EXTEND:
+                    self._truncate(offset)
+            self._rebuild_derived()
+        except BaseException:
+            self._txn = None
+            raise
+
+    @instrument.timed("storage.recover")
+    def _recover(self, rebuild=False):
+        if self.wal.size() == 0 and not rebuild:
+            return False
+        self.close()
+        self._writes += 1
+        changed = self.wal.recover(self.filename)
+        if changed or rebuild:
+            # The indexes are not logged; derive them from the repaired data
+            self.open(rebuild=True)
+        return changed
+
+    @_exclusive
+    def recover(self):
+        # Run at startup: replays the log of a run that ended without a
+        # checkpoint. Returns True if the data file had to be repaired.
+        return self._recover()
+
+    @instrument.timed("storage.checkpoint")
+    def _checkpoint(self):
+        # Once the data file is on disk the log is no longer needed
+        if self.wal.size() == 0:
+            return
+        self.open()
+        # Writes of the open transaction are kept along with the rest
+        self._apply()
+        os.fsync(self._f.fileno())
+        self.wal.reset()
+        if self._txn:
+            self._txn = []
+
+    @_exclusive
+    def checkpoint(self):
+        self._checkpoint()
+
+    def iter_raw(self):
+        # Yields (record number, record bytes) for every live record
+        with self.shared():
+            self.open()
+            mm, size = self._mm, self.record_size
+            for recno in range(self.count()):
+                start = self.offset(recno)
+                if mm[start] == RECORD_ACTIVE:
+                    yield recno, mm[start:start + size]
+
+    # --- Writes ---
+
+    @_exclusive
+    def write(self, recno, fields):
+        self.open()
+        old_key = self.key_at(recno)
+        self._put(self.offset(recno), self.struct.pack(*fields))
+        new_key = self.key_at(recno)
+        if new_key != old_key:
+            if self.sorted_file is not None and recno < self._sorted_count:
+                # A re-keyed record ends the sorted run
+                self._sorted_count = recno
+            if self.index is not None:
+                self.index.remove(old_key)
+                self.index.insert(new_key, recno)
+            if self.groups is not None and new_key[:self.group_size] != old_key[:self.group_size]:
+                self.groups.remove(old_key[:self.group_size], recno)
+                self.groups.insert(new_key[:self.group_size], recno)
+
+    @_exclusive
+    def patch(self, recno, offset, field_struct, *values):
+        # Overwrite one non-key field in place, offset bytes into the record
+        self.open()
+        self._put(self.offset(recno) + offset, field_struct.pack(*values))
+
+    def _check_new_key(self, packed):
+        key = packed[KEY_OFFSET:KEY_OFFSET + self.key_size]
+        if self.index is not None and self.index.lookup(key) is not None:
+            raise ConflictError(f"{self.filename}: key {bytes(key)!r} already exists")
+        return key
+
+    @_exclusive
+    def append(self, fields):
+        self.open()
+        self._check_new_key(self.struct.pack(*fields))
+        live, dead = self._header()
+        recno = self.count()
+        self._extend(self.struct.pack(*fields))
+        self._set_header(live + 1, dead)
+        if self.index is not None:
+            self.index.insert(self.key_at(recno), recno)
+            self.index.set_data_count(recno + 1)
+        if self.groups is not None:
+            self.groups.insert(self.key_at(recno)[:self.group_size], recno)
+            self.groups.set_data_count(recno + 1)
+        return recno
+
+    @_exclusive
+    def append_many(self, records):
+        # One write and one remap for a whole batch; returns the first record number
+        self.open()
+        live, dead = self._header()
+        first = self.count()
+        if not records:
+            return first
+        buf = bytearray()
+        batch_keys = set()
+        for fields in records:
+            packed = self.struct.pack(*fields)
+            key = self._check_new_key(packed)
+            if key in batch_keys:
+                raise ConflictError(f"{self.filename}: key {key!r} appears twice in the batch")
+            batch_keys.add(key)
+            buf += packed
+        self._extend(bytes(buf))
+        self._set_header(live + len(records), dead)
+        if self.index is not None:
+            if len(records) > first // 4:
+                self.rebuild_index()
+            else:
+                for recno in range(first, first + len(records)):
+                    self.index.insert(self.key_at(recno), recno)
+                self.index.set_data_count(self.count())
+        if self.groups is not None:
+            if len(records) > first // 4:
+                self.rebuild_groups()
+            else:
+                for recno in range(first, first + len(records)):
+                    self.groups.insert(self.key_at(recno)[:self.group_size], recno)
+                self.groups.set_data_count(self.count())
+        return first
+
+    @_exclusive
+    def delete(self, recno):
+        self.open()
+        live, dead = self._header()
+        if self.index is not None:
+            self.index.remove(self.key_at(recno))
+        if self.groups is not None:
+            self.groups.remove(self.key_at(recno)[:self.group_size], recno)
+        self._put(self.offset(recno), bytes([RECORD_DELETED]))
+        self._set_header(live - 1, dead + 1)
+
+    def flush(self):
+        # Forces committed changes to disk (the log already makes them durable)
+        if self._f is not None:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    # --- Index ---
+
+    @_shared
+    def find(self, key):
+        self.open()
+        return self.index.lookup(key)
+
+    @_shared
+    def keys(self):
+        # Set of all live keys, read from the index without touching records
+        self.open()
+        return {key for key, _ in self.index.entries()}
+
+    @_exclusive
+    def rebuild_index(self):
+        self.open()
+        self._rebuild_index()
+
+    @instrument.timed("storage.rebuild_index")
+    def _rebuild_index(self):
+        entries = [(self.key_at(recno), recno) for recno, _ in self.iter_records()]
+        if instrument.enabled:
+            instrument.count("records.scanned", len(entries))
+        self.index.rebuild(entries, self.count())
+
+    # --- Group index ---
+
+    @_shared
+    def find_group(self, prefix):
+        # Record numbers whose key starts with prefix, in file order; O(k)
+        self.open()
+        return self.groups.lookup(prefix)
+
+    @_exclusive
+    def rebuild_groups(self):
+        self.open()
+        self._rebuild_groups()
+
+    @instrument.timed("storage.rebuild_groups")
+    def _rebuild_groups(self):
+        entries = [(self.key_at(recno)[:self.group_size], recno) for recno, _ in self.iter_records()]
+        if instrument.enabled:
+            instrument.count("records.scanned", len(entries))
+        self.groups.rebuild(entries, self.count())
+
+    @_shared
+    def verify_indexes(self):
+        # Compares both indexes with the records; returns a list of problems
+        self.open()
+        problems = []
+        keys = {}
+        grouped = {}
+        for recno, _ in self.iter_records():
+            key = self.key_at(recno)
+            keys[key] = recno
+            grouped.setdefault(key[:self.group_size], []).append(recno)
+        if self.index is not None:
+            indexed = dict(self.index.entries())
+            for key in keys.keys() - indexed.keys():
+                problems.append(f"{self.filename}: key {key!r} missing from index")
+            for key in indexed.keys() - keys.keys():
+                problems.append(f"{self.filename}: index has stale key {key!r}")
+            for key in keys.keys() & indexed.keys():
+                if keys[key] != indexed[key]:
+                    problems.append(f"{self.filename}: index points {key!r} at record {indexed[key]}, expected {keys[key]}")
+        if self.groups is not None:
+            indexed = self.groups.groups()
+            for prefix in grouped.keys() | indexed.keys():
+                if grouped.get(prefix, []) != indexed.get(prefix, []):
+                    problems.append(f"{self.filename}: group {prefix!r} lists records "
+                                    f"{indexed.get(prefix, [])}, expected {grouped.get(prefix, [])}")
+        return problems
+
+    # --- Compaction ---
+
+    @_shared
+    def needs_compaction(self):
+        live, dead = self._header()
+        return dead >= COMPACT_MIN_DEAD and dead > (live + dead) * COMPACT_THRESHOLD
+
+    @instrument.timed("storage.compact")
+    @_exclusive
+    def compact(self):
+        # Rewrite the file without tombstones; record numbers change
+        return self.load(raw for _, raw in self.iter_raw())
+
+    @_exclusive
+    def load(self, records):
+        # Replaces the file's content with the packed live records given
+        # (any iterable, read while the new file is written). Returns the
+        # number of records.
+        self.open()
+        # The log holds offsets into the old file
+        self._checkpoint()
+        self._writes += 1
+        kept = self._write_file(records)
+        self.close()
+        self.open(rebuild=True)
+        return kept
+
+    # --- Sorted layout ---
+
+    def _load_sorted(self, rebuild=False):
+        # Length of the sorted run from the sidecar, or found again by a scan
+        # if the sidecar is missing or does not fit the file
+        if not rebuild:
+            try:
+                with open(self.sorted_file, 'rb') as f:
+                    run, count = SORTED_STATE.unpack(f.read(SORTED_STATE.size))
+                if run <= count <= self.count():
+                    self._sorted_count = self._sorted_saved = run
+                    return
+            except (OSError, struct.error):
+                pass
+        self._rebuild_sorted()
+
+    def _rebuild_sorted(self):
+        # Longest prefix of the file already in key order
+        count = self.count()
+        run = count
+        prev = b''
+        for recno in range(count):
+            key = self.key_at(recno)
+            if key < prev:
+                run = recno
+                break
+            prev = key
+        self._sorted_count = run
+        self._save_sorted()
+
+    def _save_sorted(self):
+        fd = os.open(self.sorted_file, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.pwrite(fd, SORTED_STATE.pack(self._sorted_count, self.count()), 0)
+        finally:
+            os.close(fd)
+        self._sorted_saved = self._sorted_count
+
+    @_shared
+    def sorted_count(self):
+        self.open()
+        return self._sorted_count if self.sorted_file is not None else 0
+
+    @_shared
+    def needs_merge(self):
+        # Never inside a transaction that has changes: the rewrite cannot be
+        # rolled back with them
+        if self.sorted_file is None or self._txn:
+            return False
+        self.open()
+        tail = self.count() - self._sorted_count
+        return tail >= MERGE_MIN_TAIL and tail > self.count() * MERGE_TAIL_SHARE
+
+    @instrument.timed("storage.merge")
+    @_exclusive
+    def merge(self):
+        # Sorted-run merge: the tail is sorted in memory and merged with the
+        # run in one streaming pass, dropping tombstones. Record numbers
+        # change. Returns the number of records kept.
+        if self._txn:
+            raise RuntimeError(f"{self.filename}: merge() inside a transaction with changes")
+        self.open()
+        run, count = self._sorted_count, self.count()
+        end = KEY_OFFSET + self.key_size
+
+        def key(raw):
+            return raw[KEY_OFFSET:end]
+
+        tail = sorted(self._live_raw(run, count), key=key)
+        self._checkpoint()
+        self._writes += 1
+        kept = self._write_file(heapq.merge(self._live_raw(0, run), tail, key=key))
+        self.close()
+        self.open(rebuild=True)
+        return kept
+
+    def _live_raw(self, start, stop):
+        mm, size = self._mm, self.record_size
+        for recno in range(start, stop):
+            pos = self.offset(recno)
+            if mm[pos] == RECORD_ACTIVE:
+                yield mm[pos:pos + size]
+
+    @_shared
+    def find_range(self, lo, hi=None):
+        # Record numbers of live records with lo <= key < hi (no upper bound
+        # if hi is None), in key order: binary search over the sorted run,
+        # a scan of the tail (the whole file if it is not kept sorted). Keys
+        # compare as raw padded bytes.
+        self.open()
+        run = self._sorted_count if self.sorted_file is not None else 0
+        count = self.count()
+        keys = _KeyColumn(self)
+        start = bisect.bisect_left(keys, lo, 0, run)
+        stop = run if hi is None else bisect.bisect_left(keys, hi, start, run)
+        mm = self._mm
+        found = [recno for recno in range(start, stop) if mm[self.offset(recno)] == RECORD_ACTIVE]
+        tail = []
+        for recno in range(run, count):
+            if mm[self.offset(recno)] == RECORD_ACTIVE:
+                key = self.key_at(recno)
+                if lo <= key and (hi is None or key < hi):
+                    tail.append((key, recno))
+        if tail:
+            tail.sort()
+            found = [recno for _, recno in heapq.merge(((self.key_at(r), r) for r in found), tail)]
+        return found
+
+    def find_prefix(self, prefix):
+        # Record numbers of live records whose key starts with prefix, in key order
+        return self.find_range(prefix, _prefix_end(prefix))
+
+
+class _KeyColumn:
+    # The keys of a record file as a sequence, for bisect
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.count()
+
+    def __getitem__(self, recno):
+        return self.store.key_at(recno)
+
+
+def _prefix_end(prefix):
+    # Smallest byte string greater than every string starting with prefix,
+    # or None if there is none (prefix empty or all 0xff)
+    prefix = prefix.rstrip(b'\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + bytes([prefix[-1] + 1])
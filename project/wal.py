@@ -0,0 +1,175 @@
+# wal.py
+import os
+import struct
+import zlib
+import instrument
+
+# Per-data-file write-ahead log. Every change to a .dat file is appended
+# here: WRITE carries the bytes before and after, EXTEND the bytes appended
+# at the old end of file, TRUNCATE a cut back to an offset, and BASE (first
+# after a checkpoint) the size of the data file when the log was started.
+# An exclusive storage section is one transaction and ends with COMMIT,
+# fsynced before any of its WRITEs reach the data file; appends may reach it
+# earlier, and recovery cuts the file back to the size its committed
+# transactions give it. The data files themselves are only forced to disk
+# at a checkpoint, which then empties the log.
+WAL_MAGIC = b'FRW1'
+
+# Entry: kind, transaction, file offset, payload length; then payload and crc32
+ENTRY = struct.Struct('<BIQI')
+CRC = struct.Struct('<I')
+
+WRITE = 1
+EXTEND = 2
+TRUNCATE = 3
+COMMIT = 4
+BASE = 5
+
+# Checkpoint once a log grows past this many bytes
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+# fsync the log at every commit; False keeps crash atomicity for process
+# crashes only: if the machine goes down, the last commits may be lost or
+# reach the data file partly
+WAL_SYNC = True
+
+
+class WriteAheadLog:
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def _open(self):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            if os.fstat(self._fd).st_size == 0:
+                os.write(self._fd, WAL_MAGIC)
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def size(self):
+        # Bytes of entries after the magic
+        if self._fd is None and not os.path.exists(self.path):
+            return 0
+        return max(os.fstat(self._open()).st_size - len(WAL_MAGIC), 0)
+
+    def append(self, kind, txn, offset, payload=b''):
+        head = ENTRY.pack(kind, txn, offset, len(payload))
+        data = memoryview(head + payload + CRC.pack(zlib.crc32(payload, zlib.crc32(head))))
+        if instrument.enabled:
+            instrument.count("wal.bytes_written", len(data))
+        fd = self._open()
+        while data:
+            data = data[os.write(fd, data):]
+
+    def commit(self, txn):
+        # Returns once the transaction is durable; only then may its writes
+        # be applied to the data file
+        self.append(COMMIT, txn, 0)
+        if WAL_SYNC:
+            with instrument.span("wal.fsync"):
+                os.fsync(self._fd)
+
+    def reset(self):
+        # Called once the data file is durable: drop every entry
+        fd = self._open()
+        os.ftruncate(fd, len(WAL_MAGIC))
+        os.fsync(fd)
+
+    def entries(self):
+        # [(kind, txn, offset, payload)], stopping at a torn or corrupt tail
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if data[:len(WAL_MAGIC)] != WAL_MAGIC:
+            return []
+        out = []
+        pos = len(WAL_MAGIC)
+        while pos + ENTRY.size + CRC.size <= len(data):
+            kind, txn, offset, length = ENTRY.unpack_from(data, pos)
+            end = pos + ENTRY.size + length
+            if end + CRC.size > len(data):
+                break
+            payload = data[pos + ENTRY.size:end]
+            if CRC.unpack_from(data, end)[0] != zlib.crc32(payload, zlib.crc32(data[pos:pos + ENTRY.size])):
+                break
+            out.append((kind, txn, offset, payload))
+            pos = end + CRC.size
+        return out
+
+    def recover(self, data_path):
+        # Brings data_path in line with the log: committed transactions are
+        # redone in order, an unfinished one is undone and the file is cut
+        # back to its committed size (appends of an unfinished transaction
+        # may be on disk without their log entries), then the file is synced
+        # and the log emptied. Returns True if any byte changed or the log
+        # held an unfinished transaction, whose index writes are suspect.
+        entries = self.entries()
+        committed = {txn for kind, txn, _, _ in entries if kind == COMMIT}
+        size = None
+        for kind, txn, offset, payload in entries:
+            if kind == BASE:
+                size = offset
+            elif size is not None and txn in committed:
+                if kind == EXTEND:
+                    size = offset + len(payload)
+                elif kind == TRUNCATE:
+                    size = offset
+        changed = any(txn not in committed for kind, txn, _, _ in entries
+                      if kind != BASE)
+        if entries and os.path.exists(data_path):
+            with open(data_path, 'r+b') as f:
+                for kind, txn, offset, payload in entries:
+                    if txn in committed:
+                        changed |= _redo(f, kind, offset, payload)
+                for kind, txn, offset, payload in reversed(entries):
+                    if txn not in committed:
+                        changed |= _undo(f, kind, offset, payload)
+                if size is not None:
+                    changed |= _cut(f, size)
+                f.flush()
+                os.fsync(f.fileno())
+        self.reset()
+        return changed
+
+
+def _redo(f, kind, offset, payload):
+    if kind == WRITE:
+        return _restore(f, offset, payload[len(payload) // 2:])
+    if kind == EXTEND:
+        return _restore(f, offset, payload)
+    if kind == TRUNCATE:
+        return _cut(f, offset)
+    return False
+
+
+def _undo(f, kind, offset, payload):
+    if kind == WRITE:
+        return _restore(f, offset, payload[:len(payload) // 2])
+    if kind == EXTEND:
+        return _cut(f, offset)
+    # A TRUNCATE only ever cancels an EXTEND of the same transaction,
+    # which is undone on its own
+    return False
+
+
+def _restore(f, offset, data):
+    f.seek(offset)
+    if f.read(len(data)) == data:
+        return False
+    f.seek(offset)
+    f.write(data)
+    return True
+
+
+def _cut(f, size):
+    if f.seek(0, os.SEEK_END) <= size:
+        return False
+    f.truncate(size)
+    return True
+
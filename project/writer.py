@@ -0,0 +1,247 @@
+# writer.py
+import functools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager, nullcontext
+
+# Optional single-writer daemon. When FRDB_WRITER_SOCKET names the socket of
+# a running daemon (main.py serve), every function marked @mutation is sent
+# there instead of running locally. The daemon applies queued mutations from
+# all clients in batches under one exclusive lock per batch, so terminals
+# stop contending for the data files with each other.
+WRITER_SOCKET_ENV = "FRDB_WRITER_SOCKET"
+WRITER_SOCKET = "writer.sock"
+BATCH_SIZE = 256
+BATCH_WAIT = 0.002     # seconds to wait for more requests once one arrives
+
+MUTATIONS = {}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def mutation(func):
+    name = f"{func.__module__}.{func.__name__}"
+    MUTATIONS[name] = func
+
+    @functools.wraps(func)
+    def forward(*args, **kwargs):
+        client = get_client()
+        if client is None:
+            return func(*args, **kwargs)
+        return client.call(name, args, kwargs)
+
+    forward.local = func
+    return forward
+
+
+# --- Client ---
+
+class WriterError(RuntimeError):
+    pass
+
+
+# Exceptions re-raised with their own type on the client side
+ERROR_TYPES = {"ValueError": ValueError, "KeyError": KeyError}
+
+
+def register_error(cls):
+    ERROR_TYPES[cls.__name__] = cls
+    return cls
+
+
+class WriterClient:
+    def __init__(self, path):
+        self.path = path
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+        self._file = self._sock.makefile("rwb")
+
+    def close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def call(self, name, args, kwargs):
+        request = json.dumps({"op": name, "args": args, "kwargs": kwargs}, default=_encode).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                self._file.write(request)
+                self._file.flush()
+                line = self._file.readline()
+            except OSError:
+                self.close()
+                raise
+            if not line:
+                self.close()
+                raise WriterError(f"writer daemon at {self.path} closed the connection")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ERROR_TYPES.get(reply["type"], WriterError)(reply["error"])
+        return reply["result"]
+
+
+def _encode(obj):
+    # Record objects travel as the list of their field values
+    if hasattr(obj, "_fields"):
+        return list(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def get_client():
+    # None unless a daemon socket is configured; the daemon itself never forwards
+    global _client
+    path = os.environ.get(WRITER_SOCKET_ENV)
+    if not path or _serving.is_set():
+        return None
+    with _client_lock:
+        if _client is None or _client.path != path:
+            _client = WriterClient(path)
+        return _client
+
+
+# --- Daemon ---
+
+_serving = threading.Event()
+
+
+@contextmanager
+def serving():
+    # Mutations called in this process run here instead of being forwarded:
+    # this process is the writer other clients send their changes to
+    _serving.set()
+    try:
+        yield
+    finally:
+        _serving.clear()
+
+
+def apply_batch(stores, calls, batch_context=nullcontext, sync=False):
+    # Runs every (func, args, kwargs) under one exclusive lock on all the
+    # stores and one batch_context. Returns (True, result) or (False,
+    # exception) per call; a call that fails does not stop the others.
+    from locking import hold_all
+    results = []
+    with batch_context(), hold_all(stores, exclusive=True):
+        for func, args, kwargs in calls:
+            try:
+                results.append((True, func(*args, **kwargs)))
+            except Exception as e:
+                results.append((False, e))
+    # Writes reach the data files when their transaction commits
+    if sync:
+        for store in stores:
+            store.flush()
+    return results
+
+
+def _operation(name):
+    func = MUTATIONS.get(name)
+    if func is None:
+        def func(*args, **kwargs):
+            raise ValueError(f"unknown operation {name}")
+    return func
+
+
+class _Request:
+    __slots__ = ("op", "args", "kwargs", "reply", "done")
+
+    def __init__(self, op, args, kwargs):
+        self.op, self.args, self.kwargs = op, args, kwargs
+        self.reply = None
+        self.done = threading.Event()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                req = _Request(msg["op"], msg.get("args", []), msg.get("kwargs", {}))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.wfile.write(json.dumps({"error": f"bad request: {e}", "type": "ValueError"}).encode() + b"\n")
+                continue
+            self.server.pending.put(req)
+            req.done.wait()
+            self.wfile.write(json.dumps(req.reply).encode("utf-8") + b"\n")
+
+
+class WriterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # batch_context: factory for a context manager wrapped around each batch,
+    # e.g. sales.group_commit so a whole batch of orders shares one fsync
+    def __init__(self, path, stores, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT, sync=False,
+                 on_batch=None, batch_context=nullcontext):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, _Handler)
+        self.path = path
+        self.stores = stores
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.sync = sync
+        self.on_batch = on_batch
+        self.batch_context = batch_context
+        self.pending = queue.Queue()
+        self.batches = 0
+        self.applied = 0
+        self._applier = threading.Thread(target=self._apply_loop, name="writer-apply", daemon=True)
+
+    def serve_forever(self, poll_interval=0.5):
+        with serving():
+            self._applier.start()
+            try:
+                super().serve_forever(poll_interval)
+            finally:
+                self.pending.put(None)
+                self._applier.join()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _next_batch(self):
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                req = self.pending.get(timeout=self.batch_wait)
+            except queue.Empty:
+                break
+            if req is None:
+                self.pending.put(None)
+                break
+            batch.append(req)
+        return batch
+
+    def _apply_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            calls = [(_operation(req.op), req.args, req.kwargs) for req in batch]
+            results = apply_batch(self.stores, calls, self.batch_context, self.sync)
+            for req, (ok, value) in zip(batch, results):
+                req.reply = {"result": value} if ok else {"error": str(value), "type": type(value).__name__}
+            self.batches += 1
+            self.applied += len(batch)
+            for req in batch:
+                req.done.set()
+            if self.on_batch is not None:
+                self.on_batch(len(batch))